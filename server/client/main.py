@@ -4,12 +4,17 @@ import websockets
 import json
 import random
 import math
+import operator
+import time
+from collections import OrderedDict, deque
+from itertools import repeat
 
 # --- Константы ---
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 TILE_SIZE = 40
 SERVER_URI = "ws://localhost:8765" # ИСПРАВЛЕНО: URI вынесен в константу
+ROOM_ID = None # Комната на сервере; None - сервер подберет сам
 
 # Цвета (расширенная палитра для стиля)
 BLACK = (0, 0, 0)
@@ -27,22 +32,62 @@ BRICK_MORTAR_COLOR = (212, 129, 102)
 BOMB_BODY_COLOR = (20, 20, 20)
 BOMB_FUSE_COLOR = (255, 255, 0)
 EXPLOSION_COLORS = [(255, 107, 0), (255, 165, 0), (255, 208, 0)]
+MAX_PARTICLES = 4096 # Емкость пула частиц; сверх нее новые частицы не создаются
+PARTICLES_PER_CELL = 20
+MAP_CHUNK = 16 # Сторона чанка слоя карты, клеток
+MAP_CHUNK_LIMIT = 24 # Сколько чанков держать в памяти (экран занимает не больше 6)
+CAMERA_PAN_STEP = 5 # На сколько клеток наблюдатель сдвигает камеру стрелками
+FPS = 60 # Частота кадров отрисовки (не зависит от частоты сообщений сервера)
+INPUT_POLL_INTERVAL = 0.004 # Как часто опрашивать клавиатуру, секунды
+MAX_DELTA_BACKLOG = 120 # Если за кадр накопилось больше дельт, проще запросить ключевой кадр
+INTERPOLATION_DELAY = 0.1 # Другие игроки рисуются с такой задержкой, между двумя снимками
+SNAPSHOT_BUFFER = 64 # Сколько последних снимков позиций хранить для интерполяции
+SNAP_DISTANCE = 3 # Сдвиг больше стольких клеток - телепорт (новый раунд), не интерполируем
+PREDICTION_TIMEOUT = 1.0 # Неподтвержденный ход старше стольких секунд забывается (сервер без input_ack)
 READY_GREEN = (0, 200, 0)
 NOT_READY_YELLOW = (200, 200, 0)
 
 # Глобальные переменные
 game_state = {}
 my_player_id = None
+map_version = 0 # Растет, когда меняются клетки карты (ключевой кадр или дельта с tiles)
 
 # Для визуальных эффектов
 screen_shake = 0
-explosion_particles = []
-processed_explosion_coords = set() # УЛУЧШЕНИЕ: Для корректной обработки эффектов
+spectator_focus = None # Клетка в центре камеры наблюдателя; None - центр карты
+
+# --- Кэши отрисовки ---
+# Создание шрифтов, рендер текста и полупрозрачных подложек - дорогие операции,
+# а результаты почти не меняются от кадра к кадру
+FONTS = {}
+TEXT_CACHE = {}
+TEXT_CACHE_LIMIT = 256
+OVERLAYS = {}
+
+def get_font(size):
+    font = FONTS.get(size)
+    if font is None:
+        font = FONTS[size] = pygame.font.Font(None, size)
+    return font
+
+def render_text(text, size, color=WHITE):
+    key = (text, size, color)
+    surface = TEXT_CACHE.get(key)
+    if surface is None:
+        if len(TEXT_CACHE) >= TEXT_CACHE_LIMIT: TEXT_CACHE.clear()
+        surface = TEXT_CACHE[key] = get_font(size).render(text, True, color)
+    return surface
+
+def get_overlay(alpha):
+    overlay = OVERLAYS.get(alpha)
+    if overlay is None:
+        overlay = OVERLAYS[alpha] = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+        overlay.fill((0, 0, 0, alpha))
+    return overlay
 
 # --- Меню ввода имени (без изменений) ---
 def name_entry_menu(screen):
-    font_title = pygame.font.Font(None, 74)
-    font_input = pygame.font.Font(None, 50)
+    font_input = get_font(50)
     name = ""
     input_box = pygame.Rect(SCREEN_WIDTH/2 - 150, SCREEN_HEIGHT/2 - 25, 300, 50)
     clock = pygame.time.Clock()
@@ -59,7 +104,7 @@ def name_entry_menu(screen):
                     name += event.unicode
         
         screen.fill(BLACK)
-        title_surf = font_title.render("BOMBERMAN", True, WHITE)
+        title_surf = render_text("BOMBERMAN", 74)
         screen.blit(title_surf, (SCREEN_WIDTH/2 - title_surf.get_width()/2, 150))
         
         pygame.draw.rect(screen, WHITE, input_box, 2)
@@ -70,20 +115,13 @@ def name_entry_menu(screen):
             cursor_pos = input_box.x + 10 + input_surf.get_width()
             pygame.draw.line(screen, WHITE, (cursor_pos, input_box.y + 10), (cursor_pos, input_box.y + 40), 2)
 
-        prompt_font = pygame.font.Font(None, 32)
-        prompt_surf = prompt_font.render("Введите имя или оставьте пустым для наблюдения", True, LIGHT_GRAY)
+        prompt_surf = render_text("Введите имя или оставьте пустым для наблюдения", 32, LIGHT_GRAY)
         screen.blit(prompt_surf, (SCREEN_WIDTH/2 - prompt_surf.get_width()/2, SCREEN_HEIGHT/2 + 50))
 
         pygame.display.flip()
         clock.tick(60)
 
-# --- Функции процедурной отрисовки (без изменений) ---
-def draw_background(surface):
-    for y in range(0, SCREEN_HEIGHT, TILE_SIZE):
-        for x in range(0, SCREEN_WIDTH, TILE_SIZE):
-            color = GRAY if (x // TILE_SIZE + y // TILE_SIZE) % 2 == 0 else (50, 50, 50)
-            pygame.draw.rect(surface, color, (x, y, TILE_SIZE, TILE_SIZE))
-
+# --- Функции процедурной отрисовки ---
 def draw_wall(surface, rect):
     pygame.draw.rect(surface, WALL_SHADOW_COLOR, rect)
     pygame.draw.rect(surface, WALL_COLOR, rect.inflate(-4, -4))
@@ -95,6 +133,78 @@ def draw_brick(surface, rect):
     pygame.draw.line(surface, BRICK_MORTAR_COLOR, (rect.centerx, rect.top), (rect.centerx, rect.top + rect.height / 2))
     pygame.draw.line(surface, BRICK_MORTAR_COLOR, (rect.centerx, rect.bottom), (rect.centerx, rect.bottom - rect.height / 2))
 
+class MapLayer:
+    """Фон, стены и кирпичи, нарисованные заранее в поверхности-чанки.
+
+    Карта делится на чанки MAP_CHUNK x MAP_CHUNK клеток; каждый кадр на экран
+    копируются только видимые. Когда карта меняется, в видимых чанках
+    перерисовываются только клетки, отличающиеся от уже нарисованных, а давно
+    не видимые чанки выбрасываются (их не больше MAP_CHUNK_LIMIT), так что
+    память не зависит от размера карты.
+    """
+    def __init__(self):
+        self.game_map = []
+        self.size = (0, 0)
+        self.version = None
+        self.chunks = OrderedDict() # (cx, cy) -> [Surface, нарисованные клетки, версия карты]
+
+    def sync(self, game_map, version):
+        self.game_map = game_map
+        self.version = version
+        height = len(game_map)
+        size = (len(game_map[0]) if height else 0, height)
+        if size != self.size:
+            self.size = size
+            self.chunks.clear()
+
+    def draw(self, surface, origin):
+        """Рисует видимую часть карты; origin - экранные координаты клетки (0, 0)."""
+        width, height = self.size
+        chunk_px = MAP_CHUNK * TILE_SIZE
+        cx0, cy0 = max(0, -origin[0] // chunk_px), max(0, -origin[1] // chunk_px)
+        cx1 = min((width - 1) // MAP_CHUNK, (SCREEN_WIDTH - origin[0]) // chunk_px)
+        cy1 = min((height - 1) // MAP_CHUNK, (SCREEN_HEIGHT - origin[1]) // chunk_px)
+        for cy in range(cy0, cy1 + 1):
+            for cx in range(cx0, cx1 + 1):
+                surface.blit(self.chunk(cx, cy), (origin[0] + cx * chunk_px, origin[1] + cy * chunk_px))
+
+    def chunk(self, cx, cy):
+        entry = self.chunks.get((cx, cy))
+        if entry is None:
+            x0, y0 = cx * MAP_CHUNK, cy * MAP_CHUNK
+            columns = min(MAP_CHUNK, self.size[0] - x0)
+            rows = min(MAP_CHUNK, self.size[1] - y0)
+            entry = [pygame.Surface((columns * TILE_SIZE, rows * TILE_SIZE)), [[None] * columns for _ in range(rows)], None]
+            self.chunks[(cx, cy)] = entry
+            if len(self.chunks) > MAP_CHUNK_LIMIT:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end((cx, cy))
+        if entry[2] != self.version:
+            entry[2] = self.version
+            self.refresh(cx, cy, entry[0], entry[1])
+        return entry[0]
+
+    def refresh(self, cx, cy, chunk_surface, drawn_rows):
+        x0, y0 = cx * MAP_CHUNK, cy * MAP_CHUNK
+        for dy, drawn in enumerate(drawn_rows):
+            row = self.game_map[y0 + dy][x0:x0 + len(drawn)]
+            if row == drawn: continue
+            for dx, tile in enumerate(row):
+                if drawn[dx] != tile:
+                    self.draw_tile(chunk_surface, x0 + dx, y0 + dy, dx, dy, tile)
+                    drawn[dx] = tile
+
+    def draw_tile(self, chunk_surface, x, y, dx, dy, tile):
+        rect = pygame.Rect(dx * TILE_SIZE, dy * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+        chunk_surface.set_clip(rect) # Линии кирпича не должны заходить на соседние клетки
+        pygame.draw.rect(chunk_surface, GRAY if (x + y) % 2 == 0 else (50, 50, 50), rect)
+        if tile == '#': draw_wall(chunk_surface, rect)
+        elif tile == '.': draw_brick(chunk_surface, rect)
+        chunk_surface.set_clip(None)
+
+MAP_LAYER = MapLayer()
+
 def draw_player(surface, rect, is_me):
     main_color = PLAYER_MAIN_COLOR if is_me else OTHER_PLAYER_MAIN_COLOR
     head_color = PLAYER_HEAD_COLOR if is_me else OTHER_PLAYER_HEAD_COLOR
@@ -109,40 +219,98 @@ def draw_bomb(surface, rect):
         fuse_rect = pygame.Rect(rect.centerx - 2, rect.top + 2, 4, 8)
         pygame.draw.rect(surface, BOMB_FUSE_COLOR, fuse_rect)
 
-def create_explosion_particles(x, y):
-    for _ in range(20):
-        particle = {
-            'pos': [x * TILE_SIZE + TILE_SIZE / 2, y * TILE_SIZE + TILE_SIZE / 2],
-            'vel': [random.uniform(-3, 3), random.uniform(-3, 3)],
-            'lifespan': random.randint(15, 30),
-            'color': random.choice(EXPLOSION_COLORS),
-            'radius': random.uniform(2, 6)
-        }
-        explosion_particles.append(particle)
-
-def update_and_draw_particles(surface, offset):
-    for p in explosion_particles[:]:
-        p['pos'][0] += p['vel'][0]
-        p['pos'][1] += p['vel'][1]
-        p['lifespan'] -= 1
-        p['radius'] -= 0.1
-        
-        if p['lifespan'] <= 0 or p['radius'] <= 0:
-            explosion_particles.remove(p)
-        else:
-            pos = (p['pos'][0] + offset[0], p['pos'][1] + offset[1])
-            pygame.draw.circle(surface, p['color'], pos, p['radius'])
+class ParticlePool:
+    """Частицы взрывов в параллельных столбцах (по элементу на живую частицу).
+
+    Движение считается по столбцам целиком через map(), погасшая частица
+    заменяется последней (O(1)), а рисуются все одним вызовом blits()
+    из заранее нарисованных кружков.
+    """
+    def __init__(self, capacity=MAX_PARTICLES):
+        self.capacity = capacity
+        self.frame = 0
+        self.x, self.y, self.vx, self.vy, self.radius = [], [], [], [], []
+        self.death = [] # Кадр, на котором частица гаснет
+        self.sprite_rows = [] # Кружки цвета частицы: индекс - целый радиус
+        self.columns = (self.x, self.y, self.vx, self.vy, self.radius, self.death, self.sprite_rows)
+        self.sprites = None # [цвет][радиус] -> Surface, создаются при первом взрыве
+
+    @property
+    def count(self):
+        return len(self.x)
+
+    def _make_sprites(self):
+        self.sprites = []
+        for color in EXPLOSION_COLORS:
+            row = [pygame.Surface((0, 0))] # Радиус меньше 1 не рисуется
+            for radius in range(1, 7):
+                # Прозрачность по цветовому ключу копируется быстрее, чем попиксельная альфа
+                sprite = pygame.Surface((radius * 2, radius * 2))
+                sprite.set_colorkey(BLACK, pygame.RLEACCEL)
+                pygame.draw.circle(sprite, color, (radius, radius), radius)
+                row.append(sprite)
+            self.sprites.append(row)
+
+    def emit(self, x, y, amount=PARTICLES_PER_CELL):
+        """Выпускает частицы из центра клетки (x, y)."""
+        if self.sprites is None: self._make_sprites()
+        cx, cy = x * TILE_SIZE + TILE_SIZE / 2, y * TILE_SIZE + TILE_SIZE / 2
+        for _ in range(min(amount, self.capacity - len(self.x))):
+            radius = random.uniform(2, 6)
+            self.x.append(cx)
+            self.y.append(cy)
+            self.vx.append(random.uniform(-3, 3))
+            self.vy.append(random.uniform(-3, 3))
+            self.radius.append(radius)
+            # Частица гаснет, когда кончилась жизнь или радиус (он уменьшается на 0.1 за кадр)
+            self.death.append(self.frame + min(random.randint(15, 30), math.ceil(radius * 10)))
+            self.sprite_rows.append(random.choice(self.sprites))
+
+    def update(self):
+        self.frame += 1
+        # Погасших ищет list.index (без цикла Python по всем частицам)
+        death, frame, i = self.death, self.frame, 0
+        while True:
+            try:
+                i = death.index(frame, i)
+            except ValueError:
+                break
+            for column in self.columns:
+                column[i] = column[-1]
+                column.pop()
+        if not self.x: return
+        self.x[:] = map(operator.add, self.x, self.vx)
+        self.y[:] = map(operator.add, self.y, self.vy)
+        self.radius[:] = map(operator.sub, self.radius, repeat(0.1))
+
+    def draw(self, surface, offset):
+        if not self.x: return
+        radii = list(map(int, self.radius))
+        sprites = map(operator.getitem, self.sprite_rows, radii)
+        xs = map(operator.sub, self.x, radii)
+        ys = map(operator.sub, self.y, radii)
+        if offset[0] or offset[1]:
+            xs, ys = map(operator.add, xs, repeat(offset[0])), map(operator.add, ys, repeat(offset[1]))
+        surface.blits(zip(sprites, zip(xs, ys)), doreturn=False)
+
+PARTICLES = ParticlePool()
 
 # --- Основные функции отрисовки (без изменений, кроме вызова эффектов) ---
 def draw_text_overlay(screen, text, size=50):
-    font = pygame.font.Font(None, size)
-    text_surface = font.render(text, True, WHITE)
+    text_surface = render_text(text, size)
     text_rect = text_surface.get_rect(center=(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2))
-    overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-    overlay.fill((0, 0, 0, 200))
-    screen.blit(overlay, (0, 0))
+    screen.blit(get_overlay(200), (0, 0))
     screen.blit(text_surface, text_rect)
 
+def camera_position(map_size, focus):
+    """Левый верхний угол камеры в пикселях карты: focus (клетка) в центре экрана,
+    но не за краями карты. Карта меньше экрана рисуется от угла, как раньше."""
+    width, height = map_size[0] * TILE_SIZE, map_size[1] * TILE_SIZE
+    if focus is None: focus = (map_size[0] / 2, map_size[1] / 2)
+    camera_x = min(max(0, round((focus[0] + 0.5) * TILE_SIZE - SCREEN_WIDTH / 2)), max(0, width - SCREEN_WIDTH))
+    camera_y = min(max(0, round((focus[1] + 0.5) * TILE_SIZE - SCREEN_HEIGHT / 2)), max(0, height - SCREEN_HEIGHT))
+    return camera_x, camera_y
+
 def draw_game_state(screen, state):
     global screen_shake
     
@@ -152,37 +320,48 @@ def draw_game_state(screen, state):
         render_offset[0] = random.randint(-4, 4)
         render_offset[1] = random.randint(-4, 4)
 
-    draw_background(screen)
-    current_game_state = state.get("state", "WAITING")
-    name_font = pygame.font.Font(None, 20)
+    game_map = state.get("map", [])
+    MAP_LAYER.sync(game_map, map_version)
+    # Свой игрок - с предсказанными ходами, остальные - с интерполяцией между снимками
+    remote_positions = INTERPOLATOR.positions(time.monotonic() - INTERPOLATION_DELAY)
+    positions = []
+    focus = spectator_focus
+    for player in state.get("players", []):
+        if player['id'] == my_player_id:
+            x, y = PREDICTOR.position(state, player)
+            focus = (x, y) # Камера следит за своим игроком, даже погибшим
+        else:
+            x, y = remote_positions.get(player['id'], (player['x'], player['y']))
+        if player['alive']:
+            positions.append((player, x, y))
 
-    for y, row in enumerate(state.get("map", [])):
-        for x, tile in enumerate(row):
-            rect = pygame.Rect(x * TILE_SIZE + render_offset[0], y * TILE_SIZE + render_offset[1], TILE_SIZE, TILE_SIZE)
-            if tile == '#': draw_wall(screen, rect)
-            elif tile == '.': draw_brick(screen, rect)
+    camera_x, camera_y = camera_position(MAP_LAYER.size, focus)
+    origin = (render_offset[0] - camera_x, render_offset[1] - camera_y)
+
+    screen.fill(BLACK)
+    MAP_LAYER.draw(screen, origin)
+    current_game_state = state.get("state", "WAITING")
 
     for bomb in state.get("bombs", []):
-        rect = pygame.Rect(bomb['x'] * TILE_SIZE + render_offset[0], bomb['y'] * TILE_SIZE + render_offset[1], TILE_SIZE, TILE_SIZE)
+        rect = pygame.Rect(bomb['x'] * TILE_SIZE + origin[0], bomb['y'] * TILE_SIZE + origin[1], TILE_SIZE, TILE_SIZE)
         draw_bomb(screen, rect)
     
-    update_and_draw_particles(screen, render_offset)
+    PARTICLES.update()
+    PARTICLES.draw(screen, origin)
 
-    for player in state.get("players", []):
-        if player['alive']:
-            rect = pygame.Rect(player['x'] * TILE_SIZE + render_offset[0], player['y'] * TILE_SIZE + render_offset[1], TILE_SIZE, TILE_SIZE)
-            draw_player(screen, rect, player['id'] == my_player_id)
-            name_surf = name_font.render(player.get('name', ''), True, WHITE)
-            name_rect = name_surf.get_rect(center=(rect.centerx, rect.y - 10))
-            screen.blit(name_surf, name_rect)
+    for player, x, y in positions:
+        rect = pygame.Rect(round(x * TILE_SIZE) + origin[0], round(y * TILE_SIZE) + origin[1], TILE_SIZE, TILE_SIZE)
+        draw_player(screen, rect, player['id'] == my_player_id)
+        name_surf = render_text(player.get('name', ''), 20)
+        name_rect = name_surf.get_rect(center=(rect.centerx, rect.y - 10))
+        screen.blit(name_surf, name_rect)
 
     if current_game_state == "IN_PROGRESS":
         time_remaining = state.get("time_remaining")
         if time_remaining is not None:
             minutes, seconds = divmod(max(0, int(time_remaining)), 60)
             timer_text = f"{minutes:02d}:{seconds:02d}"
-            font = pygame.font.Font(None, 50)
-            text_surf = font.render(timer_text, True, WHITE)
+            text_surf = render_text(timer_text, 50)
             text_rect = text_surf.get_rect(center=(SCREEN_WIDTH/2, 30))
             pygame.draw.rect(screen, BLACK, text_rect.inflate(20, 10), border_radius=10)
             screen.blit(text_surf, text_rect)
@@ -197,15 +376,9 @@ def draw_game_state(screen, state):
     pygame.display.flip()
 
 def draw_waiting_room(screen, state):
-    overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-    overlay.fill((0, 0, 0, 220))
-    screen.blit(overlay, (0, 0))
+    screen.blit(get_overlay(220), (0, 0))
 
-    title_font = pygame.font.Font(None, 70)
-    player_font = pygame.font.Font(None, 40)
-    prompt_font = pygame.font.Font(None, 32)
-
-    title_surf = title_font.render("ЛОББИ ОЖИДАНИЯ", True, WHITE)
+    title_surf = render_text("ЛОББИ ОЖИДАНИЯ", 70)
     screen.blit(title_surf, (SCREEN_WIDTH/2 - title_surf.get_width()/2, 100))
 
     players = state.get('players', [])
@@ -217,49 +390,278 @@ def draw_waiting_room(screen, state):
         card_rect = pygame.Rect(SCREEN_WIDTH/2 - 200, 200 + i * 60, 400, 50)
         pygame.draw.rect(screen, LIGHT_GRAY, card_rect, border_radius=10)
         
-        player_surf = player_font.render(player_text, True, WHITE)
+        player_surf = render_text(player_text, 40)
         screen.blit(player_surf, (card_rect.x + 15, card_rect.centery - player_surf.get_height()/2))
         
-        status_surf = player_font.render(status, True, color)
+        status_surf = render_text(status, 40, color)
         screen.blit(status_surf, (card_rect.right - status_surf.get_width() - 15, card_rect.centery - status_surf.get_height()/2))
 
     my_player = next((p for p in players if p['id'] == my_player_id), None)
     if my_player:
         ready_text = "Нажмите [R], чтобы отменить готовность" if my_player.get('ready') else "Нажмите [R] для готовности"
-        prompt_surf = prompt_font.render(ready_text, True, WHITE)
+        prompt_surf = render_text(ready_text, 32)
         screen.blit(prompt_surf, (SCREEN_WIDTH/2 - prompt_surf.get_width()/2, SCREEN_HEIGHT - 100))
 
-# ИСПРАВЛЕНО: Полностью переработанная функция для надежной обработки эффектов
-def handle_visual_effects(new_state):
-    global screen_shake, processed_explosion_coords
-    
-    # Получаем текущие координаты взрывов из нового состояния
-    current_explosion_coords = {(e['x'], e['y']) for e in new_state.get("explosions", [])}
-    
-    # Находим взрывы, которые появились только что (которых не было в нашем списке)
-    newly_appeared_explosions = current_explosion_coords - processed_explosion_coords
-    
-    if newly_appeared_explosions:
-        for ex, ey in newly_appeared_explosions:
-            create_explosion_particles(ex, ey)
-        
-        # Запускаем тряску, только если она еще не активна
-        if screen_shake <= 0:
-            screen_shake = 15
-            
-    # Обновляем наш список обработанных взрывов
-    processed_explosion_coords = current_explosion_coords
+def handle_explosion_events(events):
+    """Пачка explosion_event с сервера: частицы в каждой клетке взрыва и тряска экрана."""
+    global screen_shake
+    for event in events:
+        for cell in event.get("payload", {}).get("cells", []):
+            PARTICLES.emit(cell['x'], cell['y'])
+    # Запускаем тряску, только если она еще не активна
+    if events and screen_shake <= 0:
+        screen_shake = 15
+
+# --- Дельта-протокол ---
+def expand_view(state):
+    """На большой карте ключевой кадр содержит только окно вокруг игрока (поле view):
+    раскладываем его в карту полного размера, чтобы дельты ложились по своим координатам.
+    Клетки вне окна не видны на экране, их заполняем пустотой."""
+    view = state.pop("view", None)
+    if view is None: return
+    game_map = [[' '] * view["map_width"] for _ in range(view["map_height"])]
+    for dy, row in enumerate(state["map"]):
+        game_map[view["y"] + dy][view["x"]:view["x"] + len(row)] = row
+    state["map"] = game_map
+
+def apply_state_delta(state, delta):
+    """Накладывает game_state_delta на последний известный game_state (на месте)."""
+    state["seq"] = delta["seq"]
+    state["time_remaining"] = delta.get("time_remaining")
+    if "state" in delta:
+        state["state"], state["winner"] = delta["state"], delta.get("winner")
+
+    game_map = state.get("map", [])
+    for x, y, tile in delta.get("tiles", []):
+        game_map[y][x] = tile
+
+    if "players" in delta or "removed_players" in delta:
+        players = {p['id']: p for p in state.get("players", [])}
+        for pid in delta.get("removed_players", []):
+            players.pop(pid, None)
+        for player in delta.get("players", []):
+            players[player['id']] = player
+        state["players"] = list(players.values())
+
+    if "bombs_added" in delta or "bombs_removed" in delta:
+        removed = {(b['x'], b['y']) for b in delta.get("bombs_removed", [])}
+        bombs = [b for b in state.get("bombs", []) if (b['x'], b['y']) not in removed]
+        state["bombs"] = bombs + delta.get("bombs_added", [])
+
+# --- Предсказание и интерполяция ---
+class MovePredictor:
+    """Предсказывает собственные ходы, не дожидаясь ответа сервера.
+
+    Каждый ход уходит с номером seq и запоминается. Сервер присылает input_ack -
+    последний примененный seq; подтвержденные ходы забываются, а остальные
+    заново применяются к авторитетной позиции из game_state по тем же правилам,
+    что и Player.move. Если сервер не согласился, позиция сама сойдется к его.
+    """
+    def __init__(self):
+        self.next_seq = 1
+        self.pending = deque() # (seq, dx, dy, время отправки)
+
+    def track(self, action):
+        """Добавляет к ходу seq и запоминает его для предсказания."""
+        action["seq"] = self.next_seq
+        self.next_seq += 1
+        self.pending.append((action["seq"], action["dx"], action["dy"], time.monotonic()))
+        return action
+
+    def acknowledge(self, seq):
+        while self.pending and self.pending[0][0] <= seq:
+            self.pending.popleft()
+
+    def position(self, state, player):
+        x, y = player['x'], player['y']
+        deadline = time.monotonic() - PREDICTION_TIMEOUT
+        while self.pending and self.pending[0][3] < deadline:
+            self.pending.popleft()
+        if state.get("state") != "IN_PROGRESS" or not player['alive']: return x, y
+        game_map = state.get("map", [])
+        for _, dx, dy, _ in self.pending:
+            new_x, new_y = x + dx, y + dy
+            if 0 <= new_y < len(game_map) and 0 <= new_x < len(game_map[new_y]) and game_map[new_y][new_x] in (' ', 'p'):
+                x, y = new_x, new_y
+        return x, y
+
+class EntityInterpolator:
+    """Позиции других игроков по последним снимкам состояния.
+
+    Рисуем их на INTERPOLATION_DELAY в прошлом, между двумя полученными
+    снимками, поэтому движение плавное даже при редких кадрах сервера.
+    """
+    def __init__(self):
+        self.snapshots = deque(maxlen=SNAPSHOT_BUFFER) # (время прихода, {id: (x, y)})
+
+    def push(self, received, players):
+        self.snapshots.append((received, {p['id']: (p['x'], p['y']) for p in players}))
+
+    def positions(self, render_time):
+        """{id: (x, y)} на момент render_time; дробные координаты - между клетками."""
+        if not self.snapshots: return {}
+        newer = None
+        for snapshot in reversed(self.snapshots):
+            if snapshot[0] <= render_time: break
+            newer = snapshot
+        else:
+            return dict(self.snapshots[0][1]) # Все снимки новее - берем самый старый
+        older_time, older = snapshot
+        if newer is None: return dict(older) # Новее нет - стоим на последнем
+        newer_time, newer = newer
+        t = (render_time - older_time) / (newer_time - older_time) if newer_time > older_time else 1
+        result = {}
+        for pid, (x1, y1) in newer.items():
+            x0, y0 = older.get(pid, (x1, y1))
+            if abs(x1 - x0) + abs(y1 - y0) > SNAP_DISTANCE:
+                result[pid] = (x1, y1)
+            else:
+                result[pid] = (x0 + (x1 - x0) * t, y0 + (y1 - y0) * t)
+        return result
+
+PREDICTOR = MovePredictor()
+INTERPOLATOR = EntityInterpolator()
 
 # --- Сетевые и игровые циклы ---
+# Сервер шлет JSON со стандартными разделителями, так что тип виден по началу строки.
+# Если формат поменяется, префиксы просто не совпадут и все сообщения будут разобраны.
+KEYFRAME_PREFIX = '{"type": "game_state",'
+DELTA_PREFIX = '{"type": "game_state_delta",'
+
+class ServerFeed:
+    """Сообщения сервера, пришедшие между кадрами.
+
+    Прием только складывает сырые строки; разбираются они перед отрисовкой кадра,
+    и только те, что влияют на картинку: кадры состояния (и ключевые, и дельты)
+    до последнего ключевого кадра в пачке не нужны вовсе. Взрывы и короткие
+    служебные сообщения (input_ack, assign_id) разбираются все.
+    """
+    def __init__(self):
+        self.pending = [] # (время прихода, сырое сообщение)
+        self.awaiting_keyframe = True
+        self.input_ack = None # input_ack, после которого еще не было кадра состояния
+
+    async def sync(self, websocket):
+        """Доводит game_state до последнего полученного; возвращает True, если что-то изменилось."""
+        global game_state, my_player_id, map_version
+        messages, self.pending = self.pending, []
+        if not messages: return False
+
+        # Последний ключевой кадр перекрывает все кадры состояния перед ним
+        base = 0
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i][1].startswith(KEYFRAME_PREFIX):
+                base = i
+                break
+        deltas = [] # (время прихода, дельта, input_ack до нее)
+        events = []
+        for i, (received, message) in enumerate(messages):
+            if i < base and (message.startswith(DELTA_PREFIX) or message.startswith(KEYFRAME_PREFIX)): continue
+            data = json.loads(message)
+            if isinstance(data, list):
+                # Взрывы приходят пачкой - JSON-массивом explosion_event
+                events.extend(data)
+            elif data.get("type") == "game_state":
+                game_state = data.get("payload", game_state)
+                expand_view(game_state)
+                self.awaiting_keyframe = False
+                map_version += 1
+                deltas.clear()
+                self.state_applied(received, self.input_ack)
+            elif data.get("type") == "game_state_delta":
+                if not self.awaiting_keyframe: deltas.append((received, data.get("payload", {}), self.input_ack))
+            elif data.get("type") == "input_ack":
+                self.input_ack = data.get("payload")
+            elif data.get("type") == "assign_id":
+                my_player_id = data.get("payload")
+        handle_explosion_events(events)
+
+        if len(deltas) > MAX_DELTA_BACKLOG:
+            # Клиент надолго отстал (окно перетаскивали, система тормозила) - догоняем снимком
+            await self.request_keyframe(websocket)
+            return bool(events)
+        for received, delta, input_ack in deltas:
+            if delta.get("seq") != game_state.get("seq", 0) + 1:
+                # Пропущен тик - база устарела, просим полный снимок
+                await self.request_keyframe(websocket)
+                break
+            apply_state_delta(game_state, delta)
+            if "tiles" in delta: map_version += 1
+            self.state_applied(received, input_ack)
+        return True
+
+    def state_applied(self, received, input_ack):
+        INTERPOLATOR.push(received, game_state.get("players", []))
+        # Подтверждение приходит перед кадром, где ввод уже учтен, - применяем его вместе с кадром
+        if input_ack is not None: PREDICTOR.acknowledge(input_ack)
+
+    async def request_keyframe(self, websocket):
+        self.awaiting_keyframe = True
+        await websocket.send(json.dumps({"type": "resync"}))
+
+FEED = ServerFeed()
+
 async def listen_to_server(websocket):
-    global game_state, my_player_id
     async for message in websocket:
-        data = json.loads(message)
-        if data.get("type") == "game_state":
-            game_state = data.get("payload", game_state)
-            handle_visual_effects(game_state) # Вызываем обновленную функцию
-        elif data.get("type") == "assign_id":
-            my_player_id = data.get("payload")
+        FEED.pending.append((time.monotonic(), message))
+
+def key_to_action(key):
+    if key == pygame.K_LEFT: return {"type": "move", "dx": -1, "dy": 0}
+    if key == pygame.K_RIGHT: return {"type": "move", "dx": 1, "dy": 0}
+    if key == pygame.K_UP: return {"type": "move", "dx": 0, "dy": -1}
+    if key == pygame.K_DOWN: return {"type": "move", "dx": 0, "dy": 1}
+    if key == pygame.K_SPACE: return {"type": "place_bomb"}
+    return None
+
+def pan_camera(key):
+    """Наблюдатель двигает камеру стрелками (на картах больше экрана)."""
+    global spectator_focus
+    action = key_to_action(key)
+    if action is None or action["type"] != "move": return
+    game_map = game_state.get("map", [])
+    if not game_map: return
+    x, y = spectator_focus or (len(game_map[0]) // 2, len(game_map) // 2)
+    spectator_focus = (min(max(0, x + action["dx"] * CAMERA_PAN_STEP), len(game_map[0]) - 1),
+                       min(max(0, y + action["dy"] * CAMERA_PAN_STEP), len(game_map) - 1))
+
+async def pump_input(websocket, role):
+    """Опрашивает клавиатуру чаще, чем рисуются кадры, и сразу отправляет действия.
+
+    Возвращается, когда окно закрыли.
+    """
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT: return
+            if role != "player" and event.type == pygame.KEYDOWN: pan_camera(event.key)
+
+            if role == "player" and event.type == pygame.KEYDOWN:
+                current_state = game_state.get('state')
+                if current_state == 'WAITING':
+                    if event.key == pygame.K_r:
+                        await websocket.send(json.dumps({"type": "ready"}))
+                elif current_state == 'IN_PROGRESS':
+                    action = key_to_action(event.key)
+                    if action:
+                        if action["type"] == "move": PREDICTOR.track(action)
+                        await websocket.send(json.dumps(action))
+        await asyncio.sleep(INPUT_POLL_INTERVAL)
+
+async def render_loop(screen, websocket):
+    """Рисует кадры по ровным часам: FPS раз в секунду, с последним состоянием."""
+    loop = asyncio.get_running_loop()
+    frame_interval = 1 / FPS
+    next_frame = loop.time()
+    while True:
+        await FEED.sync(websocket)
+        if game_state:
+            draw_game_state(screen, game_state)
+        next_frame += frame_interval
+        delay = next_frame - loop.time()
+        if delay < 0:
+            # Кадр не успели - не пытаемся догнать пропущенные, считаем от текущего момента
+            next_frame = loop.time()
+            delay = 0
+        await asyncio.sleep(delay)
 
 async def main_game_loop(screen, name, role):
     pygame.display.set_caption(f"Bomberman - {name if name else 'Наблюдатель'}")
@@ -267,38 +669,20 @@ async def main_game_loop(screen, name, role):
     try:
         # ИСПРАВЛЕНО: Используем константу
         async with websockets.connect(SERVER_URI) as websocket:
-            join_message = {"type": "join", "role": role}
+            join_message = {"type": "join", "role": role, "delta": True}
             if role == "player": join_message["name"] = name
+            if ROOM_ID: join_message["room"] = ROOM_ID
             await websocket.send(json.dumps(join_message))
             print(f"Подключено к {SERVER_URI} как {role}")
             
+            # Прием, ввод и отрисовка идут независимо: ввод не ждет кадра, кадр не ждет сети
             listen_task = asyncio.create_task(listen_to_server(websocket))
-
-            running = True
-            while running:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT: running = False
-                    
-                    if role == "player" and event.type == pygame.KEYDOWN:
-                        current_state = game_state.get('state')
-                        if current_state == 'WAITING':
-                            if event.key == pygame.K_r:
-                                await websocket.send(json.dumps({"type": "ready"}))
-                        elif current_state == 'IN_PROGRESS':
-                            action = None
-                            if event.key == pygame.K_LEFT: action = {"type": "move", "dx": -1, "dy": 0}
-                            elif event.key == pygame.K_RIGHT: action = {"type": "move", "dx": 1, "dy": 0}
-                            elif event.key == pygame.K_UP: action = {"type": "move", "dx": 0, "dy": -1}
-                            elif event.key == pygame.K_DOWN: action = {"type": "move", "dx": 0, "dy": 1}
-                            elif event.key == pygame.K_SPACE: action = {"type": "place_bomb"}
-                            if action: await websocket.send(json.dumps(action))
-                
-                if game_state:
-                    draw_game_state(screen, game_state)
-                
-                await asyncio.sleep(0.01)
-
-            listen_task.cancel()
+            render_task = asyncio.create_task(render_loop(screen, websocket))
+            try:
+                await pump_input(websocket, role)
+            finally:
+                listen_task.cancel()
+                render_task.cancel()
     except (ConnectionRefusedError, websockets.exceptions.ConnectionClosed) as e:
         print(f"Не удалось подключиться к серверу: {e}")
 
@@ -0,0 +1,114 @@
+"""Бенчмарк пропускной способности тиков.
+
+Запуск из папки server/:
+    python3 server/bench.py
+    python3 server/bench.py --ticks 20000 --synthetic 61x45,201x151 --json bench.json
+
+Для каждой карты (все из maps/ и синтетические) выполняется три прогона:
+чистый - тиков в секунду; с замерами - стоимость фаз на тик (update_bombs,
+check_win_condition, get_state, сериализация); с tracemalloc - память на тик.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from headless import HeadlessSimulation, PhaseTimer, make_synthetic_map
+from main import DeltaTracker, read_maps
+
+PHASES = ["update_bombs", "check_endgame", "spawn_random_bomb", "check_win_condition", "get_state"]
+
+def bench_throughput(maps, args):
+    sim = HeadlessSimulation(maps, players=args.players, seed=args.seed)
+    start = time.perf_counter()
+    sim.run(args.ticks)
+    elapsed = time.perf_counter() - start
+    return args.ticks / elapsed
+
+def bench_phases(maps, args):
+    sim = HeadlessSimulation(maps, players=args.players, seed=args.seed)
+    timer = PhaseTimer()
+    timer.instrument(sim.game, PHASES)
+    tracker = DeltaTracker()
+    in_progress = 0
+    for _ in range(args.ticks):
+        sim.step()
+        in_progress += sim.game.state == "IN_PROGRESS"
+        # Сериализация - как в рассылке: полный снимок и дельта
+        state = sim.game.get_state()
+        timer.measure("json_keyframe", state.to_json)
+        seq, delta = timer.measure("delta_build", tracker.build, sim.game)
+        if delta is not None:
+            timer.measure("json_delta", json.dumps, {"type": "game_state_delta", "payload": delta})
+    # Среднее на тик, мкс (фаза могла вызываться не каждый тик)
+    phases = {name: total / args.ticks / 1000 for name, total in timer.totals.items()}
+    return phases, in_progress / args.ticks
+
+def bench_allocations(maps, args):
+    sim = HeadlessSimulation(maps, players=args.players, seed=args.seed)
+    ticks = max(1, args.ticks // 10) # tracemalloc сильно замедляет, хватает и части тиков
+    peak_total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(ticks):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            sim.step()
+            sim.game.get_state().to_json()
+            _, peak = tracemalloc.get_traced_memory()
+            peak_total += peak - current
+    finally:
+        tracemalloc.stop()
+    return peak_total / ticks
+
+def run_scenario(name, maps, args):
+    result = {"map": name, "ticks_per_sec": bench_throughput(maps, args)}
+    result["phases_us"], result["in_progress_share"] = bench_phases(maps, args)
+    if not args.no_alloc:
+        result["alloc_bytes_per_tick"] = bench_allocations(maps, args)
+    return result
+
+def print_result(result):
+    phases = ", ".join(f"{name} {us:.1f}" for name, us in result["phases_us"].items())
+    line = (f"{result['map']:<22} {result['ticks_per_sec']:>10.0f} тиков/с "
+            f"(в игре {result['in_progress_share']:.0%}) | мкс/тик: {phases}")
+    if "alloc_bytes_per_tick" in result:
+        line += f" | пик памяти/тик: {result['alloc_bytes_per_tick'] / 1024:.1f} КБ"
+    print(line)
+
+def parse_sizes(value):
+    sizes = []
+    for item in filter(None, value.split(",")):
+        width, height = item.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк игрового цикла без сети")
+    parser.add_argument("--ticks", type=int, default=5000, help="тиков на прогон")
+    parser.add_argument("--players", type=int, default=4, help="игроков в матче")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--maps-dir", default="maps")
+    parser.add_argument("--synthetic", default="61x45,201x151", help="размеры синтетических карт через запятую")
+    parser.add_argument("--no-alloc", action="store_true", help="не замерять память (tracemalloc)")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    scenarios = [(name, {name: descriptor}) for name, descriptor in read_maps(args.maps_dir).items()]
+    for width, height in parse_sizes(args.synthetic):
+        descriptor = make_synthetic_map(width, height, players=args.players, seed=args.seed)
+        scenarios.append((descriptor.name, {descriptor.name: descriptor}))
+
+    results = []
+    for name, maps in scenarios:
+        result = run_scenario(name, maps, args)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"ticks": args.ticks, "players": args.players, "seed": args.seed, "results": results}, f, indent=2)
+        print(f"Результаты сохранены в {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""Серверные боты: добирают игроков в неполные комнаты и играют матчи без клиентов.
+
+Бот - обычный Player в Game. Он действует через ту же очередь ввода, что и
+клиенты (queue_input -> handle_input в начале тика), поэтому матчи с ботами
+записываются в повторы и воспроизводятся как обычные.
+
+Чтобы сотни матчей с ботами помещались на одно ядро, тяжелая работа делается
+один раз на комнату, а не на бота:
+- карта опасности (DangerMap) - тик взрыва для каждой клетки под лучами бомб;
+  пересчитывается, только когда меняются бомбы или карта;
+- поле до кирпичей (один BFS сразу от всех клеток рядом с кирпичами) -
+  каждый бот просто шагает в соседнюю клетку с меньшим расстоянием;
+  пересчитывается только при изменении карты.
+На бота остаются короткий BFS к укрытию и проверка соседних клеток.
+Боты думают раз в BOT_THINK_INTERVAL тиков - примерно с частотой нажатий
+живого игрока.
+
+Прогон матчей только из ботов без сети (из папки server/):
+    python3 server/bots.py --matches 300 --seconds 30
+"""
+import argparse
+import itertools
+import random
+import time
+import uuid
+from collections import deque
+
+BOT_THINK_INTERVAL = 10 # Тиков между решениями бота (6 ходов в секунду)
+ESCAPE_DEPTH = 8 # Дальше стольких шагов бот укрытие не ищет
+BOT_MISTAKE_CHANCE = 0.15 # Доля решений, в которых бот ходит наугад, не глядя на бомбы (иначе боты не погибают)
+BOT_NAMES = ["Бот Вася", "Бот Петя", "Бот Маша", "Бот Глаша", "Бот Федя", "Бот Нюра", "Бот Гоша", "Бот Зина"]
+BOT_COLORS = [{"red": 0.6, "green": 0.6, "blue": 0.6}, {"red": 0.4, "green": 0.7, "blue": 0.9},
+              {"red": 0.9, "green": 0.6, "blue": 0.3}, {"red": 0.7, "green": 0.5, "blue": 0.9}]
+
+WALKABLE_TILES = b' p' # Как в Player.move; клетки - байты Game.tiles
+BRICK_TILE = ord('.')
+UNREACHABLE = 1 << 30
+
+class Grid:
+    """Проходимость карты в плоском списке с рамкой из непроходимых клеток.
+
+    Клетка (x, y) лежит по индексу (y + 1) * stride + x + 1, соседи - i +- 1 и
+    i +- stride, и рамка избавляет BFS от проверок границ.
+    Пересоздается, только когда меняется карта (новый матч или взорван кирпич).
+    """
+    def __init__(self, game):
+        width, height = game.map_info.width, game.map_info.height
+        self.stride = width + 2
+        self.walkable = walkable = [False] * (self.stride * (height + 2))
+        self.brick = brick = [False] * len(walkable)
+        tiles = game.tiles
+        for y in range(height):
+            base, row_start = (y + 1) * self.stride + 1, y * width
+            for x in range(width):
+                tile = tiles[row_start + x]
+                if tile in WALKABLE_TILES:
+                    walkable[base + x] = True
+                elif tile == BRICK_TILE:
+                    brick[base + x] = True
+        self.offsets = (1, -1, self.stride, -self.stride)
+        self.brick_distance = self._distance_to_bricks()
+
+    def index(self, x, y):
+        return (y + 1) * self.stride + x + 1
+
+    def position(self, i):
+        y, x = divmod(i, self.stride)
+        return x - 1, y - 1
+
+    def delta(self, i, j):
+        """(dx, dy) шага из клетки i в соседнюю j."""
+        step = j - i
+        if step in (1, -1): return step, 0
+        return 0, 1 if step > 0 else -1
+
+    def _distance_to_bricks(self):
+        """Один BFS для всех ботов: шагов до ближайшей клетки, откуда бомба достанет кирпич."""
+        walkable, brick, offsets = self.walkable, self.brick, self.offsets
+        distance = [UNREACHABLE] * len(walkable)
+        frontier = deque()
+        for i, is_walkable in enumerate(walkable):
+            if is_walkable and (brick[i + 1] or brick[i - 1] or brick[i + self.stride] or brick[i - self.stride]):
+                distance[i] = 0
+                frontier.append(i)
+        while frontier:
+            i = frontier.popleft()
+            next_distance = distance[i] + 1
+            for offset in offsets:
+                j = i + offset
+                if walkable[j] and distance[j] > next_distance:
+                    distance[j] = next_distance
+                    frontier.append(j)
+        return distance
+
+class DangerMap:
+    """Для каждой клетки под лучом бомбы - ближайший тик взрыва (индекс Grid -> тик).
+
+    Считается одна на комнату: все боты читают одну и ту же карту.
+    """
+    def __init__(self):
+        self.key = None
+        self.explode_at = {}
+
+    def update(self, game, grid):
+        key = (id(grid), tuple(game.bombs))
+        if key == self.key: return
+        self.key = key
+        explode_at = self.explode_at = {}
+        for bomb in game.bombs.values():
+            for x, y in game.blast_cells(bomb.x, bomb.y):
+                i = grid.index(x, y)
+                if explode_at.get(i, UNREACHABLE) > bomb.explode_tick:
+                    explode_at[i] = bomb.explode_tick
+
+class BotController:
+    """Боты одной комнаты: добавляет и убирает их и каждый тик ставит их ввод в очередь.
+
+    persistent - комната держится ботами и без клиентов (прогоны на сервере).
+    """
+    def __init__(self, game, persistent=False, rng=None):
+        self.game = game
+        self.persistent = persistent
+        self.rng = rng if rng is not None else random.Random()
+        self.players = {} # id -> Player
+        self.phase = self.rng.randrange(BOT_THINK_INTERVAL) # Комнаты думают в разные тики, а не все разом
+        self.grid, self.grid_key = None, None
+        self.danger = DangerMap()
+        self.names = itertools.cycle(BOT_NAMES)
+
+    def add(self):
+        """Добавляет бота; None, если в комнате нет места."""
+        player_id = str(uuid.UUID(int=self.rng.getrandbits(128)))
+        player = self.game.add_player(player_id, next(self.names), color=self.rng.choice(BOT_COLORS))
+        if player is not None:
+            self.players[player_id] = player
+        return player
+
+    def fill(self, count):
+        """Добирает ботов, пока в комнате не станет count игроков (или не кончатся места)."""
+        while len(self.game.players) < count and self.add() is not None:
+            pass
+
+    def remove(self, player_id=None):
+        if not self.players: return
+        if player_id is None:
+            player_id = next(reversed(self.players))
+        del self.players[player_id]
+        self.game.remove_player(player_id)
+
+    def remove_all(self):
+        for player_id in list(self.players):
+            self.remove(player_id)
+
+    def yield_seat(self):
+        """Освобождает место живому игроку, если комната занята ботами целиком."""
+        game = self.game
+        if self.players and len(game.players) >= game.map_info.capacity:
+            self.remove()
+
+    # --- Решения ---
+    def think(self):
+        """Ставит в очередь ввод ботов на следующий тик."""
+        game = self.game
+        if not self.players or (game.tick + self.phase) % BOT_THINK_INTERVAL: return
+        if game.state == "WAITING":
+            for player in self.players.values():
+                if not player.ready and player.id not in game.pending_inputs:
+                    game.queue_input(player.id, {"type": "ready"})
+            return
+        if game.state != "IN_PROGRESS": return
+
+        grid_key = (id(game.tiles), game.bricks_left)
+        if grid_key != self.grid_key:
+            self.grid, self.grid_key = Grid(game), grid_key
+        self.danger.update(game, self.grid)
+        for player in self.players.values():
+            if player.alive:
+                action = self.decide(player)
+                if action is not None:
+                    game.queue_input(player.id, action)
+
+    def decide(self, player):
+        game, grid, explode_at = self.game, self.grid, self.danger.explode_at
+        here = grid.index(player.x, player.y)
+        # В эндгейме боты ошибаются вдвое чаще, чтобы матч заканчивался, как и задумано
+        if self.rng.random() < BOT_MISTAKE_CHANCE * (2 if game.endgame_mode else 1):
+            steps = [here + offset for offset in grid.offsets if grid.walkable[here + offset]]
+            return self._move_to(here, self.rng.choice(steps)) if steps else None
+        if here in explode_at:
+            return self._move_to(here, self._escape_step(here, ()))
+
+        if not game.is_bomb_at(player.x, player.y) and self._worth_bombing(player, here):
+            # Бомба ставится, только если от нее есть куда уйти
+            if self._escape_step(here, {grid.index(x, y) for x, y in game.blast_cells(player.x, player.y)}) is not None:
+                return {"type": "place_bomb"}
+
+        # Соседние клетки без опасности; ближе к кирпичам, а если их не достать - к другим игрокам
+        steps = [here + offset for offset in grid.offsets if grid.walkable[here + offset] and here + offset not in explode_at]
+        if not steps: return None
+        distance = grid.brick_distance
+        if distance[here] < UNREACHABLE:
+            best = min(distance[j] for j in steps)
+            if best >= distance[here] and self.rng.random() < 0.7: return None
+            return self._move_to(here, self.rng.choice([j for j in steps if distance[j] == best]))
+        target = self._nearest_enemy(player)
+        if target is not None and abs(target.x - player.x) + abs(target.y - player.y) > 1:
+            def remaining(j):
+                x, y = grid.position(j)
+                return abs(target.x - x) + abs(target.y - y) + self.rng.random()
+            return self._move_to(here, min(steps, key=remaining))
+        return self._move_to(here, self.rng.choice(steps))
+
+    def _worth_bombing(self, player, here):
+        """Рядом кирпич или под лучом будущей бомбы стоит другой игрок."""
+        grid = self.grid
+        if any(grid.brick[here + offset] for offset in grid.offsets):
+            return True
+        cells = set(self.game.blast_cells(player.x, player.y))
+        return any(other is not player and other.alive and (other.x, other.y) in cells for other in self.game.players.values())
+
+    def _nearest_enemy(self, player):
+        enemies = [p for p in self.game.players.values() if p is not player and p.alive]
+        return min(enemies, key=lambda p: abs(p.x - player.x) + abs(p.y - player.y), default=None)
+
+    def _escape_step(self, start, extra_danger):
+        """Первый шаг кратчайшего пути к клетке без опасности (BFS не дальше ESCAPE_DEPTH).
+
+        Клетки по пути должны взорваться позже, чем бот через них пройдет.
+        None - укрытия нет или бот уже в нем.
+        """
+        grid, explode_at, now = self.grid, self.danger.explode_at, self.game.tick
+        walkable, offsets = grid.walkable, grid.offsets
+        first_step = {start: None}
+        frontier = deque([(start, 0)])
+        while frontier:
+            i, depth = frontier.popleft()
+            if i not in explode_at and i not in extra_danger:
+                return first_step[i]
+            if depth >= ESCAPE_DEPTH: continue
+            arrival = now + (depth + 1) * BOT_THINK_INTERVAL
+            for offset in offsets:
+                j = i + offset
+                if walkable[j] and j not in first_step and explode_at.get(j, UNREACHABLE) > arrival:
+                    first_step[j] = j if i == start else first_step[i]
+                    frontier.append((j, depth + 1))
+        return None
+
+    def _move_to(self, here, target):
+        if target is None: return None
+        dx, dy = self.grid.delta(here, target)
+        return {"type": "move", "dx": dx, "dy": dy}
+
+# --- Прогон без сети ---
+def run_matches(game_class, maps, matches, seconds, players, seed):
+    """Шагает matches игр только с ботами, сколько успеет за seconds секунд.
+
+    Возвращает (тиков комнат в секунду, сыграно матчей).
+    """
+    rng = random.Random(seed)
+    rooms = []
+    for _ in range(matches):
+        game = game_class(maps=maps, rng=random.Random(rng.getrandbits(32)))
+        controller = BotController(game, persistent=True, rng=random.Random(rng.getrandbits(32)))
+        controller.fill(players)
+        rooms.append(controller)
+    finished, room_ticks = 0, 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for controller in rooms:
+            state = controller.game.state
+            controller.think()
+            controller.game.update()
+            finished += state == "GAME_OVER" and controller.game.state == "WAITING"
+        room_ticks += len(rooms)
+    return room_ticks / (time.perf_counter() - start), finished
+
+def main():
+    import main as server # Как в replay.py: код сервера подгружается только для прогона
+
+    parser = argparse.ArgumentParser(description="Матчи только из ботов без сети")
+    parser.add_argument("--matches", type=int, default=100, help="одновременных матчей")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--players", type=int, default=4, help="ботов в матче")
+    parser.add_argument("--maps-dir", default="maps")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server.log.disabled = True # Выбор карты и начало матча логируются в каждой комнате
+    maps = server.read_maps(args.maps_dir)
+    rate, finished = run_matches(server.Game, maps, args.matches, args.seconds, args.players, args.seed)
+    realtime = 1 / server.GAME_TICK_RATE
+    print(f"{args.matches} матчей: {rate:.0f} тиков комнат в секунду, сыграно {finished} матчей")
+    print(f"Одно ядро тянет около {rate / realtime:.0f} матчей с ботами в реальном времени ({realtime:.0f} Гц)")
+
+if __name__ == "__main__":
+    main()
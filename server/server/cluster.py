@@ -0,0 +1,447 @@
+"""Несколько игровых процессов за одним фронтендом-матчмейкером.
+
+Запуск из папки server/:
+    python3 server/cluster.py                # по воркеру на ядро
+    python3 server/cluster.py --workers 4
+
+Фронтенд принимает websocket-подключения на обычном порту, читает join и выбирает
+клиенту воркер и комнату: комнату с запрошенным id там, где она уже есть, иначе
+самую заполненную из открытых (как get_or_create_room), а новую комнату - на
+наименее загруженном воркере. Затем сокет клиента передается воркеру (SCM_RIGHTS
+по unix-сокету) вместе с прочитанным join, и фронтенд в соединении больше не
+участвует. Каждый воркер - обычный игровой цикл main.py со своими комнатами;
+раз в REPORT_INTERVAL он присылает фронтенду список комнат и загрузку цикла
+(частями, если комнат так много, что одно сообщение их не вместит).
+
+Метрики фронтенда - на METRICS_PORT, воркера i - на METRICS_PORT + 1 + i (там же
+его профайлер). Рукопожатие фронтенд проводит без сжатия permessage-deflate:
+состояние сжатия нельзя передать в другой процесс.
+"""
+import argparse
+import asyncio
+import errno
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+
+import websockets
+from websockets.asyncio.messages import Assembler
+from websockets.asyncio.server import ServerConnection
+from websockets.datastructures import Headers
+from websockets.http11 import Request
+from websockets.protocol import State
+from websockets.server import ServerProtocol
+
+import main
+import metrics
+
+log = logging.getLogger("bomberman.cluster")
+
+REPORT_INTERVAL = 0.5 # Как часто воркер сообщает о своих комнатах, секунды
+PLACEMENT_TTL = 2 # Сколько секунд помнить новую комнату, о которой воркер еще не сообщил
+RESTART_DELAY = 1 # Пауза перед перезапуском упавшего воркера, секунды
+CONTROL_BUFFER = 65536 # Максимальный размер сообщения управляющего канала
+REPORT_CHUNK_BYTES = CONTROL_BUFFER // 2 # Комнаты отчета делятся на сообщения не больше этого размера
+
+def check_handoff_support():
+    """Передача соединения (hand_off/adopt) опирается на внутренности websockets, которые
+    не входят в его API. Если их нет - кластер падает при запуске, а не теряет клиентов молча.
+    Проверенные версии - в requirements.txt. Вызывается внутри цикла событий."""
+    missing = []
+    protocol = ServerProtocol()
+    if not isinstance(getattr(getattr(protocol, "reader", None), "buffer", None), bytearray):
+        missing.append("ServerProtocol.reader.buffer")
+    for name in ("parser", "parse", "state"):
+        if not hasattr(protocol, name):
+            missing.append(f"ServerProtocol.{name}")
+    if not hasattr(getattr(Assembler(), "frames", None), "queue"):
+        missing.append("Assembler.frames.queue")
+    if missing:
+        log.critical("КРИТИЧЕСКАЯ ОШИБКА: websockets %s не подходит для кластера - нет %s. Установите версию из requirements.txt.",
+                     websockets.__version__, ", ".join(missing))
+        exit(1)
+
+def _encode_control(payload):
+    """Сообщение управляющего канала. Больше CONTROL_BUFFER получатель прочитал бы
+    обрезанным, поэтому такое не отправляется: OSError(EMSGSIZE), как и прочие ошибки сокета."""
+    data = json.dumps(payload).encode("utf-8")
+    if len(data) > CONTROL_BUFFER:
+        raise OSError(errno.EMSGSIZE, f"Сообщение управляющего канала больше {CONTROL_BUFFER} байт: {len(data)}")
+    return data
+
+def _send_control(control, payload, fds=()):
+    """Одно сообщение управляющего канала (SOCK_SEQPACKET сохраняет границы сообщений)."""
+    socket.send_fds(control, [_encode_control(payload)], list(fds))
+
+def _read_control(data, flags):
+    """Разбирает принятое сообщение; обрезанное или испорченное - None."""
+    if flags & socket.MSG_TRUNC:
+        log.warning("Сообщение управляющего канала обрезано (больше %d байт), пропущено.", CONTROL_BUFFER)
+        return None
+    try:
+        return json.loads(data)
+    except ValueError as e:
+        log.warning("Не удалось разобрать сообщение управляющего канала: %s", e)
+        return None
+
+# --- Воркер ---
+class _Handoff:
+    """Заменяет websockets Server для соединения, рукопожатие которого провел фронтенд.
+
+    ServerConnection, подключившись, запускает server.handler(connection) - здесь
+    это обслуживание клиента с уже прочитанным join.
+    """
+    def __init__(self, message, room_hint):
+        self.message, self.room_hint = message, room_hint
+        self.handler_tasks = set()
+
+    async def handler(self, connection):
+        connection.start_keepalive()
+        try:
+            async with connection:
+                await main.serve_client(connection, self.message, self.room_hint)
+        except Exception:
+            log.exception("Ошибка обработки клиента")
+        finally:
+            self.handler_tasks.discard(asyncio.current_task())
+
+class Worker:
+    def __init__(self, index, control):
+        self.index = index
+        self.control = control
+        self.stopped = None
+        self.last_report = (time.monotonic(), main.TICK_DURATION.sum)
+        self.report_number = 0 # Номер отчета: по нему фронтенд собирает части одного отчета
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopped = loop.create_future()
+        check_handoff_support()
+        self.control.setblocking(False)
+        loop.add_reader(self.control.fileno(), self.on_control)
+        await metrics.serve_metrics(main.METRICS, main.METRICS_HOST, main.METRICS_PORT + 1 + self.index, main.PROFILER.routes())
+        game = asyncio.create_task(main.game_loop())
+        reports = asyncio.create_task(self.report_loop())
+        log.info("Воркер запущен (pid %d).", os.getpid())
+        try:
+            await self.stopped
+        finally:
+            loop.remove_reader(self.control.fileno())
+            game.cancel()
+            reports.cancel()
+
+    def on_control(self):
+        while True:
+            try:
+                data, fds, flags, _ = socket.recv_fds(self.control, CONTROL_BUFFER, 1)
+            except BlockingIOError:
+                return
+            if not data:
+                log.warning("Фронтенд закрыл управляющий канал, воркер завершается.")
+                if not self.stopped.done(): self.stopped.set_result(None)
+                return
+            handoff = _read_control(data, flags)
+            if handoff is None:
+                for fd in fds: os.close(fd)
+            elif fds:
+                asyncio.create_task(self.adopt(socket.socket(fileno=fds[0]), handoff))
+
+    async def adopt(self, sock, handoff):
+        """Подхватывает websocket, открытый фронтендом, как будто рукопожатие было здесь."""
+        protocol = ServerProtocol()
+        protocol.state = State.OPEN
+        # Парсер, созданный в состоянии CONNECTING, ждет HTTP-запрос - запускаем заново для кадров
+        protocol.parser = protocol.parse()
+        next(protocol.parser)
+        connection = ServerConnection(protocol, _Handoff(handoff["message"], handoff["room"]))
+        connection.request = Request(handoff["path"], Headers(handoff["headers"]))
+        try:
+            await asyncio.get_running_loop().connect_accepted_socket(lambda: connection, sock)
+        except OSError as e:
+            log.info("Переданное соединение уже закрыто: %s", e)
+            sock.close()
+            return
+        if handoff["leftover"]:
+            # Байты, которые фронтенд успел прочитать после join
+            connection.data_received(handoff["leftover"].encode("latin-1"))
+
+    async def report_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # Части отчета могут не влезть в буфер сокета разом - ждем, пока фронтенд их прочитает
+                for part in self.load_report():
+                    await loop.sock_sendall(self.control, _encode_control(part))
+            except OSError as e:
+                log.warning("Не удалось отправить отчет фронтенду: %s", e)
+            await asyncio.sleep(REPORT_INTERVAL)
+
+    def load_report(self):
+        """Отчет о загрузке - список сообщений: комнаты делятся на части не больше
+        REPORT_CHUNK_BYTES, фронтенд применяет отчет, получив часть с last."""
+        now, busy_total = time.monotonic(), main.TICK_DURATION.sum
+        last_time, last_busy = self.last_report
+        self.last_report = (now, busy_total)
+        self.report_number += 1
+        chunks, chunk, size = [], [], 0
+        for room in main.ROOMS.values():
+            entry = {"id": room.id, "players": len(room.game.players), "capacity": room.game.map_info.capacity,
+                     "joinable": room.can_accept_player(), "spectators": len(room.spectator_clients)}
+            entry_size = len(json.dumps(entry)) + 2
+            if entry_size > REPORT_CHUNK_BYTES:
+                continue # id комнаты задает клиент; такой не влезет ни в одно сообщение
+            if size + entry_size > REPORT_CHUNK_BYTES:
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(entry)
+            size += entry_size
+        chunks.append(chunk)
+        # Доля времени, которую цикл провел в тиках, - загрузка ядра воркера
+        busy = (busy_total - last_busy) / max(now - last_time, 1e-6)
+        return [{"type": "load", "report": self.report_number, "last": i == len(chunks) - 1, "busy": busy, "rooms": rooms}
+                for i, rooms in enumerate(chunks)]
+
+def run_worker(index, control):
+    """Точка входа процесса-воркера."""
+    log_listener = main.setup_logging(prefix=f"[воркер {index}] ")
+    try:
+        main.load_maps(main.MAPS_DIR)
+        asyncio.run(Worker(index, control).run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for room in main.ROOMS.values():
+            room.close()
+        log_listener.stop()
+
+# --- Фронтенд ---
+class WorkerHandle:
+    """Воркер глазами фронтенда: процесс, управляющий канал и последний отчет."""
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.control = None
+        self.rooms = {} # id -> сведения о комнате из отчета (число игроков правится при передаче)
+        self.partial_report = None # (номер, комнаты) отчета, пришедшего еще не целиком
+        self.busy = 0.0
+        self.handed_off = 0 # Клиентов, переданных после последнего отчета
+        self.handoffs_total = 0
+
+    @property
+    def alive(self):
+        return self.control is not None
+
+    def start(self, context):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.process = context.Process(target=run_worker, args=(self.index, child), name=f"bomberman-worker-{self.index}", daemon=True)
+        self.process.start()
+        child.close()
+        parent.setblocking(False)
+        self.control = parent
+        self.rooms, self.partial_report, self.busy, self.handed_off = {}, None, 0.0, 0
+
+    def players(self):
+        return sum(room["players"] for room in self.rooms.values()) + self.handed_off
+
+class Frontend:
+    def __init__(self, workers):
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = [WorkerHandle(index) for index in range(workers)]
+        self.pending_rooms = {} # id новой комнаты -> (воркер, сведения, время создания)
+        # Карту новой комнаты выбирает воркер, поэтому до его отчета считаем, что она самая тесная
+        self.min_capacity = min(descriptor.capacity for descriptor in main.AVAILABLE_MAPS.values())
+        self.registry = metrics.MetricsRegistry()
+        self.handoffs = self.registry.counter("bomberman_cluster_handoffs_total", "Клиентов, переданных воркерам")
+        self.rejected = self.registry.counter("bomberman_cluster_rejected_total", "Клиентов, которых не удалось передать")
+        self.registry.add_collector(self.collect_metrics)
+
+    async def run(self, host, port):
+        loop = asyncio.get_running_loop()
+        check_handoff_support()
+        for worker in self.workers:
+            self.start_worker(worker)
+        await metrics.serve_metrics(self.registry, main.METRICS_HOST, main.METRICS_PORT)
+        async with websockets.serve(self.handle, host, port, compression=None):
+            log.info("Фронтенд на ws://%s:%s, воркеров: %d", host, port, len(self.workers))
+            await loop.create_future()
+
+    def start_worker(self, worker):
+        worker.start(self.context)
+        asyncio.get_running_loop().add_reader(worker.control.fileno(), self.on_report, worker)
+        log.info("Воркер %d запущен (pid %d).", worker.index, worker.process.pid)
+
+    def on_report(self, worker):
+        while True:
+            try:
+                data, _, flags, _ = worker.control.recvmsg(CONTROL_BUFFER)
+            except BlockingIOError:
+                return
+            except OSError:
+                data = b""
+            if not data:
+                self.worker_lost(worker)
+                return
+            report = _read_control(data, flags)
+            if report is None:
+                worker.partial_report = None
+                continue
+            # Части одного отчета идут подряд; часть другого отчета значит, что прошлый оборвался
+            number = report["report"]
+            if worker.partial_report is None or worker.partial_report[0] != number:
+                worker.partial_report = (number, {})
+            rooms = worker.partial_report[1]
+            rooms.update((room["id"], room) for room in report["rooms"])
+            if report["last"]:
+                worker.busy = report["busy"]
+                worker.rooms = rooms
+                worker.partial_report = None
+                worker.handed_off = 0
+
+    def worker_lost(self, worker):
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(worker.control.fileno())
+        worker.control.close()
+        worker.control = None
+        worker.process.join(timeout=1)
+        log.error("Воркер %d завершился (код %s), его комнаты потеряны; перезапуск через %s сек.",
+                  worker.index, worker.process.exitcode, RESTART_DELAY)
+        loop.call_later(RESTART_DELAY, self.start_worker, worker)
+
+    # --- Размещение ---
+    def alive_workers(self):
+        return [worker for worker in self.workers if worker.alive]
+
+    def least_loaded(self):
+        # Загрузка цикла сравнивается грубо (шагами по 5%), при равной - по числу игроков
+        return min(self.alive_workers(), key=lambda w: (round(w.busy * 20), w.players(), len(w.rooms)), default=None)
+
+    def known_rooms(self):
+        """(воркер, сведения) всех комнат: из отчетов и еще не подтвержденных новых."""
+        now = time.monotonic()
+        reported = set()
+        for worker in self.alive_workers():
+            for room in worker.rooms.values():
+                reported.add(room["id"])
+                yield worker, room
+        for room_id, (worker, room, created) in list(self.pending_rooms.items()):
+            if room_id in reported or now - created > PLACEMENT_TTL or not worker.alive:
+                del self.pending_rooms[room_id]
+            else:
+                yield worker, room
+
+    def place(self, data):
+        """Воркер и комната для join. Комната None - воркер подберет сам."""
+        role = data.get("role", "player")
+        requested = data.get("room") or None
+        rooms = list(self.known_rooms())
+        if requested:
+            worker, room = next(((w, room) for w, room in rooms if room["id"] == requested), (None, None))
+            if worker is None:
+                worker = self.least_loaded()
+                if worker is None: return None, None
+                room = self.remember_room(worker, requested)
+            hint = None # Комнату назвал сам клиент
+        else:
+            if role == "player":
+                rooms = [(w, room) for w, room in rooms if room["joinable"]]
+            if rooms:
+                # Как get_or_create_room: самая заполненная комната, чтобы матчи быстрее набирались
+                worker, room = max(rooms, key=lambda item: item[1]["players"])
+            else:
+                worker = self.least_loaded()
+                if worker is None: return None, None
+                room = self.remember_room(worker, uuid.uuid4().hex[:8])
+            hint = room["id"]
+        # Игрок занимает место и в названной комнате, иначе до отчета воркера
+        # матчмейкер отправлял бы в нее лишних игроков
+        if role == "player":
+            room["players"] += 1
+            if room["players"] >= room["capacity"]:
+                room["joinable"] = False
+        return worker, hint
+
+    def remember_room(self, worker, room_id):
+        room = {"id": room_id, "players": 0, "capacity": self.min_capacity, "joinable": True, "spectators": 0}
+        self.pending_rooms[room_id] = (worker, room, time.monotonic())
+        return room
+
+    # --- Подключения ---
+    async def handle(self, websocket):
+        try:
+            message = await websocket.recv()
+            data = json.loads(message)
+        except (websockets.exceptions.ConnectionClosed, json.JSONDecodeError, UnicodeDecodeError):
+            return
+        if not isinstance(data, dict) or data.get("type") != "join": return
+        if data.get("room") and not main.is_valid_room_id(data["room"]):
+            self.rejected.inc()
+            await websocket.close(code=1008, reason="Invalid room id")
+            return
+
+        worker, room_hint = self.place(data)
+        if worker is None:
+            self.rejected.inc()
+            await websocket.close(code=1013, reason="No game workers")
+            return
+        try:
+            self.hand_off(websocket, worker, message, room_hint)
+        except OSError as e:
+            log.warning("Не удалось передать клиента воркеру %d: %s", worker.index, e)
+            self.rejected.inc()
+            await websocket.close(code=1013, reason="Try again later")
+            return
+        worker.handed_off += 1
+        worker.handoffs_total += 1
+        self.handoffs.inc()
+
+    def hand_off(self, websocket, worker, message, room_hint):
+        # Кадры, которые клиент успел прислать после join, уже разобраны здесь -
+        # кодируем их обратно (как от клиента, с маской) вместе с недочитанными байтами
+        leftover = b"".join(frame.serialize(mask=True) for frame in websocket.recv_messages.frames.queue)
+        leftover += bytes(websocket.protocol.reader.buffer)
+        handoff = {"message": message if isinstance(message, str) else message.decode("utf-8"), "room": room_hint,
+                   "path": websocket.request.path, "headers": list(websocket.request.headers.raw_items()),
+                   "leftover": leftover.decode("latin-1")}
+        transport = websocket.transport
+        fd = os.dup(transport.get_extra_info("socket").fileno())
+        try:
+            _send_control(worker.control, handoff, [fd])
+        finally:
+            os.close(fd)
+        # Закрываем свою копию сокета без закрывающего рукопожатия - соединение живет у воркера
+        transport.abort()
+
+    def collect_metrics(self):
+        workers = self.workers
+        return [
+            ("bomberman_cluster_worker_up", "gauge", "Воркер работает (1) или перезапускается (0)",
+             [({"worker": w.index}, int(w.alive)) for w in workers]),
+            ("bomberman_cluster_worker_busy", "gauge", "Доля времени цикла воркера, занятая тиками (из отчета)",
+             [({"worker": w.index}, w.busy) for w in workers]),
+            ("bomberman_cluster_worker_rooms", "gauge", "Комнат на воркере (из отчета)",
+             [({"worker": w.index}, len(w.rooms)) for w in workers]),
+            ("bomberman_cluster_worker_players", "gauge", "Игроков на воркере (из отчета и переданных после него)",
+             [({"worker": w.index}, w.players()) for w in workers]),
+            ("bomberman_cluster_worker_handoffs_total", "counter", "Клиентов, переданных воркеру",
+             [({"worker": w.index}, w.handoffs_total) for w in workers]),
+        ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фронтенд-матчмейкер и процессы-воркеры игры")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="число процессов-воркеров (по умолчанию - по ядру)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    log_listener = main.setup_logging(prefix="[фронтенд] ")
+    try:
+        main.load_maps(main.MAPS_DIR)
+        asyncio.run(Frontend(max(1, args.workers)).run(args.host, args.port))
+    except KeyboardInterrupt:
+        log.info("Фронтенд остановлен.")
+    finally:
+        log_listener.stop()
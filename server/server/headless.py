@@ -0,0 +1,120 @@
+"""Headless-режим: Game без сервера, сети и настенных часов.
+
+Карты, генератор случайных чисел и поток ввода подставляются снаружи,
+а тики шагаются настолько быстро, насколько позволяет процессор.
+Используется бенчмарками (bench.py) и для воспроизводимых прогонов.
+"""
+import random
+import time
+import uuid
+
+from main import Game, MapDescriptor
+
+# --- Карты ---
+def make_synthetic_map(width, height, players=4, brick_density=0.6, seed=0, name=None):
+    """Строит карту заданного размера: рамка и столбы из стен, случайные кирпичи, спавны."""
+    rng = random.Random(seed)
+    layout = []
+    for y in range(height):
+        row = []
+        for x in range(width):
+            if x in (0, width - 1) or y in (0, height - 1) or (x % 2 == 0 and y % 2 == 0):
+                row.append('#')
+            else:
+                row.append('.' if rng.random() < brick_density else ' ')
+        layout.append(row)
+
+    # Спавны - на клетках с нечетными координатами, их никогда не занимают столбы
+    free_cells = [(x, y) for y in range(1, height - 1, 2) for x in range(1, width - 1, 2)]
+    for x, y in rng.sample(free_cells, min(players, len(free_cells))):
+        layout[y][x] = 'p'
+    return MapDescriptor(name or f"synthetic_{width}x{height}", layout)
+
+# --- Потоки ввода ---
+class ScriptedInputs:
+    """Заранее записанный ввод: {номер тика: [(id игрока, действие), ...]}."""
+    def __init__(self, script):
+        self.script = script
+
+    def __call__(self, sim, tick):
+        return self.script.get(tick, ())
+
+class RandomInputs:
+    """Случайные игроки: жмут готовность в лобби, а в игре ходят и ставят бомбы."""
+    def __init__(self, rng, action_chance=0.2, bomb_chance=0.02):
+        self.rng = rng
+        self.action_chance = action_chance
+        self.bomb_chance = bomb_chance
+
+    def __call__(self, sim, tick):
+        game = sim.game
+        actions = []
+        for player in game.players.values():
+            if game.state == "WAITING":
+                if not player.ready:
+                    actions.append((player.id, {"type": "ready"}))
+            elif game.state == "IN_PROGRESS" and player.alive and self.rng.random() < self.action_chance:
+                if self.rng.random() < self.bomb_chance:
+                    actions.append((player.id, {"type": "place_bomb"}))
+                else:
+                    dx, dy = self.rng.choice(((1, 0), (-1, 0), (0, 1), (0, -1)))
+                    actions.append((player.id, {"type": "move", "dx": dx, "dy": dy}))
+        return actions
+
+# --- Симуляция ---
+class HeadlessSimulation:
+    """Game с подставленными картами, RNG и вводом; step() - один тик без ожидания."""
+    def __init__(self, maps, players=2, seed=0, inputs=None):
+        self.rng = random.Random(seed)
+        self.game = Game(maps=maps, rng=self.rng)
+        self.inputs = inputs if inputs is not None else RandomInputs(self.rng)
+        self.player_ids = []
+        for i in range(players):
+            player_id = str(uuid.UUID(int=self.rng.getrandbits(128)))
+            if self.game.add_player(player_id, f"bot{i}") is None:
+                break
+            self.player_ids.append(player_id)
+
+    def step(self):
+        # Ввод, пришедший "до" тика, ставится в очередь и применяется в начале его update()
+        tick = self.game.tick + 1
+        for player_id, action in self.inputs(self, tick):
+            self.game.queue_input(player_id, action)
+        self.game.update()
+
+    def run(self, ticks):
+        for _ in range(ticks):
+            self.step()
+
+class PhaseTimer:
+    """Замеряет время выбранных методов Game, подменяя их на экземпляре.
+
+    Обычный код Game не меняется: без установленного таймера замеры ничего не стоят.
+    """
+    def __init__(self):
+        self.totals = {} # имя фазы -> суммарное время, нс
+        self.calls = {} # имя фазы -> число вызовов
+
+    def instrument(self, game, names):
+        for name in names:
+            setattr(game, name, self._wrap(name, getattr(game, name)))
+
+    def _wrap(self, name, method):
+        self.totals.setdefault(name, 0)
+        self.calls.setdefault(name, 0)
+        def timed(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.totals[name] += time.perf_counter_ns() - start
+                self.calls[name] += 1
+        return timed
+
+    def measure(self, name, func, *args):
+        """Замеряет разовый вызов, не относящийся к методам Game (например, json.dumps)."""
+        start = time.perf_counter_ns()
+        result = func(*args)
+        self.totals[name] = self.totals.get(name, 0) + time.perf_counter_ns() - start
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return result
@@ -0,0 +1,258 @@
+"""Нагрузочный тест сервера по websocket.
+
+Запускает N синтетических игроков и M наблюдателей против локального сервера.
+Игроки говорят на том же протоколе, что и client/main.py (join/ready/move/place_bomb),
+и меряют задержку от отправки ввода до состояния, в котором он виден ("эхо").
+
+Запуск из папки server/:
+    python3 server/loadtest.py --spawn-server --players 40 --spectators 20 --duration 30
+    python3 server/loadtest.py --server-pid 12345 --players 200 --delta --binary --json run.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import websockets
+
+import protocol
+
+PROBE_TIMEOUT = 2.0 # Сколько секунд ждать эхо ввода, прежде чем считать его потерянным
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+class Stats:
+    def __init__(self):
+        self.latencies = {"move": [], "place_bomb": [], "ready": []} # секунды
+        self.timeouts = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.clients = [] # (число кадров состояния, байт, секунд в сети) на клиента
+
+class SyntheticClient:
+    """Один синтетический игрок или наблюдатель."""
+    def __init__(self, index, role, args, stats, rng):
+        self.index, self.role, self.args, self.stats, self.rng = index, role, args, stats, rng
+        self.state = {}
+        self.my_id = None
+        self.probe = None # (тип ввода, ожидаемое значение, время отправки)
+        self.frames = 0
+        self.bytes = 0
+
+    async def run(self, deadline):
+        try:
+            websocket = await websockets.connect(self.args.uri, max_size=None)
+        except (OSError, websockets.exceptions.InvalidHandshake):
+            self.stats.connect_failures += 1
+            return
+        started = time.perf_counter()
+        join = {"type": "join", "role": self.role, "name": f"load{self.index}", "delta": self.args.delta}
+        if self.args.binary: join["encoding"] = "binary"
+        if self.args.room: join["room"] = self.args.room
+        try:
+            await websocket.send(json.dumps(join))
+            tasks = [asyncio.create_task(self._receive(websocket))]
+            if self.role == "player":
+                tasks.append(asyncio.create_task(self._send_inputs(websocket)))
+            await asyncio.wait(tasks, timeout=max(0.0, deadline - time.perf_counter()), return_when=asyncio.FIRST_EXCEPTION)
+            for task in tasks:
+                task.cancel()
+        except websockets.exceptions.ConnectionClosed:
+            self.stats.disconnects += 1
+        finally:
+            await websocket.close()
+            self.stats.clients.append((self.frames, self.bytes, time.perf_counter() - started))
+
+    # --- Прием ---
+    async def _receive(self, websocket):
+        try:
+            async for message in websocket:
+                self.bytes += len(message)
+                data = protocol.decode_server_message(message) if isinstance(message, bytes) else json.loads(message)
+                if isinstance(data, list): continue # Пачка взрывов
+                msg_type = data.get("type")
+                if msg_type == "assign_id":
+                    self.my_id = data["payload"]
+                elif msg_type == "game_state":
+                    self.state = data["payload"]
+                    protocol.expand_view(self.state)
+                    self._on_state()
+                elif msg_type == "game_state_delta" and self.state:
+                    delta = data["payload"]
+                    if delta["seq"] != self.state.get("seq", 0) + 1:
+                        self.state = {}
+                        await websocket.send(protocol.encode_input({"type": "resync"}) if self.args.binary else json.dumps({"type": "resync"}))
+                        continue
+                    protocol.apply_delta(self.state, delta)
+                    self._on_state()
+        except websockets.exceptions.ConnectionClosed:
+            self.stats.disconnects += 1
+
+    def _on_state(self):
+        self.frames += 1
+        if self.probe is None: return
+        kind, expected, sent_at = self.probe
+        me = self._me()
+        if me is None: return
+        if kind == "move":
+            echoed = (me["x"], me["y"]) == expected
+        elif kind == "place_bomb":
+            echoed = any((b["x"], b["y"]) == expected for b in self.state.get("bombs", []))
+        else:
+            echoed = me["ready"] == expected
+        now = time.perf_counter()
+        if echoed:
+            self.stats.latencies[kind].append(now - sent_at)
+            self.probe = None
+        elif now - sent_at > PROBE_TIMEOUT:
+            self.stats.timeouts += 1
+            self.probe = None
+
+    def _me(self):
+        return next((p for p in self.state.get("players", []) if p["id"] == self.my_id), None)
+
+    # --- Отправка ---
+    async def _send_inputs(self, websocket):
+        while True:
+            # Экспоненциальные паузы - входящий поток похож на живых игроков
+            await asyncio.sleep(self.rng.expovariate(self.args.input_rate))
+            action = self._choose_action()
+            if action is None: continue
+            message = protocol.encode_input(action) if self.args.binary else json.dumps(action)
+            await websocket.send(message)
+
+    def _choose_action(self):
+        me = self._me()
+        if me is None or self.probe is not None: return None
+        game_state = self.state.get("state")
+        now = time.perf_counter()
+        if game_state == "WAITING" and not me["ready"]:
+            self.probe = ("ready", True, now)
+            return {"type": "ready"}
+        if game_state != "IN_PROGRESS" or not me["alive"]: return None
+
+        if self.rng.random() < self.args.bomb_share and not any((b["x"], b["y"]) == (me["x"], me["y"]) for b in self.state.get("bombs", [])):
+            self.probe = ("place_bomb", (me["x"], me["y"]), now)
+            return {"type": "place_bomb"}
+        # Ходим только туда, куда ход возможен, иначе эхо не придет
+        game_map = self.state.get("map", [])
+        options = [(dx, dy) for dx, dy in DIRECTIONS
+                   if 0 <= me["y"] + dy < len(game_map) and 0 <= me["x"] + dx < len(game_map[0])
+                   and game_map[me["y"] + dy][me["x"] + dx] in (' ', 'p')]
+        if not options: return None
+        dx, dy = self.rng.choice(options)
+        self.probe = ("move", (me["x"] + dx, me["y"] + dy), now)
+        return {"type": "move", "dx": dx, "dy": dy}
+
+# --- Процессор сервера ---
+def read_cpu_seconds(pid):
+    """Суммарное процессорное время процесса (user + system) из /proc; None, если недоступно."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+# --- Отчет ---
+def percentile(values, share):
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+def summarize(stats, args, elapsed, cpu_seconds):
+    latency = {}
+    for kind, values in stats.latencies.items():
+        ms = [v * 1000 for v in values]
+        latency[kind] = {"count": len(ms), "p50": percentile(ms, 0.50), "p95": percentile(ms, 0.95),
+                         "p99": percentile(ms, 0.99), "max": max(ms) if ms else None}
+    rates = [frames / seconds for frames, _, seconds in stats.clients if seconds > 0]
+    bandwidth = [size / seconds for _, size, seconds in stats.clients if seconds > 0]
+    return {
+        "config": vars(args),
+        "elapsed_sec": elapsed,
+        "latency_ms": latency,
+        "probe_timeouts": stats.timeouts,
+        "connect_failures": stats.connect_failures,
+        "disconnects": stats.disconnects,
+        "state_rate_hz": {"mean": sum(rates) / len(rates) if rates else None,
+                          "min": min(rates) if rates else None, "p5": percentile(rates, 0.05)},
+        "bytes_per_sec_per_client": sum(bandwidth) / len(bandwidth) if bandwidth else None,
+        "server_cpu_percent": cpu_seconds / elapsed * 100 if cpu_seconds is not None else None,
+    }
+
+def print_summary(result):
+    def fmt(value, unit=""):
+        return "-" if value is None else f"{value:.1f}{unit}"
+    for kind, lat in result["latency_ms"].items():
+        print(f"{kind:<11} n={lat['count']:<6} p50 {fmt(lat['p50'], ' мс')}  p95 {fmt(lat['p95'], ' мс')}  "
+              f"p99 {fmt(lat['p99'], ' мс')}  max {fmt(lat['max'], ' мс')}")
+    rate = result["state_rate_hz"]
+    print(f"Кадров состояния на клиента: среднее {fmt(rate['mean'], ' Гц')}, мин {fmt(rate['min'], ' Гц')}, p5 {fmt(rate['p5'], ' Гц')}")
+    print(f"Трафик на клиента: {fmt((result['bytes_per_sec_per_client'] or 0) / 1024, ' КБ/с')}")
+    print(f"Процессор сервера: {fmt(result['server_cpu_percent'], '%')}")
+    print(f"Потеряно эхо: {result['probe_timeouts']}, ошибок подключения: {result['connect_failures']}, разрывов: {result['disconnects']}")
+
+async def run(args):
+    stats = Stats()
+    rng = random.Random(args.seed)
+    clients = [SyntheticClient(i, "player", args, stats, random.Random(rng.random())) for i in range(args.players)]
+    clients += [SyntheticClient(i, "spectator", args, stats, random.Random(rng.random())) for i in range(args.spectators)]
+
+    cpu_start = read_cpu_seconds(args.server_pid) if args.server_pid else None
+    started = time.perf_counter()
+    deadline = started + args.ramp + args.duration
+    tasks = []
+    for client in clients:
+        tasks.append(asyncio.create_task(client.run(deadline)))
+        # Подключаемся постепенно, чтобы не мерить шторм рукопожатий
+        await asyncio.sleep(args.ramp / max(1, len(clients)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    cpu_end = read_cpu_seconds(args.server_pid) if args.server_pid else None
+    cpu_seconds = cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None
+    return summarize(stats, args, elapsed, cpu_seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест игрового сервера")
+    parser.add_argument("--uri", default="ws://localhost:8765")
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--spectators", type=int, default=0)
+    parser.add_argument("--duration", type=float, default=20, help="секунд под полной нагрузкой")
+    parser.add_argument("--ramp", type=float, default=2, help="секунд на подключение всех клиентов")
+    parser.add_argument("--input-rate", type=float, default=5, help="попыток ввода в секунду на игрока")
+    parser.add_argument("--bomb-share", type=float, default=0.05, help="доля ввода, ставящего бомбу")
+    parser.add_argument("--room", help="загнать всех в одну комнату (иначе сервер раскидает по комнатам)")
+    parser.add_argument("--delta", action="store_true", help="дельта-протокол")
+    parser.add_argument("--binary", action="store_true", help="бинарная кодировка")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-pid", type=int, help="pid сервера для замера процессора")
+    parser.add_argument("--spawn-server", action="store_true", help="запустить server/main.py на время теста")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn_server:
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__), "main.py")],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        args.server_pid = server.pid
+        time.sleep(1.5)
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_summary(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Результаты сохранены в {args.json}")
+
+if __name__ == "__main__":
+    main()
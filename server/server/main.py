@@ -5,12 +5,31 @@ import time
 import uuid
 import random
 import os
+import struct
+import heapq
+import itertools
+import logging
+import logging.handlers
+import math
+import queue
+import re
+import sys
+from collections import deque
+
+import bots
+import metrics
+import profiler
+import protocol
+import replay
+
+log = logging.getLogger("bomberman")
 
 # --- Константы ---
-GRID_WIDTH = 20
-GRID_HEIGHT = 15
 BOMB_TIMER = 3
 BLAST_RADIUS = 2
+# Клетки карты хранятся байтами (Game.tiles)
+WALKABLE_TILES = b' p' # Пустота и спавны
+WALL_TILE, BRICK_TILE = ord('#'), ord('.')
 GAME_TICK_RATE = 1 / 60
 MIN_PLAYERS_TO_START = 2
 GAME_OVER_DURATION = 5
@@ -18,36 +37,137 @@ ROUND_DURATION = 120 # 2 минуты
 ENDGAME_BOMB_CHANCE = 0.004 # Шанс спавна случайной бомбы в конце игры
 WIN_DELAY = 3 # Задержка перед завершением игры после смерти предпоследнего игрока
 
-# Глобальный словарь для хранения загруженных карт
+# --- Планировщик тиков ---
+TICK_OVERRUN_POLICY = "catch_up" # "catch_up" - догонять пропущенные тики, "skip" - пропускать их
+MAX_CATCH_UP_TICKS = 5 # Сколько пропущенных тиков можно досчитать за один проход цикла
+LATE_TICK_TOLERANCE = 0.25 # Тик считается опоздавшим, если начался позже срока на эту долю интервала
+TICK_REPORT_INTERVAL = 10 # Как часто (в секундах) сообщать об опоздавших и пропущенных тиках
+QUIET_WAKE_INTERVAL = 0.1 # Если ни в одной комнате не идет матч, цикл просыпается раз в столько секунд (ввод будит раньше)
+
+# --- Очереди отправки ---
+MAX_NAME_LENGTH = 32 # Символов в имени игрока, остальное обрезается
+MAX_INPUTS_PER_TICK = 4 # Сколько действий игрока применяется за один тик, остальные отбрасываются
+
+CLIENT_QUEUE_LIMIT = 64 # Максимум неотправленных событий в очереди одного клиента
+SLOW_CLIENT_TIMEOUT = 5 # Сколько секунд клиент может не принимать данные, прежде чем его отключат
+SPECTATOR_RATE = 15 # Частота кадров для наблюдателей, Гц (игроки получают каждый тик)
+HEARTBEAT_INTERVAL = 1 # В лобби и после матча кадры идут только по изменениям, но не реже раза в столько секунд
+
+# --- Большие карты ---
+MAPS_DIR = os.environ.get("BOMBERMAN_MAPS_DIR", "maps")
+MAX_MAP_SIZE = 512 # Максимальная сторона карты в клетках
+AOI_WIDTH = 31 # Окно интереса игрока, клеток: экран клиента (20x15) с запасом
+AOI_HEIGHT = 23 # Карты больше окна игроки видят только через него (см. AreaOfInterest)
+
+# --- Боты ---
+BOT_FILL_DELAY = float(os.environ.get("BOMBERMAN_BOT_FILL_DELAY") or 0) # Через сколько секунд одинокий готовый игрок получает ботов (0 - никогда)
+BOT_FILL_PLAYERS = 4 # До скольких игроков боты добирают комнату
+BOT_ROOMS = int(os.environ.get("BOMBERMAN_BOT_ROOMS") or 0) # Комнат только с ботами при старте (прогон сервера без клиентов)
+
+# --- Наблюдаемость ---
+LOG_LEVEL = os.environ.get("BOMBERMAN_LOG_LEVEL", "INFO")
+METRICS_HOST = "127.0.0.1" # Метрики отдаются только локально
+METRICS_PORT = 9100
+REPLAY_DIR = os.environ.get("BOMBERMAN_REPLAY_DIR", "replays") # Пустая строка - не записывать повторы
+PROFILE_DIR = "profiles" # Куда профайлер пишет свернутые стеки и отчеты
+PROFILE_MAX_SECONDS = 60 # Максимальная длительность сэмплирования по одному запросу
+
+def seconds_to_ticks(seconds):
+    """Переводит длительность в секундах в число тиков игрового цикла."""
+    return max(1, round(seconds / GAME_TICK_RATE))
+
+# Все игровые таймеры считаются в тиках, а не по настенным часам
+BOMB_TIMER_TICKS = seconds_to_ticks(BOMB_TIMER)
+GAME_OVER_DURATION_TICKS = seconds_to_ticks(GAME_OVER_DURATION)
+ROUND_DURATION_TICKS = seconds_to_ticks(ROUND_DURATION)
+WIN_DELAY_TICKS = seconds_to_ticks(WIN_DELAY)
+SPECTATOR_TICK_INTERVAL = seconds_to_ticks(1 / SPECTATOR_RATE)
+HEARTBEAT_TICKS = seconds_to_ticks(HEARTBEAT_INTERVAL)
+BOT_FILL_DELAY_TICKS = seconds_to_ticks(BOT_FILL_DELAY) if BOT_FILL_DELAY > 0 else None
+
+class MapDescriptor:
+    """Неизменяемое описание карты. Считается один раз в load_maps(), чтобы
+    игре не приходилось пересканировать сетку на каждом тике или перезапуске."""
+    def __init__(self, name, layout):
+        self.name = name
+        self.width, self.height = len(layout[0]), len(layout)
+        self.spawns = tuple((x, y) for y, row in enumerate(layout) for x, tile in enumerate(row) if tile == 'p')
+        self.capacity = len(self.spawns)
+        # Шаблон карты с уже очищенными зонами спавна: клетки подряд по строкам, по байту на клетку.
+        # Игра копирует его при перезапуске одним вызовом bytearray()
+        self.template = "".join("".join(row) for row in self._clear_spawn_zones(layout)).encode("ascii")
+        # Клетки, куда в эндгейме может упасть случайная бомба (все, кроме стен)
+        self.bomb_cells = tuple(divmod(i, self.width)[::-1] for i, tile in enumerate(self.template) if tile in b' p.')
+        self.brick_count = self.template.count(b'.')
+        # Символы карты не требуют экранирования в JSON - строку можно склеить без json.dumps
+        self.plain_json = all(0x20 <= tile < 0x7f and tile not in b'"\\' for tile in set(self.template))
+
+    def split_rows(self, cells):
+        """Разбивает клетки подряд (как в template) на строки карты."""
+        width = self.width
+        return [cells[start:start + width] for start in range(0, len(cells), width)]
+
+    def rows(self):
+        """Шаблон построчно - списком строк."""
+        return self.split_rows(self.template.decode("ascii"))
+
+    def _clear_spawn_zones(self, layout):
+        """Очищает зону 3x3 вокруг каждого спавна от разрушаемых блоков."""
+        cleared = [list(row) for row in layout]
+        for spawn_x, spawn_y in self.spawns:
+            # Проходим по квадрату 3x3 вокруг спавна
+            for dy in range(-1, 2):
+                for dx in range(-1, 2):
+                    x, y = spawn_x + dx, spawn_y + dy
+                    
+                    # Проверка границ карты
+                    if 0 <= x < self.width and 0 <= y < self.height:
+                        # Заменяем разрушаемые блоки на пустое пространство
+                        if cleared[y][x] == '.':
+                            cleared[y][x] = ' '
+        return cleared
+
+# Глобальный словарь для хранения загруженных карт: имя -> MapDescriptor
 AVAILABLE_MAPS = {}
 
-def load_maps():
-    """Загружает все карты из папки /maps."""
-    maps_dir = "maps"
-    if not os.path.exists(maps_dir):
-        print(f"КРИТИЧЕСКАЯ ОШИБКА: Папка '{maps_dir}' не найдена!")
-        exit()
-        
-    for filename in os.listdir(maps_dir):
+def read_maps(maps_dir="maps"):
+    """Читает все карты из папки и возвращает словарь имя -> MapDescriptor."""
+    maps = {}
+    for filename in sorted(os.listdir(maps_dir)):
         if filename.endswith(".txt"):
             try:
                 with open(os.path.join(maps_dir, filename), 'r') as f:
                     map_data = [list(row) for row in f.read().strip().split('\n')]
-                    if len(map_data) == GRID_HEIGHT and all(len(row) == GRID_WIDTH for row in map_data):
+                    width = len(map_data[0])
+                    if 0 < width <= MAX_MAP_SIZE and len(map_data) <= MAX_MAP_SIZE and all(len(row) == width for row in map_data):
                         map_name = os.path.splitext(filename)[0]
-                        AVAILABLE_MAPS[map_name] = map_data
-                        print(f"Карта '{map_name}' успешно загружена.")
+                        descriptor = MapDescriptor(map_name, map_data)
+                        maps[map_name] = descriptor
+                        log.info("Карта '%s' %dx%d успешно загружена (спавнов: %d, кирпичей: %d).", map_name,
+                                 descriptor.width, descriptor.height, descriptor.capacity, descriptor.brick_count)
                     else:
-                        print(f"Ошибка: Карта '{filename}' имеет неверные размеры.")
+                        log.error("Ошибка: Карта '%s' имеет строки разной длины или больше %d клеток по стороне.", filename, MAX_MAP_SIZE)
             except Exception as e:
-                print(f"Не удалось загрузить карту '{filename}': {e}")
+                log.error("Не удалось загрузить карту '%s': %s", filename, e)
+    return maps
+
+def load_maps(maps_dir="maps"):
+    """Загружает все карты из папки /maps в AVAILABLE_MAPS."""
+    if not os.path.exists(maps_dir):
+        log.critical("КРИТИЧЕСКАЯ ОШИБКА: Папка '%s' не найдена!", maps_dir)
+        exit()
+
+    AVAILABLE_MAPS.update(read_maps(maps_dir))
 
     if not AVAILABLE_MAPS:
-        print("КРИТИЧЕСКАЯ ОШИБКА: Ни одной корректной карты не найдено! Игра не может начаться.")
+        log.critical("КРИТИЧЕСКАЯ ОШИБКА: Ни одной корректной карты не найдено! Игра не может начаться.")
         exit()
 
 # --- Игровые классы ---
 class Player:
+    # Без __dict__: в больших матчах игроков сотни, а атрибуты у всех одни и те же
+    __slots__ = ("id", "name", "start_x", "start_y", "x", "y", "alive", "ready", "color", "input_seq", "cached_dict", "cached_json")
+
     def __init__(self, id, name, start_x, start_y, color=None):
         self.id, self.name = id, name
         self.start_x, self.start_y = start_x, start_y
@@ -55,139 +175,311 @@ class Player:
         self.alive = True
         self.ready = False
         self.color = color
+        self.input_seq = None # seq последнего примененного действия (для предсказания на клиенте)
+        self.cached_dict, self.cached_json = None, None # Сбрасываются mark_dirty() при любом изменении
+
+    def mark_dirty(self):
+        self.cached_dict, self.cached_json = None, None
 
     def move(self, dx, dy, game):
         if not self.alive: return
         new_x, new_y = self.x + dx, self.y + dy
         
         # Проверка границ
-        if not (0 <= new_x < GRID_WIDTH and 0 <= new_y < GRID_HEIGHT):
+        if not (0 <= new_x < game.map_info.width and 0 <= new_y < game.map_info.height):
             return
 
-        # Проверка препятствий (можно ходить по пустоте, спавнам и выжженной земле, если она есть)
-        target_tile = game.map[new_y][new_x]
-        if target_tile not in [' ', 'p']:
+        # Проверка препятствий (можно ходить по пустоте и спавнам)
+        if game.tiles[new_y * game.map_info.width + new_x] not in WALKABLE_TILES:
             return
             
+        game.unindex_player(self)
         self.x, self.y = new_x, new_y
+        game.index_player(self)
+        self.mark_dirty()
             
     def reset(self, start_x, start_y):
         self.start_x, self.start_y = start_x, start_y
         self.x, self.y = self.start_x, self.start_y
         self.alive = True
         self.ready = False
+        self.mark_dirty()
 
     def to_dict(self):
-        result = {"id": self.id, "name": self.name, "x": self.x, "y": self.y, "alive": self.alive, "ready": self.ready}
-        if self.color:
-            result["color"] = self.color
-        return result
+        """Словарь для кадров. Он общий для всех, кто его получил, и не должен меняться:
+        пока игрок не изменился, возвращается тот же объект."""
+        if self.cached_dict is None:
+            result = {"id": self.id, "name": self.name, "x": self.x, "y": self.y, "alive": self.alive, "ready": self.ready}
+            if self.color:
+                result["color"] = self.color
+            self.cached_dict = result
+        return self.cached_dict
+
+    def to_json(self):
+        if self.cached_json is None:
+            self.cached_json = json.dumps(self.to_dict())
+        return self.cached_json
 
 class Bomb:
-    def __init__(self, x, y):
+    __slots__ = ("x", "y", "place_tick", "explode_tick", "cached_dict", "cached_json")
+
+    def __init__(self, x, y, place_tick):
         self.x, self.y = x, y
-        self.place_time = time.time()
-    def is_expired(self): return time.time() - self.place_time > BOMB_TIMER
-    def to_dict(self): return {"x": self.x, "y": self.y}
+        self.place_tick = place_tick
+        self.explode_tick = place_tick + BOMB_TIMER_TICKS + 1 # Первый тик, на котором бомба истекла
+        # Бомба не меняется, поэтому ее представление в кадрах строится один раз
+        self.cached_dict = {"x": x, "y": y}
+        self.cached_json = json.dumps(self.cached_dict)
+    def to_dict(self): return self.cached_dict
+    def to_json(self): return self.cached_json
 
 # Класс Explosion удален, так как мы используем событийную модель
 
+MOVE_STEPS = (-1, 0, 1)
+
+def is_valid_action(action):
+    """Действие, которое Game может применить: известный тип, у хода dx/dy - целые из -1, 0, 1."""
+    if not isinstance(action, dict): return False
+    kind = action.get('type')
+    if kind == 'move':
+        dx, dy = action.get('dx'), action.get('dy')
+        return type(dx) is int and type(dy) is int and dx in MOVE_STEPS and dy in MOVE_STEPS
+    return kind in ('place_bomb', 'ready')
+
+# Сквозной счетчик для кучи бомб: при равном тике взрыва раньше взрывается поставленная раньше
+BOMB_SEQUENCE = itertools.count()
+
 class Game:
-    def __init__(self):
+    def __init__(self, maps=None, rng=None):
+        # Карты и генератор случайных чисел можно подменить (headless-симуляция, бенчмарки)
+        self.maps = maps if maps is not None else AVAILABLE_MAPS
+        self.rng = rng if rng is not None else random
         self.players = {}
+        self.tick = 0 # Номер текущего тика; все таймеры игры считаются от него
         self.events_to_send = [] # Очередь событий (взрывы)
+        self.changed_tiles = [] # Клетки карты, изменившиеся с последней рассылки (для дельт)
+        self.map_reset = False # Карта заменена целиком - дельтой не обойтись, нужен ключевой кадр
+        self.pending_inputs = {} # id игрока -> действия, ждущие начала следующего тика
+        self.recorder = None # replay.ReplayRecorder, если матчи записываются
         self.reset()
 
     def reset(self):
-        print("--- ПЕРЕЗАПУСК ИГРЫ ---")
+        log.debug("--- ПЕРЕЗАПУСК ИГРЫ ---")
         
         num_current_players = len(self.players)
-        suitable_maps = []
-        for name, layout in AVAILABLE_MAPS.items():
-            if sum(row.count('p') for row in layout) >= num_current_players:
-                suitable_maps.append((name, layout))
+        suitable_maps = [m for m in self.maps.values() if m.capacity >= num_current_players]
 
         if not suitable_maps:
-            print(f"Предупреждение: не найдено карт для {num_current_players} игроков.")
-            map_name, map_layout = random.choice(list(AVAILABLE_MAPS.items()))
+            log.warning("Предупреждение: не найдено карт для %d игроков.", num_current_players)
+            map_info = self.rng.choice(list(self.maps.values()))
         else:
-            map_name, map_layout = random.choice(suitable_maps)
+            map_info = self.rng.choice(suitable_maps)
 
-        print(f"--- Выбрана карта: {map_name} ---")
-        self.original_map = [list(row) for row in map_layout]
-        self.map = [list(row) for row in self.original_map]
-        
-        # Очищаем зону 3x3 вокруг каждого спавна от разрушаемых блоков
-        self._clear_spawn_zones()
+        log.info("--- Выбрана карта: %s ---", map_info.name)
+        self.map_info = map_info
+        # Зоны спавна в шаблоне уже очищены при загрузке карты; клетка (x, y) - tiles[y * width + x]
+        self.tiles = bytearray(map_info.template)
+        self.bricks_left = map_info.brick_count # Счетчик вместо пересканирования карты
+        self.changed_tiles.clear()
+        self.map_reset = True
+        self.reset_map_cache()
         
-        self.bombs = []
+        self.bombs = {} # (x, y) -> Bomb: индекс занятости клеток, порядок - порядок установки
+        self.player_cells = {} # (x, y) -> множество живых игроков в клетке
+        self.bomb_queue = [] # Куча (explode_tick, номер, Bomb) - ближайшая к взрыву бомба сверху
         self.state = "WAITING"
-        self.winner, self.game_over_time, self.round_start_time = None, None, None
+        self.winner, self.game_over_tick, self.round_start_tick = None, None, None
         self.endgame_mode = False
-        self.win_check_time = None  # Время когда зафиксирована победа (для задержки)
+        self.win_check_tick = None  # Тик, на котором зафиксирована победа (для задержки)
         
-        self.available_starts = self._find_start_positions()
-        random.shuffle(self.available_starts)
+        self.available_starts = list(map_info.spawns)
+        self.rng.shuffle(self.available_starts)
         
         for player in self.players.values():
             if self.available_starts:
                 start_pos = self.available_starts.pop(0)
                 player.reset(start_pos[0], start_pos[1])
             else:
-                print(f"Не хватило места для игрока {player.name}.")
+                log.warning("Не хватило места для игрока %s.", player.name)
                 player.alive = False
+                player.mark_dirty()
+            self.index_player(player)
 
-    def _find_start_positions(self):
-        return [(x, y) for y, row in enumerate(self.original_map) for x, tile in enumerate(row) if tile == 'p']
+        if self.recorder is not None: self.recorder.match_started(self)
 
-    def _clear_spawn_zones(self):
-        """Очищает зону 3x3 вокруг каждого спавна от разрушаемых блоков."""
-        spawn_positions = self._find_start_positions()
-        
-        for spawn_x, spawn_y in spawn_positions:
-            # Проходим по квадрату 3x3 вокруг спавна
-            for dy in range(-1, 2):
-                for dx in range(-1, 2):
-                    x, y = spawn_x + dx, spawn_y + dy
-                    
-                    # Проверка границ карты
-                    if 0 <= x < GRID_WIDTH and 0 <= y < GRID_HEIGHT:
-                        # Заменяем разрушаемые блоки на пустое пространство
-                        if self.map[y][x] == '.':
-                            self.map[y][x] = ' '
-                            self.original_map[y][x] = ' '
-        
-        print(f"--- Очищены зоны спавна для {len(spawn_positions)} точек ---")
+    # --- Снимки (повторы) ---
+    def snapshot(self):
+        """Полное состояние матча в JSON-совместимом виде; load_snapshot() восстанавливает его."""
+        # Бомбы - в порядке кучи, чтобы при восстановлении сохранился порядок взрывов
+        bombs = [[b.x, b.y, b.place_tick] for _, _, b in sorted(self.bomb_queue) if self.bombs.get((b.x, b.y)) is b]
+        players = [{"id": p.id, "name": p.name, "color": p.color, "x": p.x, "y": p.y, "start_x": p.start_x,
+                    "start_y": p.start_y, "alive": p.alive, "ready": p.ready} for p in self.players.values()]
+        return {"tick": self.tick, "map_name": self.map_info.name, "map": self.map_info.split_rows(self.tiles.decode("ascii")),
+                "bricks_left": self.bricks_left, "state": self.state, "winner": self.winner,
+                "game_over_tick": self.game_over_tick, "round_start_tick": self.round_start_tick,
+                "endgame_mode": self.endgame_mode, "win_check_tick": self.win_check_tick,
+                "available_starts": [list(pos) for pos in self.available_starts], "players": players, "bombs": bombs}
+
+    def load_snapshot(self, data):
+        self.map_info = self.maps[data["map_name"]]
+        self.tiles = bytearray("".join(data["map"]).encode("ascii"))
+        self.changed_tiles.clear()
+        self.map_reset = True
+        self.reset_map_cache()
+        self.events_to_send = []
+        self.pending_inputs = {}
+        for key in ("tick", "bricks_left", "state", "winner", "game_over_tick", "round_start_tick", "endgame_mode", "win_check_tick"):
+            setattr(self, key, data[key])
+        self.available_starts = [tuple(pos) for pos in data["available_starts"]]
+
+        self.players, self.player_cells = {}, {}
+        for info in data["players"]:
+            player = Player(info["id"], info["name"], info["start_x"], info["start_y"], color=info["color"])
+            player.x, player.y, player.alive, player.ready = info["x"], info["y"], info["alive"], info["ready"]
+            self.players[player.id] = player
+            self.index_player(player)
+
+        self.bombs, self.bomb_queue = {}, []
+        for x, y, place_tick in data["bombs"]:
+            bomb = Bomb(x, y, place_tick)
+            self.bombs[(x, y)] = bomb
+            heapq.heappush(self.bomb_queue, (bomb.explode_tick, next(BOMB_SEQUENCE), bomb))
+
+    # --- Кэш сериализации карты ---
+    def reset_map_cache(self):
+        height = self.map_info.height
+        # Строки карты в виде game_state (списки символов) и их JSON; None - строку надо построить заново.
+        # Строятся только по запросу: комнате, которой не нужны полные кадры, хватает tiles
+        self.row_lists = [None] * height
+        self.row_lists_stale = True # Есть строки None - map_rows() надо пройти по ним
+        self.row_json = [None] * height
+        self.cached_map_json = None
+
+    def tile(self, x, y):
+        return chr(self.tiles[y * self.map_info.width + x])
+
+    def row(self, y):
+        width = self.map_info.width
+        return self.tiles[y * width:(y + 1) * width].decode("ascii")
+
+    def row_to_json(self, y):
+        """То же, что json.dumps(list(self.row(y)))."""
+        if self.map_info.plain_json:
+            return '["' + '", "'.join(self.row(y)) + '"]'
+        return json.dumps(list(self.row(y)))
+
+    def set_tile(self, x, y, tile):
+        """Меняет клетку карты: запоминает ее для дельт и сбрасывает кэш ее строки."""
+        self.tiles[y * self.map_info.width + x] = ord(tile)
+        self.changed_tiles.append((x, y))
+        self.row_lists[y] = self.row_json[y] = None
+        self.row_lists_stale = True
+        self.cached_map_json = None
+
+    def map_rows(self):
+        """Карта для game_state - список строк, каждая - список символов."""
+        rows = self.row_lists
+        if self.row_lists_stale:
+            for y, cached in enumerate(rows):
+                if cached is None:
+                    rows[y] = list(self.row(y))
+            self.row_lists_stale = False
+        return rows
+
+    def map_json(self):
+        """JSON всей карты; заново кодируются только строки, изменившиеся с прошлого вызова."""
+        if self.cached_map_json is None:
+            rows = self.row_json
+            for y, fragment in enumerate(rows):
+                if fragment is None:
+                    rows[y] = self.row_to_json(y)
+            self.cached_map_json = "[" + ", ".join(rows) + "]"
+        return self.cached_map_json
+
+    # --- Индекс занятости клеток ---
+    def index_player(self, player):
+        if player.alive:
+            self.player_cells.setdefault((player.x, player.y), set()).add(player)
+
+    def unindex_player(self, player):
+        cell = self.player_cells.get((player.x, player.y))
+        if cell is not None:
+            cell.discard(player)
+            if not cell: del self.player_cells[(player.x, player.y)]
+
+    def is_bomb_at(self, x, y):
+        return (x, y) in self.bombs
 
     def add_player(self, player_id, player_name, color=None):
-        all_starts = self._find_start_positions()
         taken_starts = {(p.start_x, p.start_y) for p in self.players.values()}
-        free_starts = [pos for pos in all_starts if pos not in taken_starts]
+        free_starts = [pos for pos in self.map_info.spawns if pos not in taken_starts]
         
         if not free_starts:
-            print("Нет свободных мест для нового игрока.")
+            log.info("Нет свободных мест для нового игрока.")
             return None
             
         start_pos = free_starts[0]
         player = Player(player_id, player_name, start_pos[0], start_pos[1], color=color)
         self.players[player_id] = player
-        print(f"Игрок '{player_name}' ({player_id}) добавлен на {start_pos}")
+        self.index_player(player)
+        if self.recorder is not None: self.recorder.record_join(self.tick, player)
+        log.debug("Игрок '%s' (%s) добавлен на %s", player_name, player_id, start_pos)
         return player
 
     def remove_player(self, player_id):
         if player_id in self.players:
             player = self.players.pop(player_id)
-            print(f"Игрок '{player.name}' ({player_id}) удален.")
+            self.unindex_player(player)
+            self.pending_inputs.pop(player_id, None)
+            if self.recorder is not None: self.recorder.record_leave(self.tick, player_id)
+            log.debug("Игрок '%s' (%s) удален.", player.name, player_id)
             self.check_game_start()
 
+    def queue_input(self, player_id, action):
+        """Откладывает действие до начала следующего тика.
+
+        Повторы схлопываются: из одинаковых ходов подряд остается последний (разные
+        применяются все, в пределах MAX_INPUTS_PER_TICK), вторая бомба подряд не нужна,
+        а два 'ready' подряд отменяют друг друга.
+        Возвращает "queued", "merged" или "dropped" (больше MAX_INPUTS_PER_TICK
+        или некорректное действие - оно не должно дойти до тика, общего для всех комнат).
+        """
+        if player_id not in self.players or not is_valid_action(action): return "dropped"
+        pending = self.pending_inputs.setdefault(player_id, [])
+        kind = action.get('type')
+        if pending and pending[-1]['type'] == kind:
+            if kind == 'move' and (pending[-1]['dx'], pending[-1]['dy']) == (action['dx'], action['dy']):
+                pending[-1] = action
+                return "merged"
+            if kind == 'place_bomb':
+                return "merged"
+            if kind == 'ready':
+                pending.pop()
+                return "merged"
+        if len(pending) >= MAX_INPUTS_PER_TICK:
+            return "dropped"
+        pending.append(action)
+        return "queued"
+
+    def apply_inputs(self):
+        # Игроки обрабатываются в порядке первого действия за тик
+        pending, self.pending_inputs = self.pending_inputs, {}
+        if self.recorder is not None: self.recorder.record_inputs(self.tick, pending)
+        for player_id, actions in pending.items():
+            for action in actions:
+                self.handle_input(player_id, action)
+
     def handle_input(self, player_id, action):
         player = self.players.get(player_id)
         if not player: return
+        seq = action.get('seq')
+        if isinstance(seq, int): player.input_seq = seq
 
         if self.state == "WAITING":
             if action['type'] == 'ready':
                 player.ready = not player.ready
-                print(f"Игрок '{player.name}' изменил статус готовности на: {player.ready}")
+                player.mark_dirty()
+                log.debug("Игрок '%s' изменил статус готовности на: %s", player.name, player.ready)
                 self.check_game_start()
             return
 
@@ -196,27 +488,33 @@ class Game:
             elif action['type'] == 'place_bomb': self.place_bomb(player.x, player.y)
 
     def place_bomb(self, x, y):
-        if not any(b.x == x and b.y == y for b in self.bombs): self.bombs.append(Bomb(x, y))
+        if (x, y) in self.bombs: return
+        bomb = Bomb(x, y, self.tick)
+        self.bombs[(x, y)] = bomb
+        heapq.heappush(self.bomb_queue, (bomb.explode_tick, next(BOMB_SEQUENCE), bomb))
 
     def update(self):
-        # Очищаем события прошлого тика
-        self.events_to_send.clear()
+        # Ввод, накопленный с прошлого тика, применяется до шага (как раньше - между тиками)
+        if self.pending_inputs: self.apply_inputs()
+        # События не очищаются здесь: при догоняющих тиках их забирает рассылка (take_events)
+        self.tick += 1
 
         if self.state == "GAME_OVER":
-            if time.time() - self.game_over_time > GAME_OVER_DURATION: self.reset()
+            if self.tick - self.game_over_tick > GAME_OVER_DURATION_TICKS: self.reset()
         elif self.state == "IN_PROGRESS":
             self.update_bombs()
             self.check_endgame()
             if self.endgame_mode: self.spawn_random_bomb()
             self.check_win_condition()
+        if self.recorder is not None: self.recorder.tick_done(self)
 
     def check_game_start(self):
         if self.state == "WAITING" and len(self.players) >= MIN_PLAYERS_TO_START:
             all_ready = all(p.ready for p in self.players.values())
             if all_ready:
                 self.state = "IN_PROGRESS"
-                self.round_start_time = time.time()
-                print("--- ВСЕ ГОТОВЫ! ИГРА НАЧАЛАСЬ ---")
+                self.round_start_tick = self.tick
+                log.info("--- ВСЕ ГОТОВЫ! ИГРА НАЧАЛАСЬ ---")
 
     def check_win_condition(self):
         alive_players = [p for p in self.players.values() if p.alive]
@@ -225,40 +523,43 @@ class Game:
             return
             
         if len(alive_players) <= 1:
-            if self.win_check_time is None:
-                self.win_check_time = time.time()
-                print(f"--- Победа зафиксирована, ожидание {WIN_DELAY} сек для анимации... ---")
+            if self.win_check_tick is None:
+                self.win_check_tick = self.tick
+                log.debug("--- Победа зафиксирована, ожидание %s сек для анимации... ---", WIN_DELAY)
             
-            if time.time() - self.win_check_time >= WIN_DELAY:
+            if self.tick - self.win_check_tick >= WIN_DELAY_TICKS:
                 self.state = "GAME_OVER"
-                self.game_over_time = time.time()
+                self.game_over_tick = self.tick
                 self.endgame_mode = False
-                self.win_check_time = None
+                self.win_check_tick = None
                 self.winner = alive_players[0].name if alive_players else "НИЧЬЯ"
-                print(f"--- ИГРА ОКОНЧЕНА! ПОБЕДИТЕЛЬ: {self.winner} ---")
+                log.info("--- ИГРА ОКОНЧЕНА! ПОБЕДИТЕЛЬ: %s ---", self.winner)
         else:
-            self.win_check_time = None
+            self.win_check_tick = None
             
     def are_all_bricks_destroyed(self):
-        return not any('.' in row for row in self.map)
+        return self.bricks_left == 0
 
     def check_endgame(self):
-        time_is_up = self.round_start_time and (time.time() - self.round_start_time > ROUND_DURATION)
+        time_is_up = self.round_start_tick is not None and (self.tick - self.round_start_tick > ROUND_DURATION_TICKS)
         if not self.endgame_mode and (time_is_up or self.are_all_bricks_destroyed()):
             self.endgame_mode = True
-            print("--- ЭНДГЕЙМ АКТИВИРОВАН ---")
+            log.info("--- ЭНДГЕЙМ АКТИВИРОВАН ---")
 
     def spawn_random_bomb(self):
-        if random.random() < ENDGAME_BOMB_CHANCE:
-            empty_tiles = [(x, y) for y, row in enumerate(self.map) for x, tile in enumerate(row) if self.original_map[y][x] in [' ', 'p', '.']]
-            if empty_tiles:
-                x, y = random.choice(empty_tiles)
+        if self.rng.random() < ENDGAME_BOMB_CHANCE:
+            if self.map_info.bomb_cells:
+                x, y = self.rng.choice(self.map_info.bomb_cells)
+                if self.recorder is not None: self.recorder.record_bomb(self.tick, x, y)
                 self.place_bomb(x, y)
 
     # --- ЛОГИКА ВЗРЫВОВ (ВЗЯТО ИЗ КОДА №1) ---
     def update_bombs(self):
-        for bomb in [b for b in self.bombs if b.is_expired()]:
-            self.bombs.remove(bomb)
+        # Смотрим только вершину кучи: бомбы, которым рано взрываться, не трогаем вовсе
+        while self.bomb_queue and self.bomb_queue[0][0] <= self.tick:
+            bomb = heapq.heappop(self.bomb_queue)[2]
+            if self.bombs.get((bomb.x, bomb.y)) is not bomb: continue
+            del self.bombs[(bomb.x, bomb.y)]
             
             # 1. Вычисляем все затронутые клетки
             affected_cells = self.process_server_side_explosion(bomb.x, bomb.y)
@@ -273,144 +574,948 @@ class Game:
             # Добавляем в очередь на отправку
             self.events_to_send.append(explosion_event)
 
-    def process_server_side_explosion(self, start_x, start_y):
-        affected_cells = []
-        
-        def add_and_check(x, y):
-            if (x, y) not in affected_cells:
-                affected_cells.append((x, y))
-                self._check_collisions(x, y)
+    def blast_cells(self, start_x, start_y):
+        """Клетки, которые заденет взрыв бомбы в (start_x, start_y) на текущей карте.
 
-        add_and_check(start_x, start_y)
-        
+        Луч останавливается у стены и на первом кирпиче (кирпич тоже задет).
+        Ничего не меняет - этим же пользуется карта опасности ботов.
+        """
+        tiles, width, height = self.tiles, self.map_info.width, self.map_info.height
+        affected_cells = [(start_x, start_y)]
         for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
             for i in range(1, BLAST_RADIUS + 1):
                 x, y = start_x + dx * i, start_y + dy * i
-                if not (0 <= x < GRID_WIDTH and 0 <= y < GRID_HEIGHT and self.map[y][x] != '#'):
+                if not (0 <= x < width and 0 <= y < height):
                     break
-                
-                add_and_check(x, y)
-                
-                if self.map[y][x] == '.':
-                    self.map[y][x] = ' '
+                tile = tiles[y * width + x]
+                if tile == WALL_TILE:
                     break
-        
+                affected_cells.append((x, y))
+                if tile == BRICK_TILE:
+                    break
+        return affected_cells
+
+    def process_server_side_explosion(self, start_x, start_y):
+        affected_cells = self.blast_cells(start_x, start_y)
+        for x, y in affected_cells:
+            self._check_collisions(x, y)
+            if self.tiles[y * self.map_info.width + x] == BRICK_TILE:
+                self.set_tile(x, y, ' ')
+                self.bricks_left -= 1
         return affected_cells
 
     def _check_collisions(self, x, y):
-        for player in self.players.values():
-            if player.alive and player.x == x and player.y == y:
-                player.alive = False
-                print(f"Игрок '{player.name}' погиб.")
+        # В индексе только живые игроки - после взрыва клетка пустеет целиком
+        for player in self.player_cells.pop((x, y), ()):
+            player.alive = False
+            player.mark_dirty()
+            log.debug("Игрок '%s' погиб.", player.name)
+
+    def get_time_remaining(self):
+        if self.state == "IN_PROGRESS" and self.round_start_tick is not None:
+            return (ROUND_DURATION_TICKS - (self.tick - self.round_start_tick)) * GAME_TICK_RATE
+        return None
 
     def get_state(self):
-        time_remaining = None
-        if self.state == "IN_PROGRESS" and self.round_start_time:
-            time_remaining = ROUND_DURATION - (time.time() - self.round_start_time)
-        return {
+        return StateFrame(self, {
             "state": self.state,
             "winner": self.winner,
-            "time_remaining": time_remaining,
-            "map": self.map,
+            "time_remaining": self.get_time_remaining(),
+            "map": self.map_rows(),
             "players": [p.to_dict() for p in self.players.values()],
-            "bombs": [b.to_dict() for b in self.bombs]
+            "bombs": [b.to_dict() for b in self.bombs.values()]
             # Explosions больше нет в state, они летят через events_to_send
+        })
+
+    def take_events(self):
+        """Возвращает накопленные с прошлой рассылки события и очищает очередь."""
+        events, self.events_to_send = self.events_to_send, []
+        return events
+
+    def take_changed_tiles(self):
+        """Возвращает изменения карты с прошлого вызова и сбрасывает их."""
+        map_reset, changed_tiles = self.map_reset, self.changed_tiles
+        self.map_reset, self.changed_tiles = False, []
+        return map_reset, changed_tiles
+
+class StateFrame(dict):
+    """Полный game_state из Game.get_state().
+
+    Для бинарного кодека и инструментов это обычный словарь, а JSON-сообщение
+    to_json() склеивается из кэшированных кусков игры: строк карты, игроков и
+    бомб. Заново кодируются только скалярные поля (state, winner, time_remaining,
+    seq), так что без изменений на поле кадр почти ничего не стоит. Результат
+    совпадает с json.dumps({"type": "game_state", "payload": frame}).
+    """
+    def __init__(self, game, fields):
+        super().__init__(fields)
+        self.game = game
+
+    def to_json(self):
+        game = self.game
+        fragments = {
+            "map": game.map_json,
+            "players": lambda: "[" + ", ".join(p.to_json() for p in game.players.values()) + "]",
+            "bombs": lambda: "[" + ", ".join(b.to_json() for b in game.bombs.values()) + "]",
         }
+        payload = ", ".join(f'"{key}": {fragments[key]() if key in fragments else json.dumps(value)}'
+                            for key, value in self.items())
+        return '{"type": "game_state", "payload": {' + payload + '}}'
+
+# --- Дельта-протокол ---
+class DeltaTracker:
+    """Превращает состояние игры в последовательность дельт с номерами.
+
+    Клиент с дельта-протоколом сначала получает ключевой кадр (полный game_state
+    с полем seq), а затем каждый тик только изменившиеся клетки, игроков и бомбы.
+    Если клиент видит пропуск в seq, он присылает {"type": "resync"} и получает
+    новый ключевой кадр.
+    """
+    def __init__(self):
+        self.seq = 0
+        self.prev_players = {}
+        self.prev_bombs = set()
+        self.prev_meta = (None, None)
+
+    def build(self, game, changes=None):
+        """Снимает изменения за тик. Возвращает (seq, delta или None, если нужен ключевой кадр).
+
+        changes - (map_reset, changed_tiles), если их уже забрали у game (несколько трекеров на комнату).
+        """
+        self.seq += 1
+        map_reset, changed_tiles = changes if changes is not None else game.take_changed_tiles()
+
+        players = {p.id: p.to_dict() for p in game.players.values()}
+        bombs = set(game.bombs)
+        meta = (game.state, game.winner)
+
+        delta = None
+        if not map_reset:
+            delta = {"seq": self.seq, "time_remaining": game.get_time_remaining()}
+            if meta != self.prev_meta:
+                delta["state"], delta["winner"] = meta
+            if changed_tiles:
+                delta["tiles"] = [[x, y, game.tile(x, y)] for x, y in set(changed_tiles)]
+            # Словари игроков кэшируются, пока игрок не изменился, - достаточно сравнить объекты
+            changed_players = [p for pid, p in players.items() if self.prev_players.get(pid) is not p]
+            if changed_players:
+                delta["players"] = changed_players
+            removed_players = [pid for pid in self.prev_players if pid not in players]
+            if removed_players:
+                delta["removed_players"] = removed_players
+            if bombs != self.prev_bombs:
+                delta["bombs_added"] = [{"x": x, "y": y} for x, y in bombs - self.prev_bombs]
+                delta["bombs_removed"] = [{"x": x, "y": y} for x, y in self.prev_bombs - bombs]
+
+        self.prev_players, self.prev_bombs, self.prev_meta = players, bombs, meta
+        return self.seq, delta
+
+    def is_unchanged(self, game, changes):
+        """True, если дельта была бы пустой: карта, состояние, игроки и бомбы те же, что в прошлом кадре.
+
+        time_remaining не сравнивается - вне IN_PROGRESS он всегда None.
+        """
+        map_reset, changed_tiles = changes
+        if map_reset or changed_tiles or (game.state, game.winner) != self.prev_meta:
+            return False
+        # Измененный игрок сбросил кэш (None), а неизмененный отдает тот же словарь - хватает
+        # сравнения списков, которое для одинаковых объектов не заглядывает внутрь
+        return ([p.cached_dict for p in game.players.values()] == list(self.prev_players.values())
+                and game.bombs.keys() == self.prev_bombs)
+
+def _exposed_cells(rect, old):
+    """Клетки окна rect, которых не было в окне old."""
+    x0, y0, x1, y1 = rect
+    ox0, oy0, ox1, oy1 = old
+    for y in range(y0, y1):
+        if oy0 <= y < oy1:
+            xs = itertools.chain(range(x0, min(x1, ox0)), range(max(x0, ox1), x1))
+        else:
+            xs = range(x0, x1)
+        for x in xs:
+            yield x, y
+
+class AreaOfInterest:
+    """Окно карты вокруг игрока: на больших картах игрок получает только его.
+
+    Ключевой кадр содержит клетки окна и поле view с его положением и размером
+    карты, дельты - изменения внутри окна, а когда окно сдвигается, еще и
+    открывшиеся клетки. Игроки и бомбы вне окна не отправляются (ушедший из окна
+    игрок приходит в removed_players). Так размер кадров и время их кодирования
+    зависят от размера окна, а не карты.
+    """
+    def __init__(self, width=AOI_WIDTH, height=AOI_HEIGHT):
+        self.width, self.height = width, height
+        self.rect = None # (x0, y0, x1, y1), правая и нижняя границы не включаются
+        self.prev_players = {}
+        self.prev_bombs = set()
+        self.prev_meta = (None, None)
+
+    def locate(self, game, player):
+        """Окно с игроком в центре, прижатое к краям карты."""
+        map_width, map_height = game.map_info.width, game.map_info.height
+        width, height = min(self.width, map_width), min(self.height, map_height)
+        center_x, center_y = (player.x, player.y) if player is not None else (map_width // 2, map_height // 2)
+        x0 = min(max(0, center_x - width // 2), map_width - width)
+        y0 = min(max(0, center_y - height // 2), map_height - height)
+        return x0, y0, x0 + width, y0 + height
+
+    def build(self, game, player_id, seq, players, changes):
+        """Дельта для игрока за тик или None, если нужен ключевой кадр.
+
+        players - словари всех игроков за тик (одни на комнату), changes - (map_reset, changed_tiles).
+        """
+        map_reset, changed_tiles = changes
+        rect = self.locate(game, game.players.get(player_id))
+        x0, y0, x1, y1 = rect
+        visible_players = {pid: p for pid, p in players.items()
+                           if pid == player_id or (x0 <= p["x"] < x1 and y0 <= p["y"] < y1)}
+        visible_bombs = {(x, y) for x, y in game.bombs if x0 <= x < x1 and y0 <= y < y1}
+        meta = (game.state, game.winner)
+
+        delta = None
+        if not map_reset and self.rect is not None:
+            delta = {"seq": seq, "time_remaining": game.get_time_remaining()}
+            if meta != self.prev_meta:
+                delta["state"], delta["winner"] = meta
+            tiles = {(x, y) for x, y in changed_tiles if x0 <= x < x1 and y0 <= y < y1}
+            if rect != self.rect:
+                tiles.update(_exposed_cells(rect, self.rect))
+            if tiles:
+                delta["tiles"] = [[x, y, game.tile(x, y)] for x, y in tiles]
+            changed_players = [p for pid, p in visible_players.items() if self.prev_players.get(pid) is not p]
+            if changed_players:
+                delta["players"] = changed_players
+            removed_players = [pid for pid in self.prev_players if pid not in visible_players]
+            if removed_players:
+                delta["removed_players"] = removed_players
+            if visible_bombs != self.prev_bombs:
+                delta["bombs_added"] = [{"x": x, "y": y} for x, y in visible_bombs - self.prev_bombs]
+                delta["bombs_removed"] = [{"x": x, "y": y} for x, y in self.prev_bombs - visible_bombs]
+
+        self.rect, self.prev_players, self.prev_bombs, self.prev_meta = rect, visible_players, visible_bombs, meta
+        return delta
+
+    def get_state(self, game):
+        """Ключевой кадр окна, снятого последним build()."""
+        x0, y0, x1, y1 = self.rect
+        return {
+            "state": game.state,
+            "winner": game.winner,
+            "time_remaining": game.get_time_remaining(),
+            "map": [list(game.row(y)[x0:x1]) for y in range(y0, y1)],
+            "players": list(self.prev_players.values()),
+            "bombs": [{"x": x, "y": y} for x, y in self.prev_bombs],
+            "view": {"x": x0, "y": y0, "map_width": game.map_info.width, "map_height": game.map_info.height},
+        }
+
+    def filter_events(self, events):
+        """Взрывы, задевшие окно."""
+        x0, y0, x1, y1 = self.rect
+        return [event for event in events
+                if any(x0 <= cell["x"] < x1 and y0 <= cell["y"] < y1 for cell in event["payload"]["cells"])]
+
+# --- Метрики ---
+METRICS = metrics.MetricsRegistry()
+TICK_DURATION = METRICS.histogram("bomberman_tick_duration_seconds", "Время одного прохода цикла: update всех комнат и рассылка")
+GET_STATE_DURATION = METRICS.histogram("bomberman_get_state_seconds", "Время Game.get_state()")
+JSON_ENCODE_DURATION = METRICS.histogram("bomberman_json_encode_seconds", "Время json.dumps сообщений рассылки")
+BINARY_ENCODE_DURATION = METRICS.histogram("bomberman_binary_encode_seconds", "Время бинарного кодирования сообщений рассылки")
+INPUTS_TOTAL = METRICS.counter("bomberman_inputs_total", "Принято сообщений ввода от игроков")
+INPUTS_MERGED_TOTAL = METRICS.counter("bomberman_inputs_merged_total", "Действий, схлопнутых с предыдущим в том же тике")
+INPUTS_DROPPED_TOTAL = METRICS.counter("bomberman_inputs_dropped_total", "Отброшенных действий: сверх MAX_INPUTS_PER_TICK или некорректных")
+BYTES_SENT_TOTAL = METRICS.counter("bomberman_bytes_sent_total", "Отправлено байт всем клиентам")
+MESSAGES_SENT_TOTAL = METRICS.counter("bomberman_messages_sent_total", "Отправлено сообщений всем клиентам")
+ROOM_FAILURES_TOTAL = METRICS.counter("bomberman_room_failures_total", "Комнат, закрытых из-за ошибки в тике или рассылке")
+
+def collect_runtime_metrics():
+    """Метрики, которые дешевле посчитать в момент запроса, чем обновлять на каждом тике."""
+    rooms = list(ROOMS.values())
+    clients = [(room, c) for room in rooms for c in list(room.player_clients.values()) + list(room.spectator_clients)]
+    per_room = lambda value: [({"room": room.id}, value(room)) for room in rooms]
+    per_client = lambda value: [({"room": room.id, "client": c.label}, value(c)) for room, c in clients]
+    return [
+        ("bomberman_rooms", "gauge", "Открытых комнат", [({}, len(rooms))]),
+        ("bomberman_players", "gauge", "Подключенных игроков", per_room(lambda r: len(r.player_clients))),
+        ("bomberman_spectators", "gauge", "Подключенных наблюдателей", per_room(lambda r: len(r.spectator_clients))),
+        ("bomberman_bombs_alive", "gauge", "Бомб на поле", per_room(lambda r: len(r.game.bombs))),
+        ("bomberman_bots", "gauge", "Ботов в комнате", per_room(lambda r: len(r.bots.players))),
+        ("bomberman_client_queue_depth", "gauge", "Неотправленных сообщений в очереди клиента", per_client(lambda c: c.queue_depth())),
+        ("bomberman_client_bytes_sent_total", "counter", "Отправлено байт клиенту", per_client(lambda c: c.bytes_sent)),
+        ("bomberman_client_messages_sent_total", "counter", "Отправлено сообщений клиенту", per_client(lambda c: c.messages_sent)),
+        ("bomberman_client_coalesced_frames_total", "counter", "Кадров состояния, замененных более свежими", per_client(lambda c: c.coalesced_frames)),
+        ("bomberman_client_dropped_messages_total", "counter", "Сообщений, выброшенных из-за переполненной очереди", per_client(lambda c: c.dropped_messages)),
+        ("bomberman_client_inputs_merged_total", "counter", "Действий клиента, схлопнутых в тике", per_client(lambda c: c.inputs_merged)),
+        ("bomberman_client_inputs_dropped_total", "counter", "Действий клиента, отброшенных сверх лимита на тик или некорректных", per_client(lambda c: c.inputs_dropped)),
+        ("bomberman_ticks_total", "counter", "Выполнено тиков симуляции", [({}, TICK_SCHEDULER.ticks)]),
+        ("bomberman_late_ticks_total", "counter", "Тиков, начатых позже срока", [({}, TICK_SCHEDULER.late_ticks)]),
+        ("bomberman_skipped_ticks_total", "counter", "Тиков, выброшенных без симуляции", [({}, TICK_SCHEDULER.skipped_ticks)]),
+    ]
+
+METRICS.add_collector(collect_runtime_metrics)
+
+# --- Соединения ---
+class ClientConnection:
+    """Websocket клиента со своей очередью отправки.
+
+    Игровой цикл никогда не ждет сеть: send()/send_state() только кладут сообщение
+    в очередь, а отправляет его отдельная задача-писатель. Из кадров состояния
+    важен только последний, поэтому неотправленный кадр просто заменяется новым.
+    Если клиент не принимает данные дольше SLOW_CLIENT_TIMEOUT, его отключают.
+    """
+    def __init__(self, websocket, delta=False, encoding="json", label=None):
+        self.websocket = websocket
+        if label is None and websocket.remote_address:
+            label = ":".join(str(part) for part in websocket.remote_address[:2])
+        self.label = label # Имя клиента в метриках
+        self.delta = delta # Клиент попросил дельта-протокол при join
+        self.encoding = encoding # "json" или "binary" (см. protocol.py)
+        self.needs_keyframe = delta # На ближайшем тике нужен ключевой кадр
+        self.queue = deque() # События и служебные сообщения, отправляются по порядку
+        self.pending_state = None # Последний еще не отправленный кадр состояния
+        self.coalesced_frames = 0 # Кадров состояния, замененных более свежими
+        self.dropped_messages = 0 # Сообщений, выброшенных из-за переполненной очереди
+        self.inputs_merged = 0 # Действий игрока, схлопнутых с предыдущим в том же тике
+        self.inputs_dropped = 0 # Действий сверх MAX_INPUTS_PER_TICK и некорректных
+        self.acked_input = None # Последний seq ввода, о котором клиенту уже сообщили
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.closed = False
+        self._last_progress = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    @property
+    def remote_address(self):
+        return self.websocket.remote_address
+
+    def send(self, message):
+        if self.closed: return
+        if len(self.queue) >= CLIENT_QUEUE_LIMIT:
+            self.dropped_messages += 1
+            self._check_stalled()
+        else:
+            self.queue.append(message)
+        self._wakeup.set()
+
+    def send_state(self, message):
+        if self.closed: return
+        if self.pending_state is not None:
+            self.coalesced_frames += 1
+            self._check_stalled()
+        self.pending_state = message
+        self._wakeup.set()
+
+    def has_pending_state(self):
+        return self.pending_state is not None
+
+    def queue_depth(self):
+        return len(self.queue) + (self.pending_state is not None)
+
+    def _check_stalled(self):
+        if time.monotonic() - self._last_progress > SLOW_CLIENT_TIMEOUT:
+            log.warning("Клиент %s не успевает принимать данные, отключаем.", self.remote_address)
+            self.disconnect(1008, "Client too slow")
+
+    def disconnect(self, code, reason):
+        """Отключает клиента из игрового цикла: неотправленное выбрасывается, закрытие идет в фоне."""
+        self.closed = True
+        self.queue.clear()
+        self.pending_state = None
+        asyncio.create_task(self.websocket.close(code=code, reason=reason))
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.queue or self.pending_state is not None:
+                    if self.queue:
+                        message = self.queue.popleft()
+                    else:
+                        message, self.pending_state = self.pending_state, None
+                    await self.websocket.send(message)
+                    self._last_progress = time.monotonic()
+                    self.bytes_sent += len(message)
+                    self.messages_sent += 1
+                    BYTES_SENT_TOTAL.inc(len(message))
+                    MESSAGES_SENT_TOTAL.inc()
+                self._last_progress = time.monotonic()
+        except websockets.exceptions.ConnectionClosed:
+            self.closed = True
+
+    def close(self):
+        self.closed = True
+        self._writer.cancel()
+
+BINARY_ENCODERS = {
+    "explosion_events": protocol.encode_events,
+    "game_state": protocol.encode_keyframe,
+    "game_state_delta": protocol.encode_delta,
+}
+
+def encode_message(kind, payload, encoding):
+    start = time.perf_counter()
+    if encoding == "binary":
+        message = BINARY_ENCODERS[kind](payload)
+        BINARY_ENCODE_DURATION.observe(time.perf_counter() - start)
+        return message
+    if kind == "explosion_events":
+        # События исторически уходят JSON-списком без обертки
+        message = json.dumps(payload)
+    elif isinstance(payload, StateFrame):
+        message = payload.to_json()
+    else:
+        message = json.dumps({"type": kind, "payload": payload})
+    JSON_ENCODE_DURATION.observe(time.perf_counter() - start)
+    return message
+
+def encode_for_clients(clients, kind, payload):
+    """Пары (клиент, сообщение); каждое сообщение кодируется один раз на кодировку."""
+    encoded = {}
+    for client in clients:
+        if client.encoding not in encoded:
+            encoded[client.encoding] = encode_message(kind, payload, client.encoding)
+        yield client, encoded[client.encoding]
+
+# --- Комнаты ---
+def send_frame(recipients, events, seq, delta, get_state):
+    """Ставит в очереди получателей события и кадр состояния; каждое сообщение
+    кодируется один раз на формат, сколько бы ни было получателей.
+
+    get_state() вызывается, только если кому-то нужен полный снимок.
+    """
+    # 1. События (взрывы), накопленные за все тики с прошлого кадра
+    if events:
+        for client, message in encode_for_clients(recipients, "explosion_events", events):
+            client.send(message)
+
+    # 2. Состояние: полный снимок старым клиентам и тем, кому нужен ключевой кадр.
+    # Если прошлая дельта клиента еще не ушла, она будет заменена - без нее следующая
+    # дельта бессмысленна, поэтому такой клиент тоже получает ключевой кадр.
+    full_recipients, delta_recipients = [], []
+    for client in recipients:
+        if client.delta and not client.needs_keyframe and delta is not None and not client.has_pending_state():
+            delta_recipients.append(client)
+        else:
+            full_recipients.append(client)
+            client.needs_keyframe = False
+
+    if full_recipients:
+        state = get_state()
+        state["seq"] = seq
+        for client, message in encode_for_clients(full_recipients, "game_state", state):
+            client.send_state(message)
+    if delta_recipients:
+        for client, message in encode_for_clients(delta_recipients, "game_state_delta", delta):
+            client.send_state(message)
+
+class Room:
+    """Отдельный матч: свой экземпляр Game и свои наборы клиентов (ClientConnection)."""
+    def __init__(self, room_id):
+        self.id = room_id
+        self.game = Game()
+        self.player_clients = {}
+        self.spectator_clients = set()
+        self.delta_tracker = DeltaTracker()
+        self.areas = {} # id игрока -> AreaOfInterest (только на картах больше окна)
+        # Отдельный поток кадров для наблюдателей (см. broadcast_spectators)
+        self.spectator_tracker = DeltaTracker()
+        self.spectator_map_reset, self.spectator_tiles, self.spectator_events = True, [], []
+        self.next_spectator_tick = 0
+        # Вне матча кадр уходит только при изменениях, а без них - не реже HEARTBEAT_TICKS
+        self.next_heartbeat_tick, self.next_spectator_heartbeat_tick = 0, 0
+        self.bots = bots.BotController(self.game)
+        self.lonely_since = None # Тик, с которого готовому игроку не с кем начать матч
+        if REPLAY_DIR:
+            replay.ReplayRecorder(REPLAY_DIR, room_id).attach(self.game)
+
+    def close(self):
+        # Дописывает на диск повтор текущего матча
+        if self.game.recorder is not None: self.game.recorder.close()
+
+    def is_empty(self):
+        return not self.player_clients and not self.spectator_clients and not self.bots.persistent
+
+    def update(self):
+        if BOT_FILL_DELAY_TICKS is not None: self.fill_with_bots()
+        self.bots.think()
+        self.game.update()
+
+    def fill_with_bots(self):
+        """Если игрок готов, но начать не с кем, через BOT_FILL_DELAY к нему приходят боты."""
+        game = self.game
+        lonely = (game.state == "WAITING" and self.player_clients and len(game.players) < MIN_PLAYERS_TO_START
+                  and all(p.ready for p in game.players.values()))
+        if not lonely:
+            self.lonely_since = None
+        elif self.lonely_since is None:
+            self.lonely_since = game.tick
+        elif game.tick - self.lonely_since >= BOT_FILL_DELAY_TICKS:
+            self.lonely_since = None
+            self.bots.fill(BOT_FILL_PLAYERS)
+            log.info("В комнату '%s' добавлены боты: %d.", self.id, len(self.bots.players))
+
+    def can_accept_player(self):
+        return self.game.state == "WAITING" and len(self.game.players) < self.game.map_info.capacity
+
+    def uses_areas(self):
+        return self.game.map_info.width > AOI_WIDTH or self.game.map_info.height > AOI_HEIGHT
+
+    def get_state(self):
+        start = time.perf_counter()
+        state = self.game.get_state()
+        GET_STATE_DURATION.observe(time.perf_counter() - start)
+        return state
+
+    def is_quiet(self, tracker, clients, changes, events, heartbeat_tick):
+        """Можно ли пропустить кадр: в лобби и после матча (без физики) ничего не изменилось,
+        никто не ждет ключевого кадра и до очередного пульса еще есть время."""
+        return (self.game.state != "IN_PROGRESS" and not events and self.game.tick < heartbeat_tick
+                and not any(client.needs_keyframe for client in clients)
+                and tracker.is_unchanged(self.game, changes))
+
+    def broadcast_state(self):
+        """Ставит события и состояние тика в очереди клиентов; сеть здесь не ждем."""
+        changes = self.game.take_changed_tiles()
+        events = self.game.take_events()
+        # Подтверждение ввода всегда уходит вместе с кадром, поэтому тоже отменяет пропуск
+        acked = self.send_input_acks()
+        if not acked and self.is_quiet(self.delta_tracker, self.player_clients.values(), changes, events, self.next_heartbeat_tick):
+            # Пропущенный кадр не занимает seq: дельта к нему была бы пустой
+            self.broadcast_spectators(changes, events)
+            return
+        self.next_heartbeat_tick = self.game.tick + HEARTBEAT_TICKS
+        # Дельты снимаем каждый тик с изменениями, даже без получателей, чтобы база не устаревала
+        seq, delta = self.delta_tracker.build(self.game, changes)
+        if self.player_clients:
+            if self.uses_areas():
+                self.broadcast_areas(seq, delta, changes, events)
+            else:
+                # Смена карты всегда дает ключевой кадр, так что окна можно просто забыть
+                self.areas.clear()
+                send_frame(list(self.player_clients.values()), events, seq, delta, self.get_state)
+        self.broadcast_spectators(changes, events)
+
+    def broadcast_areas(self, seq, delta, changes, events):
+        """Большая карта: каждый игрок получает только свое окно, и кадр кодируется для каждого отдельно.
+
+        Окно (поле view) понимают только клиенты с дельта-протоколом; старые клиенты
+        без него (в том числе iOS) получают, как и раньше, всю карту."""
+        players = self.delta_tracker.prev_players # Словари игроков за этот тик, уже снятые общим трекером
+        legacy_clients = [client for client in self.player_clients.values() if not client.delta]
+        if legacy_clients:
+            send_frame(legacy_clients, events, seq, delta, self.get_state)
+        for client_id, client in self.player_clients.items():
+            if not client.delta: continue
+            area = self.areas.get(client_id)
+            if area is None:
+                area = self.areas[client_id] = AreaOfInterest()
+            delta = area.build(self.game, client_id, seq, players, changes)
+            send_frame([client], area.filter_events(events), seq, delta, lambda area=area: area.get_state(self.game))
+
+    def send_input_acks(self):
+        """Сообщает игрокам, до какого seq их ввод применен. Подтверждение уходит
+        перед кадром, в котором этот ввод уже учтен (очередь отправляется раньше кадра).
+        Возвращает True, если что-то отправлено."""
+        sent = False
+        for client_id, client in self.player_clients.items():
+            player = self.game.players.get(client_id)
+            if player is not None and player.input_seq != client.acked_input:
+                client.acked_input = player.input_seq
+                client.send(json.dumps({"type": "input_ack", "payload": player.input_seq}))
+                sent = True
+        return sent
+
+    def broadcast_spectators(self, changes, events):
+        """Наблюдатели получают кадры реже игроков (SPECTATOR_RATE): изменения карты
+        и взрывы копятся между кадрами, а каждый кадр кодируется один раз на всех."""
+        if not self.spectator_clients:
+            # Без наблюдателей ничего не копим; первый кадр после паузы будет ключевым
+            self.spectator_map_reset, self.spectator_tiles, self.spectator_events = True, [], []
+            return
+        self.spectator_map_reset = self.spectator_map_reset or changes[0]
+        self.spectator_tiles.extend(changes[1])
+        self.spectator_events.extend(events)
+        if self.game.tick < self.next_spectator_tick: return
+        if self.is_quiet(self.spectator_tracker, self.spectator_clients, (self.spectator_map_reset, self.spectator_tiles),
+                         self.spectator_events, self.next_spectator_heartbeat_tick):
+            return
+
+        self.next_spectator_tick = self.game.tick + SPECTATOR_TICK_INTERVAL
+        self.next_spectator_heartbeat_tick = self.game.tick + HEARTBEAT_TICKS
+        seq, delta = self.spectator_tracker.build(self.game, (self.spectator_map_reset, self.spectator_tiles))
+        events = self.spectator_events
+        self.spectator_map_reset, self.spectator_tiles, self.spectator_events = False, [], []
+        send_frame(list(self.spectator_clients), events, seq, delta, self.get_state)
+
+# Реестр комнат: id -> Room
+ROOMS = {}
+
+# --- Данные игрока из join ---
+# Имя и цвет попадают в кадры всех клиентов комнаты, поэтому приводятся к типам кодеков здесь
+def clean_player_name(name):
+    if name is None: return "Аноним"
+    return str(name)[:MAX_NAME_LENGTH]
+
+def _color_channel(value, default):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return default
+    return min(1.0, max(0.0, float(value)))
+
+def clean_player_color(color_data):
+    if not color_data or not isinstance(color_data, dict): return None
+    return {
+        "red": _color_channel(color_data.get("red"), 1.0),
+        "green": _color_channel(color_data.get("green"), 0.0),
+        "blue": _color_channel(color_data.get("blue"), 0.0)
+    }
+
+# id комнаты, который можно запросить в join: он попадает в имена файлов повторов и метки метрик
+ROOM_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,32}")
+
+def is_valid_room_id(room_id):
+    return isinstance(room_id, str) and ROOM_ID_PATTERN.fullmatch(room_id) is not None
+
+def get_or_create_room(room_id=None, role="player"):
+    """Возвращает комнату по id (создавая её при необходимости) или подбирает подходящую."""
+    if room_id:
+        room_id = str(room_id)
+        if room_id not in ROOMS:
+            ROOMS[room_id] = Room(room_id)
+            log.info("--- Создана комната '%s' ---", room_id)
+            TICK_SCHEDULER.wake()
+        return ROOMS[room_id]
+
+    if role == "player":
+        candidates = [room for room in ROOMS.values() if room.can_accept_player()]
+    else:
+        candidates = list(ROOMS.values())
+    if candidates:
+        # Предпочитаем самые заполненные комнаты, чтобы матчи быстрее набирались
+        return max(candidates, key=lambda room: len(room.game.players))
+
+    return get_or_create_room(uuid.uuid4().hex[:8])
+
+def close_room_if_empty(room):
+    if room.is_empty() and ROOMS.get(room.id) is room:
+        del ROOMS[room.id]
+        room.close()
+        log.info("--- Комната '%s' закрыта ---", room.id)
 
 # --- Логика WebSocket ---
-PLAYER_CLIENTS = {}
-SPECTATOR_CLIENTS = set()
+class TickScheduler:
+    """Планировщик с фиксированным шагом по монотонным часам.
+
+    Каждый тик имеет свой срок (deadline); сон считается до срока следующего тика,
+    поэтому время на update и рассылку не сдвигает частоту. Если цикл отстал,
+    пропущенные тики либо досчитываются (не более MAX_CATCH_UP_TICKS за проход),
+    либо пропускаются - в зависимости от политики.
+    """
+    def __init__(self, interval=GAME_TICK_RATE, policy=TICK_OVERRUN_POLICY, max_catch_up=MAX_CATCH_UP_TICKS, clock=time.monotonic):
+        if policy not in ("catch_up", "skip"):
+            raise ValueError(f"Неизвестная политика перегрузки тиков: {policy}")
+        self.interval = interval
+        self.clock = clock
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        self.ticks = 0 # Всего выполнено тиков симуляции
+        self.late_ticks = 0 # Тиков, начатых позже своего срока
+        self.skipped_ticks = 0 # Тиков, выброшенных без симуляции
+        self.max_lag = 0.0 # Наибольшее опоздание в секундах
+        self._reported = (0, 0, 0)
+        self._next_report = None
+        self.observer = None # observer(длительность, шагов, опоздание) после каждого прохода (профайлер)
+        self._wake = None # asyncio.Event, которого ждет уснувший цикл
+
+    def wake(self):
+        """Будит уснувший цикл: появилась комната, клиент или ввод."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _wait_wake(self, timeout=None):
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, update, broadcast, is_idle=None, is_quiet=None):
+        """update() - один шаг симуляции, broadcast() - рассылка после шагов (не ждет сеть).
+
+        Если is_idle() вернул True, цикл не тикает вовсе, пока его не разбудит wake().
+        Если is_quiet() вернул True (нет физики, которой нужен каждый тик), цикл спит
+        до QUIET_WAKE_INTERVAL или до wake(), а накопившиеся тики считает разом.
+        """
+        self._wake = asyncio.Event()
+        deadline = self.clock()
+        self._next_report = deadline + TICK_REPORT_INTERVAL
+        coasting = False
+        while True:
+            if is_idle is not None and is_idle():
+                log.debug("Планировщик: симулировать нечего, цикл уснул.")
+                await self._wait_wake()
+                # Время сна - не опоздание: отсчет сроков начинается заново
+                deadline = self.clock()
+                continue
+            now = self.clock()
+            lag = now - deadline
+            steps = 1
+            if coasting:
+                # Тики, проспанные без физики, досчитываются все и опозданием не считаются
+                steps += max(0, int(lag / self.interval))
+            elif lag > self.interval * LATE_TICK_TOLERANCE:
+                self.late_ticks += 1
+                self.max_lag = max(self.max_lag, lag)
+                behind = int(lag / self.interval) # Сколько тиков целиком уже просрочено
+                catch_up = min(behind, self.max_catch_up) if self.policy == "catch_up" else 0
+                skipped = behind - catch_up
+                steps += catch_up
+                self.skipped_ticks += skipped
+                deadline += skipped * self.interval
 
-load_maps()
-GAME = Game()
+            tick_start = time.perf_counter()
+            for _ in range(steps):
+                update()
+            self.ticks += steps
+            broadcast()
+            duration = time.perf_counter() - tick_start
+            TICK_DURATION.observe(duration)
+            if self.observer is not None:
+                self.observer(duration, steps, lag)
 
-async def broadcast_state():
-    if not PLAYER_CLIENTS and not SPECTATOR_CLIENTS: return
-    
-    all_recipients = list(PLAYER_CLIENTS.values()) + list(SPECTATOR_CLIENTS)
-    if not all_recipients: return
+            deadline += steps * self.interval
+            self._report(now)
+            coasting = is_quiet is not None and is_quiet()
+            if coasting:
+                await self._wait_wake(max(0.0, deadline - self.clock()) + QUIET_WAKE_INTERVAL)
+            # sleep(0) при отставании все равно отдает управление обработчикам сокетов;
+            # разбуженный раньше срока цикл досыпает до него, чтобы тики не шли быстрее
+            await asyncio.sleep(max(0.0, deadline - self.clock()))
+
+    def _report(self, now):
+        if now < self._next_report: return
+        self._next_report = now + TICK_REPORT_INTERVAL
+        ticks, late, skipped = self.ticks, self.late_ticks, self.skipped_ticks
+        prev_ticks, prev_late, prev_skipped = self._reported
+        self._reported = (ticks, late, skipped)
+        if late > prev_late or skipped > prev_skipped:
+            log.warning("Планировщик: за %s сек %d тиков, опоздало %d, пропущено %d, макс. задержка %.1f мс",
+                        TICK_REPORT_INTERVAL, ticks - prev_ticks, late - prev_late, skipped - prev_skipped, self.max_lag * 1000)
+            self.max_lag = 0.0
+
+TICK_SCHEDULER = TickScheduler()
+
+def update_rooms():
+    for room in list(ROOMS.values()):
+        try:
+            room.update()
+        except Exception:
+            fail_room(room, "update")
+
+def broadcast_rooms():
+    for room in list(ROOMS.values()):
+        try:
+            room.broadcast_state()
+        except Exception:
+            fail_room(room, "broadcast_state")
+
+def fail_room(room, phase):
+    """Ошибка одной комнаты не должна останавливать цикл, общий для всех:
+    комната закрывается, ее клиенты отключаются, остальные играют дальше."""
+    log.exception("Ошибка в комнате '%s' (%s), комната закрыта.", room.id, phase)
+    ROOM_FAILURES_TOTAL.inc()
+    if ROOMS.get(room.id) is room:
+        del ROOMS[room.id]
+    for connection in list(room.player_clients.values()) + list(room.spectator_clients):
+        connection.disconnect(1011, "Room failed")
+    try:
+        room.close()
+    except Exception:
+        log.exception("Не удалось закрыть комнату '%s'.", room.id)
 
-    # 1. Отправляем события (взрывы)
-    if GAME.events_to_send:
-        event_batch = json.dumps(GAME.events_to_send)
-        await asyncio.gather(*[client.send(event_batch) for client in all_recipients], return_exceptions=True)
+def rooms_are_quiet():
+    """Ни в одной комнате не идет матч и нет ждущего ввода - тики можно считать пачками."""
+    return all(room.game.state != "IN_PROGRESS" and not room.game.pending_inputs for room in ROOMS.values())
 
-    # 2. Отправляем состояние
-    state = GAME.get_state()
-    message = json.dumps({"type": "game_state", "payload": state})
-    await asyncio.gather(*[client.send(message) for client in all_recipients], return_exceptions=True)
+def profile_targets():
+    """Что профайлер тиков подменяет на время записи: (объект, атрибут, имя фазы)."""
+    targets = [(sys.modules[__name__], "encode_message", "encode")]
+    for room in ROOMS.values():
+        targets.append((room.bots, "think", "bots"))
+        targets.append((room.game, "update", "update"))
+        targets.extend((room.game, name, name) for name in ("update_bombs", "check_endgame", "spawn_random_bomb", "check_win_condition"))
+        targets.append((room, "broadcast_state", "broadcast"))
+        targets.append((room.delta_tracker, "build", "delta_build"))
+        targets.append((room, "broadcast_spectators", "spectators"))
+        targets.append((room.spectator_tracker, "build", "spectator_delta_build"))
+        targets.append((room.game, "get_state", "get_state"))
+    return targets
+
+PROFILER = profiler.Profiler(PROFILE_DIR, TICK_SCHEDULER, profile_targets,
+                             max_seconds=PROFILE_MAX_SECONDS, max_ticks=seconds_to_ticks(PROFILE_MAX_SECONDS))
 
 async def game_loop():
-    while True:
-        GAME.update()
-        await broadcast_state()
-        await asyncio.sleep(GAME_TICK_RATE)
+    # Один общий планировщик тиков для всех комнат
+    # Без комнат нет и клиентов - цикл спит до создания первой комнаты
+    await TICK_SCHEDULER.run(update_rooms, broadcast_rooms, is_idle=lambda: not ROOMS, is_quiet=rooms_are_quiet)
 
 async def handler(websocket):
+    try:
+        message = await websocket.recv()
+    except websockets.exceptions.ConnectionClosed:
+        log.info("Соединение с клиентом потеряно.")
+        return
+    await serve_client(websocket, message)
+
+async def serve_client(websocket, message, room_hint=None):
+    """Обслуживает клиента, начиная с его первого сообщения (join).
+
+    room_hint - комната, которую подобрал матчмейкер (cluster.py), если клиент
+    не просил конкретную; если она уже не принимает игроков, подбираем сами.
+    """
     client_id = None
     client_type = None
+    room = None
+    connection = None
     try:
-        message = await websocket.recv()
         data = json.loads(message)
         
-        if data.get("type") == "join":
+        if isinstance(data, dict) and data.get("type") == "join":
             role = data.get("role", "player")
+            encoding = "binary" if data.get("encoding") == "binary" else "json"
+            room_id, room = data.get("room"), None
+            if room_id and not is_valid_room_id(room_id):
+                await websocket.close(code=1008, reason="Invalid room id")
+                log.info("Отклонено подключение %s: некорректный id комнаты.", websocket.remote_address)
+                return
+            if room_hint and not room_id:
+                room = ROOMS.get(room_hint)
+                if room is None:
+                    room_id = room_hint # Новая комната, id выдал матчмейкер
+                elif role == "player" and not room.can_accept_player():
+                    room = None # Сведения матчмейкера устарели - подбираем сами
+            if room is None:
+                room = get_or_create_room(room_id, role)
             if role == "player":
-                player_name = data.get("name", "Аноним")
-                color_data = data.get("color")
-                color = None
-                if color_data:
-                    color = {
-                        "red": color_data.get("red", 1.0),
-                        "green": color_data.get("green", 0.0),
-                        "blue": color_data.get("blue", 0.0)
-                    }
+                player_name = clean_player_name(data.get("name"))
+                color = clean_player_color(data.get("color"))
                 client_id = str(uuid.uuid4())
                 
-                if GAME.add_player(client_id, player_name, color=color) is None:
-                    await websocket.close(code=1008, reason="Server is full")
-                    print(f"Отклонено подключение для '{player_name}': сервер полон.")
+                room.bots.yield_seat()
+                if room.game.add_player(client_id, player_name, color=color) is None:
+                    await websocket.close(code=1008, reason="Room is full")
+                    log.info("Отклонено подключение для '%s': комната '%s' полна.", player_name, room.id)
                     return
 
                 client_type = "player"
-                PLAYER_CLIENTS[client_id] = websocket
-                await websocket.send(json.dumps({"type": "assign_id", "payload": client_id}))
-                print(f"Игрок '{player_name}' ({client_id}) подключился.")
+                connection = ClientConnection(websocket, delta=bool(data.get("delta")), encoding=encoding, label=client_id)
+                room.player_clients[client_id] = connection
+                connection.send(json.dumps({"type": "assign_id", "payload": client_id}))
+                log.info("Игрок '%s' (%s) подключился к комнате '%s'.", player_name, client_id, room.id)
             else:
-                client_id = websocket
+                connection = ClientConnection(websocket, delta=bool(data.get("delta")), encoding=encoding)
+                client_id = connection
                 client_type = "spectator"
-                SPECTATOR_CLIENTS.add(websocket)
-                print(f"Наблюдатель {websocket.remote_address} подключился.")
+                room.spectator_clients.add(connection)
+                log.info("Наблюдатель %s подключился к комнате '%s'.", websocket.remote_address, room.id)
+            connection.send(json.dumps({"type": "assign_room", "payload": room.id}))
+            TICK_SCHEDULER.wake() # Новому клиенту нужен ключевой кадр, не дожидаясь пульса
         else:
             return
 
         if client_type == "player":
             async for message in websocket:
-                action = json.loads(message)
-                GAME.handle_input(client_id, action)
+                if isinstance(message, bytes):
+                    try:
+                        action = protocol.decode_input(message)
+                    except (ValueError, struct.error):
+                        continue
+                else:
+                    action = json.loads(message)
+                INPUTS_TOTAL.inc()
+                TICK_SCHEDULER.wake()
+                if isinstance(action, dict) and action.get("type") == "resync":
+                    connection.needs_keyframe = True
+                    continue
+                result = room.game.queue_input(client_id, action)
+                if result == "merged":
+                    INPUTS_MERGED_TOTAL.inc()
+                    connection.inputs_merged += 1
+                elif result == "dropped":
+                    INPUTS_DROPPED_TOTAL.inc()
+                    connection.inputs_dropped += 1
         else:
-            await websocket.wait_closed()
+            # Наблюдатели ничего не присылают, кроме запросов ключевого кадра
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    is_resync = message[:1] == bytes([protocol.MSG_RESYNC])
+                else:
+                    data = json.loads(message)
+                    is_resync = isinstance(data, dict) and data.get("type") == "resync"
+                if is_resync:
+                    connection.needs_keyframe = True
+                    TICK_SCHEDULER.wake()
 
     except (websockets.exceptions.ConnectionClosed, json.JSONDecodeError):
-        print(f"Соединение с {client_type if client_type else 'клиентом'} потеряно.")
+        log.info("Соединение с %s потеряно.", client_type if client_type else 'клиентом')
     finally:
-        if client_type == "player" and client_id in PLAYER_CLIENTS:
-            del PLAYER_CLIENTS[client_id]
-            GAME.remove_player(client_id)
-        elif client_type == "spectator" and client_id in SPECTATOR_CLIENTS:
-            SPECTATOR_CLIENTS.remove(client_id)
-            print(f"Наблюдатель отключился.")
+        if connection is not None:
+            connection.close()
+        if room is not None:
+            if client_type == "player" and client_id in room.player_clients:
+                del room.player_clients[client_id]
+                room.areas.pop(client_id, None)
+                room.game.remove_player(client_id)
+                if not room.player_clients and not room.bots.persistent:
+                    room.bots.remove_all() # Боты доигрывали только ради людей
+            elif client_type == "spectator" and client_id in room.spectator_clients:
+                room.spectator_clients.remove(client_id)
+                log.info("Наблюдатель отключился.")
+            close_room_if_empty(room)
+
+def setup_logging(level=LOG_LEVEL, prefix=""):
+    """Логи пишутся в stdout из отдельного потока: игровой цикл только кладет запись в очередь.
+
+    prefix ставится перед именем логгера (например, номер процесса-воркера).
+    """
+    records = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(f"%(asctime)s %(levelname)s {prefix}%(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(records, stream_handler)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    listener.start()
+    return listener
+
+def create_bot_rooms(count):
+    """Комнаты, где матчи без конца играют одни боты: нагрузка на сервер без клиентов."""
+    for i in range(count):
+        room = get_or_create_room(f"bots-{i}")
+        room.bots.persistent = True
+        room.bots.fill(BOT_FILL_PLAYERS)
+    if count:
+        log.info("Создано комнат с ботами: %d (к ним можно подключиться наблюдателем).", count)
 
 async def main():
-    print("Запуск игрового цикла...")
+    await metrics.serve_metrics(METRICS, METRICS_HOST, METRICS_PORT, PROFILER.routes())
+    create_bot_rooms(BOT_ROOMS)
+    log.info("Запуск игрового цикла...")
     asyncio.create_task(game_loop())
     # Слушаем 0.0.0.0 для доступа из локальной сети
     async with websockets.serve(handler, "0.0.0.0", 8765):
-        print("WebSocket сервер запущен на ws://0.0.0.0:8765")
+        log.info("WebSocket сервер запущен на ws://0.0.0.0:8765")
         await asyncio.Future()
 
 if __name__ == "__main__":
+    log_listener = setup_logging()
     try:
+        load_maps(MAPS_DIR)
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("\nСервер остановлен.")
\ No newline at end of file
+        log.info("Сервер остановлен.")
+    finally:
+        for room in ROOMS.values():
+            room.close()
+        log_listener.stop()
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""Метрики сервера и HTTP-эндпоинт для их чтения.
+
+На горячем пути только счетчики и гистограммы (пара сложений на замер).
+Все, что можно посчитать по текущему состоянию (игроки, очереди, бомбы),
+собирается коллекторами в момент запроса, а не на каждом тике.
+
+    GET /metrics       - текстовый формат Prometheus
+    GET /metrics.json  - то же самое в JSON
+
+На том же порту можно зарегистрировать служебные маршруты (например, профайлер).
+"""
+import asyncio
+import bisect
+import json
+import logging
+from urllib.parse import parse_qsl, urlsplit
+
+log = logging.getLogger("bomberman.metrics")
+
+# Границы корзин по умолчанию (секунды): от 10 мкс до 100 мс
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.0167, 0.025, 0.05, 0.1)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels: return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+class Counter:
+    def __init__(self, name, help):
+        self.name, self.help = name, help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return "counter", [({}, self.value)]
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name, self.help = name, help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        return "histogram", None
+
+    def render(self):
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+    def to_json(self):
+        bounds = [repr(b) for b in self.buckets] + ["+Inf"]
+        return {"count": self.count, "sum": self.sum, "buckets": dict(zip(bounds, self.counts))}
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = [] # Функции -> [(имя, тип, описание, [(метки, значение), ...]), ...]
+
+    def counter(self, name, help):
+        metric = Counter(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def _families(self):
+        for metric in self.metrics:
+            kind, samples = metric.samples()
+            yield metric.name, kind, metric.help, samples, metric
+        for collector in self.collectors:
+            for name, kind, help, samples in collector():
+                yield name, kind, help, samples, None
+
+    def render_prometheus(self):
+        lines = []
+        for name, kind, help, samples, metric in self._families():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                lines.extend(metric.render())
+            else:
+                lines.extend(f"{name}{_format_labels(labels)} {value}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def render_json(self):
+        result = {}
+        for name, kind, help, samples, metric in self._families():
+            if kind == "histogram":
+                result[name] = metric.to_json()
+            elif len(samples) == 1 and not samples[0][0]:
+                result[name] = samples[0][1]
+            else:
+                result[name] = [dict(labels, value=value) for labels, value in samples]
+        return json.dumps(result)
+
+# --- HTTP ---
+async def _handle_http(registry, routes, reader, writer):
+    try:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        # Остаток заголовков не нужен, но его надо вычитать
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        url = urlsplit(request_line[1] if len(request_line) > 1 else "/")
+        path = url.path
+        if path == "/metrics":
+            status, content_type, body = "200 OK", "text/plain; version=0.0.4", registry.render_prometheus()
+        elif path == "/metrics.json":
+            status, content_type, body = "200 OK", "application/json", registry.render_json()
+        elif path in routes:
+            # Маршрут получает параметры запроса и возвращает (статус, тип, тело)
+            status, content_type, body = routes[path](dict(parse_qsl(url.query)))
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", "not found\n"
+        data = body.encode("utf-8")
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_metrics(registry, host, port, routes=None):
+    """Запускает HTTP-эндпоинт метрик на отдельном (обычно локальном) порту."""
+    routes = routes or {}
+    server = await asyncio.start_server(lambda r, w: _handle_http(registry, routes, r, w), host, port)
+    log.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,253 @@
+"""Профайлер сервера по запросу (включается через служебный порт метрик).
+
+    GET /profile/sample?seconds=N  - сэмплировать стек потока игрового цикла N секунд
+    GET /profile/ticks?ticks=N     - записать время фаз каждого из следующих N тиков
+
+Результаты пишутся в папку профилей: *.collapsed - свернутые стеки (понимают
+flamegraph.pl, inferno, speedscope), для режима тиков еще и отчет о медленных тиках.
+
+Выключенный профайлер ничего не стоит: поток-сэмплер живет только во время замера,
+а обертки фаз ставятся на экземпляры на время записи и потом снимаются.
+"""
+import asyncio
+import collections
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+log = logging.getLogger("bomberman.profiler")
+
+SAMPLE_INTERVAL = 0.001 # Период сэмплирования стека, секунды
+SLOW_TICKS_IN_REPORT = 20 # Сколько самых медленных тиков расписывать по фазам
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _timestamp():
+    return time.strftime("%Y%m%d-%H%M%S")
+
+def write_collapsed(path, counts):
+    """counts: {(кадр, ..., кадр): вес} -> строки "кадр;кадр;кадр вес"."""
+    with open(path, "w") as f:
+        for stack, weight in sorted(counts.items()):
+            f.write(f"{';'.join(stack)} {weight}\n")
+
+# --- Сэмплирование стека ---
+class StackSampler:
+    """Из отдельного потока периодически снимает стек потока игрового цикла."""
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+
+    def run(self, seconds):
+        counts = collections.Counter()
+        labels = {} # code -> подпись кадра, чтобы не форматировать одно и то же
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            if stack:
+                counts[tuple(reversed(stack))] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+        return counts
+
+# --- Фазы тиков ---
+class TickRecorder:
+    """Время фаз каждого тика; фазы - методы и функции, подмененные на время записи.
+
+    Вложенность учитывается: update_bombs внутри update попадает в стек
+    "tick;update;update_bombs", а в свернутые стеки пишется собственное время фазы.
+    """
+    def __init__(self, ticks, budget):
+        self.remaining = ticks
+        self.budget = budget # Бюджет тика в секундах; тики дольше считаются медленными
+        self.self_ns = collections.Counter() # стек фаз -> собственное время, нс
+        self.calls = collections.Counter() # фаза -> число вызовов
+        self.covered_ns = 0 # Полное время фаз верхнего уровня
+        self.ticks = [] # (длительность, шагов, опоздание, {фаза: время за тик, нс})
+        self._current = collections.Counter()
+        self._stack = []
+        self._patched = []
+
+    def instrument(self, owner, name, phase):
+        original = getattr(owner, name)
+        had_own = name in vars(owner)
+        self._patched.append((owner, name, had_own, original))
+        setattr(owner, name, self._wrap(phase, original))
+
+    def restore(self):
+        for owner, name, had_own, original in reversed(self._patched):
+            if had_own:
+                setattr(owner, name, original)
+            else:
+                delattr(owner, name)
+        self._patched.clear()
+
+    def _wrap(self, phase, func):
+        stack, current, calls, self_ns = self._stack, self._current, self.calls, self.self_ns
+        def timed(*args, **kwargs):
+            frame = [phase, 0] # имя, время вложенных фаз
+            stack.append(frame)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                stack.pop()
+                path = ("tick",) + tuple(f[0] for f in stack) + (phase,)
+                self_ns[path] += elapsed - frame[1]
+                current[phase] += elapsed
+                calls[phase] += 1
+                if stack:
+                    stack[-1][1] += elapsed
+                else:
+                    self.covered_ns += elapsed
+        return timed
+
+    def on_tick(self, duration, steps, lag):
+        """Вызывается планировщиком после прохода цикла; True - запись закончена."""
+        phases = dict(self._current)
+        self._current.clear()
+        self.ticks.append((duration, steps, lag, phases))
+        self.remaining -= 1
+        return self.remaining <= 0
+
+    def collapsed(self):
+        counts = collections.Counter()
+        for path, ns in self.self_ns.items():
+            counts[path] += ns // 1000
+        # Собственное время тика - все, что не покрыто фазами
+        total = sum(int(duration * 1e9) for duration, _, _, _ in self.ticks)
+        counts[("tick",)] += max(0, total - self.covered_ns) // 1000
+        return counts
+
+    def report(self):
+        lines = []
+        durations = [duration for duration, _, _, _ in self.ticks]
+        count = len(durations)
+        slow = [t for t in self.ticks if t[0] > self.budget]
+        lines.append(f"Тиков записано: {count}, бюджет тика {self.budget * 1000:.2f} мс")
+        if count:
+            ordered = sorted(durations)
+            lines.append(f"Длительность, мс: среднее {sum(durations) / count * 1000:.3f}, "
+                         f"p50 {ordered[count // 2] * 1000:.3f}, p99 {ordered[min(count - 1, count * 99 // 100)] * 1000:.3f}, "
+                         f"макс {ordered[-1] * 1000:.3f}")
+            lines.append(f"Медленных тиков (дольше бюджета): {len(slow)}")
+        lines.append("")
+        lines.append(f"{'фаза':<24}{'вызовов':>10}{'всего, мс':>12}{'среднее, мкс':>15}{'макс за тик, мкс':>19}")
+        totals = collections.Counter()
+        peaks = collections.Counter()
+        for _, _, _, phases in self.ticks:
+            for phase, ns in phases.items():
+                totals[phase] += ns
+                peaks[phase] = max(peaks[phase], ns)
+        for phase, ns in totals.most_common():
+            calls = self.calls[phase]
+            lines.append(f"{phase:<24}{calls:>10}{ns / 1e6:>12.3f}{ns / calls / 1000:>15.1f}{peaks[phase] / 1000:>19.1f}")
+        lines.append("")
+        lines.append(f"Самые медленные тики (до {SLOW_TICKS_IN_REPORT}):")
+        indexed = sorted(enumerate(self.ticks), key=lambda item: item[1][0], reverse=True)
+        for index, (duration, steps, lag, phases) in indexed[:SLOW_TICKS_IN_REPORT]:
+            breakdown = ", ".join(f"{phase} {ns / 1000:.0f}" for phase, ns in sorted(phases.items(), key=lambda p: -p[1]))
+            lines.append(f"  #{index}: {duration * 1000:.3f} мс, шагов {steps}, опоздание {lag * 1000:.1f} мс | мкс: {breakdown}")
+        return "\n".join(lines) + "\n"
+
+# --- Управление ---
+class Profiler:
+    """Запускает замеры по HTTP-запросу; одновременно идет не больше одного замера.
+
+    targets() возвращает, что подменять на время записи тиков: [(объект, атрибут, фаза), ...].
+    Комнаты, созданные во время записи, в замер не попадают.
+    """
+    def __init__(self, output_dir, scheduler, targets, max_seconds=60, max_ticks=3600):
+        self.output_dir = output_dir
+        self.scheduler = scheduler
+        self.targets = targets
+        self.max_seconds = max_seconds
+        self.max_ticks = max_ticks
+        self.busy = False
+
+    def routes(self):
+        return {"/profile/sample": self.handle_sample, "/profile/ticks": self.handle_ticks}
+
+    def _path(self, prefix, suffix):
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f"{prefix}-{_timestamp()}{suffix}")
+
+    def _respond(self, status, payload):
+        return status, "application/json", json.dumps(payload) + "\n"
+
+    def _parse(self, query, name, default, limit):
+        try:
+            value = float(query.get(name, default))
+        except ValueError:
+            return None
+        return value if 0 < value <= limit else None
+
+    def handle_sample(self, query):
+        seconds = self._parse(query, "seconds", 10, self.max_seconds)
+        if seconds is None:
+            return self._respond("400 Bad Request", {"error": f"seconds: от 0 до {self.max_seconds}"})
+        if self.busy:
+            return self._respond("409 Conflict", {"error": "замер уже идет"})
+        self.busy = True
+        path = self._path("sample", ".collapsed")
+        # Обработчик маршрута выполняется в потоке игрового цикла - его и сэмплируем
+        sampler = StackSampler(threading.get_ident())
+        asyncio.get_running_loop().run_in_executor(None, self._run_sampler, sampler, seconds, path)
+        log.info("Сэмплирование игрового цикла на %s сек -> %s", seconds, path)
+        return self._respond("202 Accepted", {"status": "started", "seconds": seconds, "output": [path]})
+
+    def _run_sampler(self, sampler, seconds, path):
+        try:
+            write_collapsed(path, sampler.run(seconds))
+            log.info("Сэмплирование завершено: %d сэмплов -> %s", sampler.samples, path)
+        except Exception:
+            log.exception("Ошибка сэмплирования")
+        finally:
+            self.busy = False
+
+    def handle_ticks(self, query):
+        ticks = self._parse(query, "ticks", 600, self.max_ticks)
+        if ticks is None:
+            return self._respond("400 Bad Request", {"error": f"ticks: от 1 до {self.max_ticks}"})
+        if self.busy:
+            return self._respond("409 Conflict", {"error": "замер уже идет"})
+        self.busy = True
+        recorder = TickRecorder(int(ticks), self.scheduler.interval)
+        for owner, name, phase in self.targets():
+            recorder.instrument(owner, name, phase)
+        prefix = self._path("ticks", "")
+        paths = [prefix + ".collapsed", prefix + ".txt"]
+
+        def observe(duration, steps, lag):
+            if recorder.on_tick(duration, steps, lag):
+                self.scheduler.observer = None
+                recorder.restore()
+                asyncio.get_running_loop().run_in_executor(None, self._write_ticks, recorder, paths)
+        self.scheduler.observer = observe
+        log.info("Запись фаз следующих %d тиков -> %s", recorder.remaining, prefix)
+        return self._respond("202 Accepted", {"status": "started", "ticks": recorder.remaining, "output": paths})
+
+    def _write_ticks(self, recorder, paths):
+        try:
+            write_collapsed(paths[0], recorder.collapsed())
+            with open(paths[1], "w") as f:
+                f.write(recorder.report())
+            log.info("Запись тиков завершена -> %s", paths[1])
+        except Exception:
+            log.exception("Ошибка записи профиля тиков")
+        finally:
+            self.busy = False
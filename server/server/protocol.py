@@ -0,0 +1,305 @@
+"""Компактный бинарный протокол (выбирается полем "encoding": "binary" в join).
+
+Все числа little-endian. Первый байт каждого сообщения - его тип.
+Служебные сообщения (assign_id, assign_room) остаются JSON-текстом,
+бинарными идут только частые: состояние, дельты, взрывы и ввод игроков.
+
+Сервер -> клиент:
+    KEYFRAME   B type, I seq, B state, f time_remaining (NaN = нет), str winner,
+               H width, H height, width*height байт клеток (ASCII-символ клетки),
+               H число игроков + записи игроков, H число бомб + (H x, H y),
+               [H x, H y, H ширина карты, H высота карты] - если это окно большой карты
+    DELTA      B type, I seq, B флаги (DELTA_*), f time_remaining,
+               [B state, str winner], [H число клеток + (H x, H y, B клетка)],
+               [H число игроков + записи], [H число + 16 байт id удаленных],
+               [H число + (H x, H y) новых бомб], [H число + (H x, H y) убранных бомб]
+    EXPLOSIONS B type, H число событий, для каждого H число клеток + (H x, H y)
+
+Запись игрока: 16 байт UUID, H x, H y, B флаги (alive, ready, есть цвет),
+B r, B g, B b, str name. Строка str - H длина (0xFFFF = None) + UTF-8.
+
+Клиент -> сервер:
+    MOVE       B type, b dx, b dy, [I seq]
+    PLACE_BOMB B type
+    READY      B type
+    RESYNC     B type
+
+seq в MOVE необязателен: его присылают клиенты с предсказанием движения,
+сервер отвечает JSON-сообщением input_ack с последним примененным seq.
+"""
+import math
+import struct
+import uuid
+
+MSG_KEYFRAME = 0x01
+MSG_DELTA = 0x02
+MSG_EXPLOSIONS = 0x03
+
+MSG_MOVE = 0x10
+MSG_PLACE_BOMB = 0x11
+MSG_READY = 0x12
+MSG_RESYNC = 0x13
+
+GAME_STATES = ["WAITING", "IN_PROGRESS", "GAME_OVER"]
+
+# Какие необязательные блоки есть в дельте
+DELTA_META = 1 << 0
+DELTA_TILES = 1 << 1
+DELTA_PLAYERS = 1 << 2
+DELTA_REMOVED_PLAYERS = 1 << 3
+DELTA_BOMBS_ADDED = 1 << 4
+DELTA_BOMBS_REMOVED = 1 << 5
+
+PLAYER_ALIVE = 1 << 0
+PLAYER_READY = 1 << 1
+PLAYER_HAS_COLOR = 1 << 2
+
+NO_STRING = 0xFFFF
+
+_HEADER = struct.Struct("<BIBf")
+_SIZE = struct.Struct("<HH")
+_POINT = struct.Struct("<HH")
+_TILE = struct.Struct("<HHB")
+_PLAYER = struct.Struct("<16sHHBBBB")
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_MOVE = struct.Struct("<Bbb")
+_VIEW = struct.Struct("<HHHH")
+
+_INPUT_TYPES = {MSG_PLACE_BOMB: "place_bomb", MSG_READY: "ready", MSG_RESYNC: "resync"}
+
+# --- Вспомогательные функции ---
+def _pack_str(parts, value):
+    if value is None:
+        parts.append(_U16.pack(NO_STRING))
+        return
+    data = value.encode("utf-8")
+    if len(data) > NO_STRING - 1:
+        # Обрезаем по границе символа: недописанный хвост UTF-8 отбрасывается
+        data = data[:NO_STRING - 1].decode("utf-8", "ignore").encode("utf-8")
+    parts.append(_U16.pack(len(data)))
+    parts.append(data)
+
+def _unpack_str(buf, offset):
+    (length,) = _U16.unpack_from(buf, offset)
+    offset += _U16.size
+    if length == NO_STRING:
+        return None, offset
+    return bytes(buf[offset:offset + length]).decode("utf-8"), offset + length
+
+def _pack_time(value):
+    return math.nan if value is None else value
+
+def _unpack_time(value):
+    return None if math.isnan(value) else value
+
+def _color_byte(value):
+    return max(0, min(255, round(value * 255)))
+
+def _pack_player(parts, player):
+    flags = (PLAYER_ALIVE if player["alive"] else 0) | (PLAYER_READY if player["ready"] else 0)
+    color = player.get("color")
+    r = g = b = 0
+    if color:
+        flags |= PLAYER_HAS_COLOR
+        r, g, b = _color_byte(color["red"]), _color_byte(color["green"]), _color_byte(color["blue"])
+    parts.append(_PLAYER.pack(uuid.UUID(player["id"]).bytes, player["x"], player["y"], flags, r, g, b))
+    _pack_str(parts, player["name"])
+
+def _unpack_player(buf, offset):
+    raw_id, x, y, flags, r, g, b = _PLAYER.unpack_from(buf, offset)
+    name, offset = _unpack_str(buf, offset + _PLAYER.size)
+    player = {"id": str(uuid.UUID(bytes=raw_id)), "name": name, "x": x, "y": y,
+              "alive": bool(flags & PLAYER_ALIVE), "ready": bool(flags & PLAYER_READY)}
+    if flags & PLAYER_HAS_COLOR:
+        player["color"] = {"red": r / 255, "green": g / 255, "blue": b / 255}
+    return player, offset
+
+def _pack_players(parts, players):
+    parts.append(_U16.pack(len(players)))
+    for player in players:
+        _pack_player(parts, player)
+
+def _unpack_players(buf, offset):
+    (count,) = _U16.unpack_from(buf, offset)
+    offset += _U16.size
+    players = []
+    for _ in range(count):
+        player, offset = _unpack_player(buf, offset)
+        players.append(player)
+    return players, offset
+
+def _pack_points(parts, points):
+    parts.append(_U16.pack(len(points)))
+    parts.extend(_POINT.pack(p["x"], p["y"]) for p in points)
+
+def _unpack_points(buf, offset):
+    (count,) = _U16.unpack_from(buf, offset)
+    offset += _U16.size
+    points = [{"x": x, "y": y} for x, y in _POINT.iter_unpack(buf[offset:offset + count * _POINT.size])]
+    return points, offset + count * _POINT.size
+
+# --- Сервер -> клиент ---
+def encode_keyframe(state):
+    """Кодирует полный game_state (словарь из Game.get_state() с полем seq)."""
+    game_map = state["map"]
+    height = len(game_map)
+    width = len(game_map[0]) if height else 0
+    parts = [_HEADER.pack(MSG_KEYFRAME, state["seq"], GAME_STATES.index(state["state"]), _pack_time(state["time_remaining"]))]
+    _pack_str(parts, state["winner"])
+    parts.append(_SIZE.pack(width, height))
+    parts.append("".join("".join(row) for row in game_map).encode("ascii"))
+    _pack_players(parts, state["players"])
+    _pack_points(parts, state["bombs"])
+    view = state.get("view")
+    if view is not None:
+        parts.append(_VIEW.pack(view["x"], view["y"], view["map_width"], view["map_height"]))
+    return b"".join(parts)
+
+def encode_delta(delta):
+    """Кодирует словарь дельты из DeltaTracker.build()."""
+    flags = 0
+    if "state" in delta: flags |= DELTA_META
+    if "tiles" in delta: flags |= DELTA_TILES
+    if "players" in delta: flags |= DELTA_PLAYERS
+    if "removed_players" in delta: flags |= DELTA_REMOVED_PLAYERS
+    if "bombs_added" in delta: flags |= DELTA_BOMBS_ADDED
+    if "bombs_removed" in delta: flags |= DELTA_BOMBS_REMOVED
+
+    parts = [_HEADER.pack(MSG_DELTA, delta["seq"], flags, _pack_time(delta["time_remaining"]))]
+    if flags & DELTA_META:
+        parts.append(_U8.pack(GAME_STATES.index(delta["state"])))
+        _pack_str(parts, delta["winner"])
+    if flags & DELTA_TILES:
+        parts.append(_U16.pack(len(delta["tiles"])))
+        parts.extend(_TILE.pack(x, y, ord(tile)) for x, y, tile in delta["tiles"])
+    if flags & DELTA_PLAYERS:
+        _pack_players(parts, delta["players"])
+    if flags & DELTA_REMOVED_PLAYERS:
+        parts.append(_U16.pack(len(delta["removed_players"])))
+        parts.extend(uuid.UUID(pid).bytes for pid in delta["removed_players"])
+    if flags & DELTA_BOMBS_ADDED:
+        _pack_points(parts, delta["bombs_added"])
+    if flags & DELTA_BOMBS_REMOVED:
+        _pack_points(parts, delta["bombs_removed"])
+    return b"".join(parts)
+
+def encode_events(events):
+    """Кодирует пачку explosion_event из Game.take_events()."""
+    parts = [_U8.pack(MSG_EXPLOSIONS), _U16.pack(len(events))]
+    for event in events:
+        _pack_points(parts, event["payload"]["cells"])
+    return b"".join(parts)
+
+def decode_server_message(buf):
+    """Обратное преобразование для клиентов и инструментов: байты -> JSON-совместимое сообщение."""
+    msg_type = buf[0]
+    if msg_type == MSG_EXPLOSIONS:
+        (count,) = _U16.unpack_from(buf, 1)
+        offset, events = 1 + _U16.size, []
+        for _ in range(count):
+            cells, offset = _unpack_points(buf, offset)
+            events.append({"type": "explosion_event", "payload": {"cells": cells}})
+        return events
+
+    _, seq, byte, time_remaining = _HEADER.unpack_from(buf, 0)
+    offset = _HEADER.size
+    if msg_type == MSG_KEYFRAME:
+        winner, offset = _unpack_str(buf, offset)
+        width, height = _SIZE.unpack_from(buf, offset)
+        offset += _SIZE.size
+        cells = bytes(buf[offset:offset + width * height]).decode("ascii")
+        offset += width * height
+        players, offset = _unpack_players(buf, offset)
+        bombs, offset = _unpack_points(buf, offset)
+        state = {"state": GAME_STATES[byte], "winner": winner, "time_remaining": _unpack_time(time_remaining),
+                 "map": [list(cells[y * width:(y + 1) * width]) for y in range(height)],
+                 "players": players, "bombs": bombs, "seq": seq}
+        if len(buf) >= offset + _VIEW.size:
+            x, y, map_width, map_height = _VIEW.unpack_from(buf, offset)
+            state["view"] = {"x": x, "y": y, "map_width": map_width, "map_height": map_height}
+        return {"type": "game_state", "payload": state}
+
+    if msg_type == MSG_DELTA:
+        flags, delta = byte, {"seq": seq, "time_remaining": _unpack_time(time_remaining)}
+        if flags & DELTA_META:
+            delta["state"] = GAME_STATES[buf[offset]]
+            delta["winner"], offset = _unpack_str(buf, offset + 1)
+        if flags & DELTA_TILES:
+            (count,) = _U16.unpack_from(buf, offset)
+            offset += _U16.size
+            end = offset + count * _TILE.size
+            delta["tiles"] = [[x, y, chr(tile)] for x, y, tile in _TILE.iter_unpack(buf[offset:end])]
+            offset = end
+        if flags & DELTA_PLAYERS:
+            delta["players"], offset = _unpack_players(buf, offset)
+        if flags & DELTA_REMOVED_PLAYERS:
+            (count,) = _U16.unpack_from(buf, offset)
+            offset += _U16.size
+            delta["removed_players"] = [str(uuid.UUID(bytes=bytes(buf[offset + i * 16:offset + (i + 1) * 16]))) for i in range(count)]
+            offset += count * 16
+        if flags & DELTA_BOMBS_ADDED:
+            delta["bombs_added"], offset = _unpack_points(buf, offset)
+        if flags & DELTA_BOMBS_REMOVED:
+            delta["bombs_removed"], offset = _unpack_points(buf, offset)
+        return {"type": "game_state_delta", "payload": delta}
+
+    raise ValueError(f"Неизвестный тип бинарного сообщения: {msg_type}")
+
+def expand_view(state):
+    """Ключевой кадр окна большой карты (поле view) -> карта полного размера.
+
+    Клетки вне окна неизвестны и заполняются пустотой; дельты используют
+    координаты всей карты и дальше накладываются как обычно.
+    """
+    view = state.pop("view", None)
+    if view is None: return
+    game_map = [[' '] * view["map_width"] for _ in range(view["map_height"])]
+    for dy, row in enumerate(state["map"]):
+        game_map[view["y"] + dy][view["x"]:view["x"] + len(row)] = row
+    state["map"] = game_map
+
+def apply_delta(state, delta):
+    """Накладывает game_state_delta на снимок (как apply_state_delta в client/main.py)."""
+    state["seq"], state["time_remaining"] = delta["seq"], delta.get("time_remaining")
+    if "state" in delta:
+        state["state"], state["winner"] = delta["state"], delta.get("winner")
+    for x, y, tile in delta.get("tiles", []):
+        state["map"][y][x] = tile
+    if "players" in delta or "removed_players" in delta:
+        players = {p["id"]: p for p in state.get("players", [])}
+        for pid in delta.get("removed_players", []):
+            players.pop(pid, None)
+        for player in delta.get("players", []):
+            players[player["id"]] = player
+        state["players"] = list(players.values())
+    if "bombs_added" in delta or "bombs_removed" in delta:
+        removed = {(b["x"], b["y"]) for b in delta.get("bombs_removed", [])}
+        state["bombs"] = [b for b in state.get("bombs", []) if (b["x"], b["y"]) not in removed] + delta.get("bombs_added", [])
+
+# --- Клиент -> сервер ---
+def encode_input(action):
+    if action["type"] == "move":
+        message = _MOVE.pack(MSG_MOVE, action["dx"], action["dy"])
+        if "seq" in action: message += _U32.pack(action["seq"])
+        return message
+    for msg_type, name in _INPUT_TYPES.items():
+        if action["type"] == name:
+            return _U8.pack(msg_type)
+    raise ValueError(f"Действие нельзя закодировать: {action['type']}")
+
+def decode_input(buf):
+    """Байты ввода -> словарь действия в том же виде, что и JSON-ввод."""
+    if not buf:
+        raise ValueError("Пустое сообщение")
+    msg_type = buf[0]
+    if msg_type == MSG_MOVE:
+        _, dx, dy = _MOVE.unpack_from(buf, 0)
+        action = {"type": "move", "dx": dx, "dy": dy}
+        if len(buf) >= _MOVE.size + _U32.size:
+            (action["seq"],) = _U32.unpack_from(buf, _MOVE.size)
+        return action
+    if msg_type in _INPUT_TYPES:
+        return {"type": _INPUT_TYPES[msg_type]}
+    raise ValueError(f"Неизвестный тип ввода: {msg_type}")
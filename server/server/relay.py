@@ -0,0 +1,128 @@
+"""Ретранслятор для наблюдателей: одна подписка на комнату - сколько угодно зрителей.
+
+Запуск из папки server/:
+    python3 server/relay.py --room <id комнаты> --port 8766
+    python3 server/relay.py --upstream ws://game-host:8765 --port 8766
+
+Ретранслятор подключается к игровому серверу как один наблюдатель (дельты в
+бинарном формате) и восстанавливает из потока полное состояние. Зрители
+подключаются к нему так же, как к серверу ({"type": "join", "role": "spectator",
+"delta": ..., "encoding": ...}) и получают те же сообщения: ключевой кадр при
+входе и после отставания, дальше дельты. Каждый кадр кодируется один раз на
+формат, а игровой процесс видит одного клиента, сколько бы ни было зрителей.
+"""
+import argparse
+import asyncio
+import json
+import logging
+
+import websockets
+
+import protocol
+from main import ClientConnection, send_frame, setup_logging
+
+log = logging.getLogger("bomberman.relay")
+
+RECONNECT_DELAY = 2 # Секунд между попытками переподключиться к серверу
+
+class Relay:
+    def __init__(self, upstream_uri, room=None):
+        self.upstream_uri = upstream_uri
+        self.room = room # После первого подключения - комната, которую выдал сервер
+        self.viewers = set() # ClientConnection зрителей
+        self.state = None # Последнее полное состояние (game_state с seq); None - ждем ключевой кадр
+        self.events = [] # Взрывы, пришедшие до следующего кадра состояния
+
+    async def run_upstream(self):
+        while True:
+            try:
+                async with websockets.connect(self.upstream_uri) as websocket:
+                    await websocket.send(json.dumps({"type": "join", "role": "spectator", "room": self.room,
+                                                     "delta": True, "encoding": "binary"}))
+                    await self._consume(websocket)
+            except (OSError, websockets.exceptions.ConnectionClosed) as e:
+                log.warning("Связь с сервером потеряна (%s), переподключение через %s сек.", e, RECONNECT_DELAY)
+            # После переподключения seq начнется заново - всем зрителям нужен ключевой кадр
+            self.state, self.events = None, []
+            for viewer in self.viewers:
+                viewer.needs_keyframe = True
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _consume(self, websocket):
+        async for message in websocket:
+            if isinstance(message, str):
+                data = json.loads(message)
+                if data.get("type") == "assign_room":
+                    self.room = data["payload"]
+                    log.info("Подписка на комнату '%s'.", self.room)
+                continue
+
+            data = protocol.decode_server_message(message)
+            if isinstance(data, list):
+                self.events.extend(data)
+            elif data["type"] == "game_state":
+                self.state = data["payload"]
+                self._publish(None)
+            elif self.state is not None:
+                delta = data["payload"]
+                if delta["seq"] != self.state["seq"] + 1:
+                    log.warning("Пропуск в потоке (seq %d после %d), запрошен ключевой кадр.", delta["seq"], self.state["seq"])
+                    self.state = None
+                    await websocket.send(protocol.encode_input({"type": "resync"}))
+                    continue
+                protocol.apply_delta(self.state, delta)
+                self._publish(delta)
+
+    def _publish(self, delta):
+        events, self.events = self.events, []
+        if self.viewers:
+            send_frame(list(self.viewers), events, self.state["seq"], delta, lambda: self.state)
+
+    async def handle_viewer(self, websocket):
+        connection = None
+        try:
+            data = json.loads(await websocket.recv())
+            if not isinstance(data, dict) or data.get("type") != "join": return
+            encoding = "binary" if data.get("encoding") == "binary" else "json"
+            connection = ClientConnection(websocket, delta=bool(data.get("delta")), encoding=encoding)
+            connection.send(json.dumps({"type": "assign_room", "payload": self.room}))
+            self.viewers.add(connection)
+            log.debug("Зритель %s подключился, всего %d.", connection.label, len(self.viewers))
+            # Зрители ничего не присылают, кроме запросов ключевого кадра
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    is_resync = message[:1] == bytes([protocol.MSG_RESYNC])
+                else:
+                    data = json.loads(message)
+                    is_resync = isinstance(data, dict) and data.get("type") == "resync"
+                if is_resync:
+                    connection.needs_keyframe = True
+        except (websockets.exceptions.ConnectionClosed, json.JSONDecodeError):
+            pass
+        finally:
+            if connection is not None:
+                self.viewers.discard(connection)
+                connection.close()
+
+async def main(args):
+    relay = Relay(args.upstream, args.room)
+    asyncio.create_task(relay.run_upstream())
+    async with websockets.serve(relay.handle_viewer, args.host, args.port):
+        log.info("Ретранслятор %s -> ws://%s:%s", args.upstream, args.host, args.port)
+        await asyncio.Future()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ретранслятор потока комнаты для наблюдателей")
+    parser.add_argument("--upstream", default="ws://localhost:8765", help="адрес игрового сервера")
+    parser.add_argument("--room", help="id комнаты (по умолчанию сервер выберет сам)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    log_listener = setup_logging()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        log.info("Ретранслятор остановлен.")
+    finally:
+        log_listener.stop()
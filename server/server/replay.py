@@ -0,0 +1,350 @@
+"""Запись и просмотр повторов матчей.
+
+Каждый матч (от перезапуска Game до следующего) пишется в отдельный файл
+только на дозапись: ввод игроков по тикам, случайные бомбы эндгейма, входы
+и выходы игроков и периодические полные снимки Game - точки перемотки.
+Все остальное детерминировано и пересчитывается симуляцией.
+
+Запуск из папки server/:
+    python3 server/replay.py replays/<файл>.replay              # сводка и прогон до конца
+    python3 server/replay.py replays/<файл>.replay --seek 1800  # состояние на тике
+    python3 server/replay.py replays/<файл>.replay --verify     # сверка со снимками
+
+Формат: сигнатура MAGIC, затем записи "B тип, I тик, данные":
+    HEADER    I длина + JSON (карта, комната, номера игроков на начало матча)
+    SNAPSHOT  I длина + zlib(JSON из Game.snapshot())
+    INPUTS    H число + (H номер игрока, B действие, [h dx, h dy для хода])
+    BOMB      H x, H y
+    JOIN      I длина + JSON (номер, id, имя, цвет)
+    LEAVE     H номер игрока
+    END       без данных: тик, на котором матч закончился (перезапуск или закрытие комнаты)
+Записи JOIN/LEAVE/INPUTS с тиком T применяются между update() тиков T и T+1,
+снимок с тиком T - состояние сразу после update() тика T.
+"""
+import argparse
+import bisect
+import hashlib
+import importlib
+import json
+import os
+import random
+import re
+import struct
+import time
+import zlib
+
+MAGIC = b"BMRP\x01"
+
+REC_HEADER = 0x01
+REC_SNAPSHOT = 0x02
+REC_INPUTS = 0x03
+REC_BOMB = 0x04
+REC_JOIN = 0x05
+REC_LEAVE = 0x06
+REC_END = 0x07
+
+ACTION_MOVE = 0
+ACTION_PLACE_BOMB = 1
+ACTION_READY = 2
+_ACTION_CODES = {"move": ACTION_MOVE, "place_bomb": ACTION_PLACE_BOMB, "ready": ACTION_READY}
+
+SNAPSHOT_INTERVAL = 600 # Тиков между снимками во время игры (10 секунд при 60 Гц)
+FLUSH_BYTES = 64 * 1024 # Буфер сбрасывается на диск при таком размере (и на каждом снимке)
+
+_RECORD = struct.Struct("<BI")
+_LENGTH = struct.Struct("<I")
+_U16 = struct.Struct("<H")
+_POINT = struct.Struct("<HH")
+_ACTION = struct.Struct("<HB")
+_MOVE = struct.Struct("<hh")
+
+# --- Запись ---
+def file_stem(room_id):
+    """Начало имени файла повтора. id комнаты проверяется при join, но путь к файлу
+    не должен от этого зависеть: лишние символы заменяются, а чтобы разные id не
+    совпали, к замененному добавляется хэш исходного."""
+    room_id = str(room_id)
+    stem = re.sub(r"[^A-Za-z0-9_-]", "_", room_id)[:32]
+    if stem != room_id:
+        stem += "-" + hashlib.sha1(room_id.encode("utf-8")).hexdigest()[:8]
+    return stem
+
+class ReplayRecorder:
+    """Копит записи матча в памяти и пишет их на диск пачками.
+
+    Game вызывает методы record_* сам, если у него есть recorder; без
+    записи это одна проверка на None в нескольких местах.
+    """
+    def __init__(self, directory, room_id, snapshot_interval=SNAPSHOT_INTERVAL, flush_bytes=FLUSH_BYTES):
+        self.directory = directory
+        self.room_id = room_id
+        self.snapshot_interval = snapshot_interval
+        self.flush_bytes = flush_bytes
+        self.matches = 0
+        self.game = None
+        self.path = None
+        self.buffer = bytearray()
+        self.slots = {} # id игрока -> номер в записи
+        self.started = False # Матч дошел до IN_PROGRESS; записи лобби без игры не сохраняются
+        self.last_snapshot_tick = 0
+        self.skipped_inputs = 0 # Ходов, которые не влезли в формат записи (Game их все равно не применит)
+
+    def attach(self, game):
+        game.recorder = self
+        self.game = game
+        self.match_started(game)
+
+    def close(self):
+        self._finish()
+
+    # --- Вызовы из Game ---
+    def match_started(self, game):
+        """Game.reset(): предыдущий матч закрывается, начинается новый файл."""
+        self._finish()
+        self.matches += 1
+        self.path = os.path.join(self.directory, f"{file_stem(self.room_id)}-{time.strftime('%Y%m%d-%H%M%S')}-{self.matches:03d}.replay")
+        self.buffer = bytearray(MAGIC)
+        self.slots = {player_id: slot for slot, player_id in enumerate(game.players)}
+        self.started = False
+        header = {"room": self.room_id, "map": game.map_info.name, "layout": game.map_info.rows(),
+                  "slots": {slot: player_id for player_id, slot in self.slots.items()}, "time": time.time()}
+        self._append_blob(REC_HEADER, game.tick, json.dumps(header).encode("utf-8"))
+        self._snapshot(game)
+
+    def record_join(self, tick, player):
+        slot = self.slots[player.id] = len(self.slots)
+        info = {"slot": slot, "id": player.id, "name": player.name, "color": player.color}
+        self._append_blob(REC_JOIN, tick, json.dumps(info).encode("utf-8"))
+
+    def record_leave(self, tick, player_id):
+        slot = self.slots.get(player_id)
+        if slot is not None:
+            self.buffer += _RECORD.pack(REC_LEAVE, tick) + _U16.pack(slot)
+
+    def record_inputs(self, tick, pending):
+        parts, count = [], 0
+        for player_id, actions in pending.items():
+            slot = self.slots.get(player_id)
+            if slot is None: continue
+            for action in actions:
+                code = _ACTION_CODES.get(action.get("type"))
+                if code is None: continue # Неизвестные действия Game все равно игнорирует
+                if code == ACTION_MOVE:
+                    # Запись идет внутри тика: ввод, который не упаковать, пропускается, а не роняет цикл
+                    try:
+                        move = _MOVE.pack(action["dx"], action["dy"])
+                    except (KeyError, struct.error):
+                        self.skipped_inputs += 1
+                        continue
+                    parts.append(_ACTION.pack(slot, code) + move)
+                else:
+                    parts.append(_ACTION.pack(slot, code))
+                count += 1
+        if count:
+            self.buffer += _RECORD.pack(REC_INPUTS, tick) + _U16.pack(count) + b"".join(parts)
+
+    def record_bomb(self, tick, x, y):
+        self.buffer += _RECORD.pack(REC_BOMB, tick) + _POINT.pack(x, y)
+
+    def tick_done(self, game):
+        if game.state == "IN_PROGRESS":
+            self.started = True
+            if game.tick - self.last_snapshot_tick >= self.snapshot_interval:
+                self._snapshot(game)
+                self._flush()
+        elif len(self.buffer) >= self.flush_bytes:
+            self._flush()
+
+    # --- Внутреннее ---
+    def _append_blob(self, kind, tick, data):
+        self.buffer += _RECORD.pack(kind, tick) + _LENGTH.pack(len(data)) + data
+
+    def _snapshot(self, game):
+        self.last_snapshot_tick = game.tick
+        self._append_blob(REC_SNAPSHOT, game.tick, zlib.compress(json.dumps(game.snapshot()).encode("utf-8")))
+
+    def _flush(self):
+        if not self.buffer: return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(self.buffer)
+        self.buffer = bytearray()
+
+    def _finish(self):
+        if self.path is None: return
+        self.buffer += _RECORD.pack(REC_END, self.game.tick)
+        # Лобби, где так и не начали играть, не сохраняем (если еще ничего не записано на диск)
+        if self.started or os.path.exists(self.path):
+            self._flush()
+        self.buffer = bytearray()
+        self.path = None
+
+# --- Чтение ---
+class ReplayReader:
+    """Разбирает файл повтора и восстанавливает Game на любом тике.
+
+    Снимки распаковываются лениво: seek() берет ближайший снимок не позже
+    нужного тика и досчитывает симуляцию вперед по записанному вводу.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f"Не файл повтора: {path}")
+        self.path = path
+        self.size = len(data)
+        self.header = None
+        self.slots = {} # номер игрока -> id
+        self.snapshot_ticks = []
+        self._snapshots = [] # сжатые снимки в порядке snapshot_ticks
+        self.timeline = {} # тик -> [("join", info) | ("leave", id) | ("input", id, действие), ...]
+        self.bombs = {} # тик -> [(x, y), ...] случайные бомбы эндгейма
+        self.last_tick = 0
+        self._parse(data, len(MAGIC))
+        self.first_tick = self.snapshot_ticks[0]
+
+    def _parse(self, data, offset):
+        while offset < len(data):
+            kind, tick = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            self.last_tick = max(self.last_tick, tick)
+            if kind in (REC_HEADER, REC_SNAPSHOT, REC_JOIN):
+                (length,) = _LENGTH.unpack_from(data, offset)
+                offset += _LENGTH.size
+                blob = data[offset:offset + length]
+                offset += length
+                if kind == REC_HEADER:
+                    self.header = json.loads(blob)
+                    self.slots.update({int(slot): player_id for slot, player_id in self.header["slots"].items()})
+                elif kind == REC_SNAPSHOT:
+                    self.snapshot_ticks.append(tick)
+                    self._snapshots.append(blob)
+                else:
+                    info = json.loads(blob)
+                    self.slots[info["slot"]] = info["id"]
+                    self.timeline.setdefault(tick, []).append(("join", info))
+            elif kind == REC_LEAVE:
+                (slot,) = _U16.unpack_from(data, offset)
+                offset += _U16.size
+                self.timeline.setdefault(tick, []).append(("leave", self.slots[slot]))
+            elif kind == REC_INPUTS:
+                (count,) = _U16.unpack_from(data, offset)
+                offset += _U16.size
+                entries = self.timeline.setdefault(tick, [])
+                for _ in range(count):
+                    slot, code = _ACTION.unpack_from(data, offset)
+                    offset += _ACTION.size
+                    if code == ACTION_MOVE:
+                        dx, dy = _MOVE.unpack_from(data, offset)
+                        offset += _MOVE.size
+                        action = {"type": "move", "dx": dx, "dy": dy}
+                    else:
+                        action = {"type": "place_bomb" if code == ACTION_PLACE_BOMB else "ready"}
+                    entries.append(("input", self.slots[slot], action))
+            elif kind == REC_END:
+                pass
+            elif kind == REC_BOMB:
+                self.bombs.setdefault(tick, []).append(_POINT.unpack_from(data, offset))
+                offset += _POINT.size
+            else:
+                raise ValueError(f"Неизвестный тип записи {kind} по смещению {offset - _RECORD.size}")
+
+    def snapshot(self, index):
+        return json.loads(zlib.decompress(self._snapshots[index]))
+
+    def _new_game(self, snapshot):
+        # main импортируется лениво: сервер пишет повторы, не загружая код чтения
+        from main import Game, MapDescriptor
+        descriptor = MapDescriptor(self.header["map"], self.header["layout"])
+        game = Game(maps={descriptor.name: descriptor}, rng=random.Random(0))
+        game.load_snapshot(snapshot)
+        # Случайность заменяется записанным: бомбы эндгейма берутся из файла,
+        # а перезапуск означает конец матча (следующий матч - в другом файле)
+        game.spawn_random_bomb = lambda: self._spawn_recorded_bombs(game)
+        game.reset = lambda: None
+        return game
+
+    def _spawn_recorded_bombs(self, game):
+        for x, y in self.bombs.get(game.tick, ()):
+            game.place_bomb(x, y)
+
+    def seek(self, tick):
+        """Game в состоянии сразу после update() тика tick (не дальше конца записи)."""
+        tick = min(tick, self.last_tick)
+        index = max(0, bisect.bisect_right(self.snapshot_ticks, tick) - 1)
+        game = self._new_game(self.snapshot(index))
+        self.play(game, tick)
+        return game
+
+    def play(self, game, until_tick, on_tick=None):
+        """Шагает game вперед до until_tick; on_tick(game, события взрывов) - после каждого тика."""
+        while game.tick < until_tick:
+            for entry in self.timeline.get(game.tick, ()):
+                if entry[0] == "join":
+                    info = entry[1]
+                    game.add_player(info["id"], info["name"], color=info["color"])
+                elif entry[0] == "leave":
+                    game.remove_player(entry[1])
+                else:
+                    game.handle_input(entry[1], entry[2])
+            game.update()
+            events = game.take_events()
+            if on_tick is not None:
+                on_tick(game, events)
+        return game
+
+    def run(self, on_tick=None):
+        """Прогоняет весь матч без ожидания и возвращает Game на последнем тике."""
+        return self.play(self.seek(self.first_tick), self.last_tick, on_tick)
+
+    def verify(self):
+        """Сверяет каждый снимок с результатом симуляции от предыдущего; возвращает тики расхождений."""
+        mismatches = []
+        for index in range(1, len(self.snapshot_ticks)):
+            game = self._new_game(self.snapshot(index - 1))
+            self.play(game, self.snapshot_ticks[index])
+            if game.snapshot() != self.snapshot(index):
+                mismatches.append(self.snapshot_ticks[index])
+        return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Просмотр и проверка повтора матча")
+    parser.add_argument("path")
+    parser.add_argument("--seek", type=int, help="показать состояние на этом тике")
+    parser.add_argument("--verify", action="store_true", help="сверить симуляцию со всеми снимками")
+    args = parser.parse_args()
+
+    reader = ReplayReader(args.path)
+    # _new_game() импортирует main лениво; загружаем его (с websockets и asyncio) заранее,
+    # чтобы время импорта не попало в замеры --seek и прогона ниже
+    importlib.import_module("main")
+    ticks = reader.last_tick - reader.first_tick
+    print(f"Комната {reader.header['room']}, карта {reader.header['map']}: тики {reader.first_tick}-{reader.last_tick} "
+          f"({ticks} тиков), снимков {len(reader.snapshot_ticks)}, игроков {len(reader.slots)}, "
+          f"{reader.size} байт ({reader.size / max(1, ticks):.1f} байт/тик)")
+
+    if args.seek is not None:
+        start = time.perf_counter()
+        game = reader.seek(args.seek)
+        elapsed = time.perf_counter() - start
+        print(f"Тик {game.tick} восстановлен за {elapsed * 1000:.1f} мс: состояние {game.state}, "
+              f"живых {sum(p.alive for p in game.players.values())}, бомб {len(game.bombs)}, кирпичей {game.bricks_left}")
+        for y in range(game.map_info.height):
+            print(game.row(y))
+    else:
+        explosions = []
+        start = time.perf_counter()
+        game = reader.run(lambda game, events: explosions.extend(events))
+        elapsed = time.perf_counter() - start
+        print(f"Прогон: {ticks} тиков за {elapsed * 1000:.1f} мс, взрывов {len(explosions)}, "
+              f"итог {game.state}, победитель {game.winner}")
+
+    if args.verify:
+        mismatches = reader.verify()
+        if mismatches:
+            print(f"Расхождения со снимками на тиках: {mismatches}")
+        else:
+            print(f"Все {len(reader.snapshot_ticks) - 1} снимков воспроизведены точно")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Некорректный ввод клиента не должен ронять общий игровой цикл.
+
+Запуск из папки server/:
+    python3 -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import main
+import protocol
+import replay
+from headless import HeadlessSimulation, ScriptedInputs, make_synthetic_map
+
+main.log.disabled = True
+
+MALFORMED = [
+    {"foo": 1},
+    {"type": "move"},
+    {"type": "move", "dx": 1},
+    {"type": "move", "dx": 0.5, "dy": 0},
+    {"type": "move", "dx": "1", "dy": 0},
+    {"type": "move", "dx": True, "dy": 0},
+    {"type": "move", "dx": 40000, "dy": 0},
+    {"type": "move", "dx": 2, "dy": 0},
+    {"type": "teleport"},
+    ["move"],
+    None,
+]
+
+class MalformedInputTest(unittest.TestCase):
+    def setUp(self):
+        descriptor = make_synthetic_map(21, 15, players=2, seed=1)
+        self.sim = HeadlessSimulation({descriptor.name: descriptor}, players=2, seed=0, inputs=ScriptedInputs({}))
+        self.game = self.sim.game
+        for player_id in self.sim.player_ids:
+            self.game.queue_input(player_id, {"type": "ready"})
+        self.sim.step()
+        self.assertEqual(self.game.state, "IN_PROGRESS")
+
+    def test_malformed_actions_are_dropped(self):
+        player_id = self.sim.player_ids[0]
+        for action in MALFORMED:
+            with self.subTest(action=action):
+                self.assertEqual(self.game.queue_input(player_id, action), "dropped")
+        self.assertEqual(self.game.pending_inputs.get(player_id, []), [])
+        self.sim.step()
+
+    def test_valid_actions_still_apply(self):
+        player = self.game.players[self.sim.player_ids[0]]
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            self.game.queue_input(player.id, {"type": "move", "dx": dx, "dy": dy, "seq": 7})
+            self.sim.step()
+        self.assertEqual(player.input_seq, 7)
+        self.assertEqual(self.game.queue_input(player.id, {"type": "place_bomb"}), "queued")
+        self.sim.step()
+        self.assertIn((player.x, player.y), self.game.bombs)
+
+class CoalescingTest(unittest.TestCase):
+    def setUp(self):
+        descriptor = make_synthetic_map(21, 15, players=2, brick_density=0, seed=1)
+        self.sim = HeadlessSimulation({descriptor.name: descriptor}, players=2, seed=0, inputs=ScriptedInputs({}))
+        self.game = self.sim.game
+        for player_id in self.sim.player_ids:
+            self.game.queue_input(player_id, {"type": "ready"})
+        self.sim.step()
+
+    def test_distinct_moves_in_one_tick_all_apply(self):
+        player = self.game.players[self.sim.player_ids[0]]
+        # Шаг вдоль столбов: из клетки с нечетными координатами по x, затем по y
+        dx = 1 if player.x + 2 < self.game.map_info.width else -1
+        dy = 1 if player.y + 2 < self.game.map_info.height else -1
+        start = (player.x, player.y)
+        self.assertEqual(self.game.queue_input(player.id, {"type": "move", "dx": dx, "dy": 0, "seq": 1}), "queued")
+        self.assertEqual(self.game.queue_input(player.id, {"type": "move", "dx": 0, "dy": dy, "seq": 2}), "queued")
+        self.sim.step()
+        self.assertEqual((player.x, player.y), (start[0] + dx, start[1]))
+        self.assertEqual(player.input_seq, 2)
+
+    def test_identical_moves_merge(self):
+        player_id = self.sim.player_ids[0]
+        self.assertEqual(self.game.queue_input(player_id, {"type": "move", "dx": 1, "dy": 0, "seq": 1}), "queued")
+        self.assertEqual(self.game.queue_input(player_id, {"type": "move", "dx": 1, "dy": 0, "seq": 2}), "merged")
+        self.assertEqual(self.game.pending_inputs[player_id], [{"type": "move", "dx": 1, "dy": 0, "seq": 2}])
+
+    def test_distinct_moves_are_capped(self):
+        player_id = self.sim.player_ids[0]
+        steps = [(1, 0), (0, 1)] * main.MAX_INPUTS_PER_TICK
+        results = [self.game.queue_input(player_id, {"type": "move", "dx": dx, "dy": dy}) for dx, dy in steps]
+        self.assertEqual(results.count("queued"), main.MAX_INPUTS_PER_TICK)
+        self.assertIn("dropped", results)
+        self.assertEqual(len(self.game.pending_inputs[player_id]), main.MAX_INPUTS_PER_TICK)
+
+class RecorderInputTest(unittest.TestCase):
+    def test_recorder_skips_moves_it_cannot_encode(self):
+        descriptor = make_synthetic_map(21, 15, players=2, seed=1)
+        sim = HeadlessSimulation({descriptor.name: descriptor}, players=2, seed=0, inputs=ScriptedInputs({}))
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = replay.ReplayRecorder(directory, "test")
+            recorder.attach(sim.game)
+            player_id = sim.player_ids[0]
+            self.assertEqual(sim.game.queue_input(player_id, {"type": "move", "dx": 40000, "dy": 0}), "dropped")
+            sim.step()
+            # Даже если такой ход минует проверку в queue_input, запись его пропускает
+            recorder.record_inputs(sim.game.tick, {player_id: [{"type": "move", "dx": 40000, "dy": 0}, {"type": "move"}, {"type": "ready"}]})
+            self.assertEqual(recorder.skipped_inputs, 2)
+            recorder.close()
+
+class RoomIdTest(unittest.TestCase):
+    def test_room_id_whitelist(self):
+        for room_id in ("lobby", "bots-0", "a_B-9", "x" * 32):
+            self.assertTrue(main.is_valid_room_id(room_id), room_id)
+        for room_id in ("../escaped", "a/b", "", "x" * 33, "комната", 5, None, ["a"]):
+            self.assertFalse(main.is_valid_room_id(room_id), room_id)
+
+    def test_replay_file_stays_in_directory(self):
+        descriptor = make_synthetic_map(21, 15, players=2, seed=1)
+        sim = HeadlessSimulation({descriptor.name: descriptor}, players=2, seed=0, inputs=ScriptedInputs({}))
+        with tempfile.TemporaryDirectory() as directory:
+            for room_id in ("../escaped", "a/b"):
+                recorder = replay.ReplayRecorder(directory, room_id)
+                recorder.attach(sim.game)
+                self.assertEqual(os.path.dirname(recorder.path), directory)
+                recorder.close()
+            self.assertNotEqual(replay.file_stem("a/b"), replay.file_stem("a_b"))
+
+class PlayerInfoTest(unittest.TestCase):
+    def test_name_and_color_are_cleaned(self):
+        self.assertEqual(main.clean_player_name(None), "Аноним")
+        self.assertEqual(main.clean_player_name(12345), "12345")
+        self.assertEqual(len(main.clean_player_name("я" * 1000)), main.MAX_NAME_LENGTH)
+        self.assertIsNone(main.clean_player_color("red"))
+        self.assertEqual(main.clean_player_color({"red": "abc", "green": 7, "blue": float("nan")}),
+                         {"red": 1.0, "green": 1.0, "blue": 0.0})
+        self.assertEqual(main.clean_player_color({"red": -1, "green": 0.5, "blue": True}),
+                         {"red": 0.0, "green": 0.5, "blue": 0.0})
+
+    def test_binary_keyframe_with_dirty_join(self):
+        descriptor = make_synthetic_map(21, 15, players=2, seed=1)
+        sim = HeadlessSimulation({descriptor.name: descriptor}, players=0, seed=0, inputs=ScriptedInputs({}))
+        player_id = "00000000-0000-0000-0000-000000000001"
+        sim.game.add_player(player_id, main.clean_player_name(["x"]), color=main.clean_player_color({"red": "abc"}))
+        state = sim.game.get_state()
+        state["seq"] = 1
+        decoded = protocol.decode_server_message(protocol.encode_keyframe(state))["payload"]
+        self.assertEqual(decoded["players"][0]["name"], "['x']")
+
+    def test_long_string_is_cut_on_character_boundary(self):
+        parts = []
+        protocol._pack_str(parts, "я" * 40000)
+        data = b"".join(parts)
+        value, _ = protocol._unpack_str(data, 0)
+        self.assertLessEqual(len(data) - 2, protocol.NO_STRING - 1)
+        self.assertEqual(value, "я" * ((protocol.NO_STRING - 1) // 2))
+
+if __name__ == "__main__":
+    unittest.main()